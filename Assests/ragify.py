@@ -64,7 +64,6 @@ def embed_pages_and_save(pages, base_name):
     with open(pkl_path, "wb") as f:
         pickle.dump({
             "index": index,
-            "embeddings": embeddings,
             "texts": texts,
             "pages": pages
         }, f)
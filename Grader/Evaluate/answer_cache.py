@@ -0,0 +1,244 @@
+"""
+Semantic cache of grades, per question.
+
+Each answer graded by the model is stored in the AnswerCache collection with
+the embedding of its normalized text, keyed by the subject, the exam, the
+question text and its total marks:
+
+    {"key", "subject", "exam_type", "qno", "usn", "answer", "length",
+     "embedding", "score", "feedback", "created_at"}
+
+A later answer to the same question whose cosine similarity to a stored one is
+at least ANSWER_CACHE_SIMILARITY, and that is not much shorter than it, gets
+that grade instead of a model call. Every reuse is written to AnswerCacheAudit,
+where the teacher can review it and override the score.
+
+Entries expire ANSWER_CACHE_TTL seconds after they were stored, and only the
+newest ANSWER_CACHE_MAX_ENTRIES of a question are kept and compared against.
+Editing a question's rubric drops its entries (forget_question); a new question
+text, total or rubric otherwise changes the key, and the entries stored under
+the old one are dropped with the first grade stored under the new one.
+
+The cache is opt-in: per request with "answer_cache": true, per question with
+the same field on the question, or for everything with ANSWER_CACHE_ENABLED.
+"""
+import datetime
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING
+
+REUSE_NOTE = "(Graded the same as a near-identical answer to this question.)"
+
+# Collections whose indexes exist, by full name: one sync and one async
+# collection object per event loop point at the same server collection
+_indexed = set()
+
+
+def now():
+    # A BSON date, so the TTL index can expire the entry
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def normalize_answer(answer):
+    """Lowercased words of an answer (a string or the OCR'd parts of one), punctuation dropped."""
+    if isinstance(answer, list):
+        answer = " ".join(str(part) for part in answer)
+    return " ".join(re.sub(r"[^\w\s]", " ", str(answer or "").lower()).split())
+
+
+def cache_key(subject, exam_type, question, total, rubric=None):
+    """
+    Answers are only compared with answers to the same question, marked out of
+    the same total against the same rubric (so editing a rubric starts afresh).
+    """
+    digest = hashlib.sha256()
+    for field in (subject, exam_type, normalize_answer(question), total, rubric):
+        digest.update(str(field or "").encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def cache_enabled(data, q):
+    return bool(q.get("answer_cache", data.get("answer_cache", settings.ANSWER_CACHE_ENABLED)))
+
+
+def embed(text):
+    from ragpipe.views import get_embedding_model
+
+    # Unit vectors, so a dot product is the cosine similarity
+    return get_embedding_model().encode([text], normalize_embeddings=True)[0]
+
+
+def best_match(vector, length, entries, threshold=None, min_length_ratio=None):
+    """
+    The stored entry most similar to an answer of `length` words with embedding
+    `vector`, if it clears the threshold. Returns (entry, similarity) or (None, best similarity).
+    """
+    import numpy as np
+
+    if threshold is None:
+        threshold = settings.ANSWER_CACHE_SIMILARITY
+    if min_length_ratio is None:
+        min_length_ratio = settings.ANSWER_CACHE_MIN_LENGTH_RATIO
+
+    if not entries:
+        return None, 0.0
+    similarities = np.asarray([entry["embedding"] for entry in entries], dtype="float32") @ vector
+    best = int(np.argmax(similarities))
+    similarity = float(similarities[best])
+    entry = entries[best]
+    # A much shorter answer can embed close to a complete one while missing points
+    if similarity >= threshold and length >= entry["length"] * min_length_ratio:
+        return entry, similarity
+    return None, similarity
+
+
+class CachedAnswer:
+    """One answer on its way through the cache: looked up first, stored once the model has graded it."""
+
+    def __init__(self, data, q, total):
+        self.subject = data.get("subject")
+        self.exam_type = data.get("exam_type")
+        self.usn = data.get("usn")
+        self.qno = q.get("qno")
+        self.question = q.get("question")
+        self.text = normalize_answer(q.get("answer"))
+        self.key = cache_key(self.subject, self.exam_type, self.question, total, q.get("rubric"))
+        self.vector = None
+
+    @property
+    def length(self):
+        return len(self.text.split())
+
+    def _reused(self, idx, entry, similarity):
+        audit = {
+            "key": self.key,
+            "subject": self.subject,
+            "exam_type": self.exam_type,
+            "qno": self.qno,
+            "question": self.question,
+            "usn": self.usn,
+            "answer": self.text,
+            "source_id": entry["_id"],
+            "source_usn": entry.get("usn"),
+            "source_answer": entry.get("answer"),
+            "similarity": round(similarity, 4),
+            "score": entry["score"],
+            "feedback": entry["feedback"],
+            "overridden": False,
+            "created_at": time.time(),
+        }
+        return audit, {
+            "index": idx,
+            "question": self.question,
+            "score": entry["score"],
+            "feedback": f"{entry['feedback']} {REUSE_NOTE}",
+        }
+
+    def _entry(self, result):
+        return {
+            "key": self.key,
+            "subject": self.subject,
+            "exam_type": self.exam_type,
+            "qno": self.qno,
+            "usn": self.usn,
+            "answer": self.text,
+            "length": self.length,
+            "embedding": [float(value) for value in self.vector],
+            "score": result["score"],
+            "feedback": result.get("feedback") or "",
+            "created_at": now(),
+        }
+
+    def _stale(self):
+        """Entries of this question stored under another key, i.e. before its text, total or rubric changed."""
+        if self.qno is None:
+            # Questions without a number can only be told apart by their key
+            return None
+        return {"subject": self.subject, "exam_type": self.exam_type, "qno": self.qno, "key": {"$ne": self.key}}
+
+    def _candidates(self, entries):
+        return entries.find({"key": self.key}).sort("created_at", -1).limit(settings.ANSWER_CACHE_MAX_ENTRIES)
+
+    def lookup(self, entries, audits, idx):
+        """The cached result entry for this answer, or None to grade it with the model."""
+        _ensure_indexes(entries, audits)
+        if not self.text:
+            return None
+        self.vector = embed(self.text)
+        match, similarity = best_match(self.vector, self.length, list(self._candidates(entries)))
+        if match is None:
+            return None
+        audit, result = self._reused(idx, match, similarity)
+        audit_id = audits.insert_one(audit).inserted_id
+        result["cached"] = {"audit_id": str(audit_id), "similarity": audit["similarity"]}
+        return result
+
+    def store(self, entries, result):
+        """Remember a grade the model gave, for the answers that come after it."""
+        if self.vector is None or "error" in result or result.get("score") is None:
+            return
+        entries.insert_one(self._entry(result))
+        stale = self._stale()
+        if stale:
+            entries.delete_many(stale)
+        overflow = entries.find({"key": self.key}, {"_id": 1}).sort("created_at", -1).skip(
+            settings.ANSWER_CACHE_MAX_ENTRIES)
+        ids = [entry["_id"] for entry in overflow]
+        if ids:
+            entries.delete_many({"_id": {"$in": ids}})
+
+    async def alookup(self, entries, audits, idx):
+        from asgiref.sync import sync_to_async
+
+        await _aensure_indexes(entries, audits)
+        if not self.text:
+            return None
+        # Encoding is CPU work, keep it off the event loop
+        self.vector = await sync_to_async(embed, thread_sensitive=False)(self.text)
+        stored = await self._candidates(entries).to_list()
+        match, similarity = best_match(self.vector, self.length, stored)
+        if match is None:
+            return None
+        audit, result = self._reused(idx, match, similarity)
+        audit_id = (await audits.insert_one(audit)).inserted_id
+        result["cached"] = {"audit_id": str(audit_id), "similarity": audit["similarity"]}
+        return result
+
+    async def astore(self, entries, result):
+        if self.vector is None or "error" in result or result.get("score") is None:
+            return
+        await entries.insert_one(self._entry(result))
+        stale = self._stale()
+        if stale:
+            await entries.delete_many(stale)
+        overflow = entries.find({"key": self.key}, {"_id": 1}).sort("created_at", -1).skip(
+            settings.ANSWER_CACHE_MAX_ENTRIES)
+        ids = [entry["_id"] for entry in await overflow.to_list()]
+        if ids:
+            await entries.delete_many({"_id": {"$in": ids}})
+
+
+def forget_question(entries, subject, exam_type, qno):
+    """Drop every cached grade of one question, e.g. once its rubric has changed."""
+    return entries.delete_many({"subject": subject, "exam_type": exam_type, "qno": qno}).deleted_count
+
+
+def _ensure_indexes(entries, audits):
+    if entries.full_name not in _indexed:
+        entries.create_index([("key", ASCENDING), ("created_at", DESCENDING)])
+        entries.create_index([("subject", ASCENDING), ("exam_type", ASCENDING), ("qno", ASCENDING)])
+        entries.create_index("created_at", expireAfterSeconds=settings.ANSWER_CACHE_TTL)
+        audits.create_index([("subject", ASCENDING), ("exam_type", ASCENDING), ("qno", ASCENDING)])
+        _indexed.add(entries.full_name)
+
+
+async def _aensure_indexes(entries, audits):
+    if entries.full_name not in _indexed:
+        await entries.create_index([("key", ASCENDING), ("created_at", DESCENDING)])
+        await entries.create_index([("subject", ASCENDING), ("exam_type", ASCENDING), ("qno", ASCENDING)])
+        await entries.create_index("created_at", expireAfterSeconds=settings.ANSWER_CACHE_TTL)
+        await audits.create_index([("subject", ASCENDING), ("exam_type", ASCENDING), ("qno", ASCENDING)])
+        _indexed.add(entries.full_name)
@@ -0,0 +1,128 @@
+"""
+Question-major grading of a class: every student's answer to one question is
+graded together, up to BATCH_GRADING_SIZE answers per model call.
+
+The calls for a question share one prompt prefix (the instructions, the
+question and its rubric), so the provider can reuse it and every answer is
+marked against the same wording. Answers are listed under ids (A1, A2, ...),
+never under the student's USN, and each grade is routed back to its student
+by that id. An answer the reply leaves out, grades out of range or grades
+twice is graded on its own instead.
+"""
+import json
+import re
+
+from django.conf import settings
+
+BATCH_GRADING_PROMPT = """Grade each student's answer to the question below out of {total_marks} marks{against}.
+Judge every answer on its own and by the same standard; be conservative.
+Respond in JSON format, with one entry for every answer id:
+{{
+    "grades": [
+        {{"id": "<answer id>", "score": <numeric_score>, "feedback": "<a sentence or two on points made and missed>"}}
+    ]
+}}
+
+Question: {question}
+{rubric}
+Answers:
+"""
+
+
+def answer_text(answer):
+    if isinstance(answer, list):
+        return "\n\n".join(str(part) for part in answer)
+    return str(answer or "")
+
+
+def batch_prefix(question, rubric, total_marks):
+    """Everything before the answers, the same for every call that grades this question."""
+    if rubric:
+        return BATCH_GRADING_PROMPT.format(
+            total_marks=total_marks, question=question, rubric=f"Rubric:\n{rubric}\n",
+            against=" against the rubric, awarding marks only for the key points an answer makes")
+    return BATCH_GRADING_PROMPT.format(total_marks=total_marks, question=question, rubric="", against="")
+
+
+def batch_prompt(prefix, answers):
+    return prefix + "".join(f"\n[A{n}]\n{answer_text(answer)}\n" for n, answer in enumerate(answers, start=1))
+
+
+def question_groups(students):
+    """
+    Every student's answers grouped by question, as lists of entries
+    {"usn", "index", "q"}, where index is the question's place in that
+    student's list (and so in their results).
+    """
+    groups = {}
+    for student in students:
+        for idx, q in enumerate(student.get('questions') or []):
+            key = (q.get('qno', idx + 1), q.get('question'), q.get('rubric'))
+            groups.setdefault(key, []).append({'usn': student['usn'], 'index': idx, 'q': q})
+    return list(groups.values())
+
+
+def batches(entries):
+    """
+    Split one question's answers into model calls of at most BATCH_GRADING_SIZE
+    answers and about BATCH_GRADING_MAX_ANSWER_TOKENS tokens of answer text.
+    """
+    batch = []
+    tokens = 0
+    for entry in entries:
+        size = len(answer_text(entry['q'].get('answer'))) // 4 + 1
+        if batch and (len(batch) >= settings.BATCH_GRADING_SIZE
+                      or tokens + size > settings.BATCH_GRADING_MAX_ANSWER_TOKENS):
+            yield batch
+            batch = []
+            tokens = 0
+        batch.append(entry)
+        tokens += size
+    if batch:
+        yield batch
+
+
+def parse_grades(content, count, total_marks):
+    """
+    {position: (score, feedback)} of the answers the reply graded; anything
+    unusable is left out, as is an answer graded more than once.
+    """
+    match = re.search(r'\{.*\}', content or "", re.DOTALL)
+    if not match:
+        return {}
+    try:
+        grades = json.loads(match.group(0)).get('grades')
+    except (ValueError, AttributeError):
+        return {}
+
+    parsed = {}
+    repeated = set()
+    for grade in grades if isinstance(grades, list) else []:
+        if not isinstance(grade, dict):
+            continue
+        found = re.fullmatch(r'\s*\[?A?(\d+)\]?\s*', str(grade.get('id', '')))
+        score = grade.get('score')
+        if not found or isinstance(score, bool) or not isinstance(score, (int, float)):
+            continue
+        position = int(found.group(1)) - 1
+        if position in parsed:
+            repeated.add(position)
+        elif 0 <= position < count and 0 <= score <= total_marks:
+            parsed[position] = (score, grade.get('feedback') or "")
+    for position in repeated:
+        del parsed[position]
+    return parsed
+
+
+def feedback_item(entry, result, total_marks):
+    """A graded answer as the student's stored feedback (see Student.views.clean_feedbacks)."""
+    q = entry['q']
+    answer = q.get('answer')
+    return {
+        'qno': q.get('qno', entry['index'] + 1),
+        'question': q.get('question'),
+        'answer': " ".join(answer) if isinstance(answer, list) else str(answer or ""),
+        'feedback': result.get('feedback') or "",
+        'score': result['score'],
+        'total': total_marks,
+    }
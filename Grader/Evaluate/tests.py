@@ -1,3 +1,50 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from Evaluate.batch import parse_grades
+
+
+def reply(*grades):
+    return json.dumps({'grades': list(grades)})
+
+
+class ParseGradesTests(SimpleTestCase):
+    def test_routes_grades_by_answer_id(self):
+        content = reply({'id': 'A2', 'score': 4, 'feedback': 'good'}, {'id': 'A1', 'score': 1.5, 'feedback': 'thin'})
+        self.assertEqual(parse_grades(content, 2, 5), {0: (1.5, 'thin'), 1: (4, 'good')})
+
+    def test_accepts_bracketed_and_bare_ids(self):
+        content = reply({'id': '[A1]', 'score': 2}, {'id': '2', 'score': 3}, {'id': ' A3 ', 'score': 0})
+        self.assertEqual(parse_grades(content, 3, 5), {0: (2, ''), 1: (3, ''), 2: (0, '')})
+
+    def test_missing_ids_are_left_out(self):
+        content = reply({'id': 'A1', 'score': 3}, {'score': 4}, {'id': 'B2', 'score': 4}, {'id': '', 'score': 4})
+        self.assertEqual(parse_grades(content, 3, 5), {0: (3, '')})
+
+    def test_ids_outside_the_batch_are_left_out(self):
+        content = reply({'id': 'A0', 'score': 3}, {'id': 'A4', 'score': 3}, {'id': 'A3', 'score': 2})
+        self.assertEqual(parse_grades(content, 3, 5), {2: (2, '')})
+
+    def test_answers_graded_twice_are_left_out(self):
+        content = reply({'id': 'A1', 'score': 2}, {'id': 'A2', 'score': 4}, {'id': 'A1', 'score': 5},
+                        {'id': '[A1]', 'score': 2})
+        self.assertEqual(parse_grades(content, 2, 5), {1: (4, '')})
+
+    def test_out_of_range_scores_are_left_out(self):
+        content = reply({'id': 'A1', 'score': -1}, {'id': 'A2', 'score': 5.5}, {'id': 'A3', 'score': 5})
+        self.assertEqual(parse_grades(content, 3, 5), {2: (5, '')})
+
+    def test_non_numeric_scores_are_left_out(self):
+        content = reply({'id': 'A1', 'score': '4'}, {'id': 'A2', 'score': True}, {'id': 'A3', 'score': None})
+        self.assertEqual(parse_grades(content, 3, 5), {})
+
+    def test_malformed_json_grades_nothing(self):
+        for content in ('{"grades": [{"id": "A1", "score": 3}', 'not json at all', '', None,
+                        '{"grades": "A1: 3"}', '[{"id": "A1", "score": 3}]', '{"grades": [3, "A1"]}'):
+            with self.subTest(content=content):
+                self.assertEqual(parse_grades(content, 2, 5), {})
+
+    def test_json_wrapped_in_prose_is_read(self):
+        content = 'Here are the grades:\n' + reply({'id': 'A1', 'score': 3, 'feedback': 'ok'}) + '\nDone.'
+        self.assertEqual(parse_grades(content, 1, 5), {0: (3, 'ok')})
@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from .views import evaluate_answer
+from .views import (answer_cache_audit, evaluate_answer, evaluate_answer_async, evaluate_class, evaluate_class_async,
+                    override_cached_grade)
 
 urlpatterns = [
-    path('script/', evaluate_answer, name='evaluate_answer'),
-]
\ No newline at end of file
+    path('script/', evaluate_answer_async if settings.ASYNC_VIEWS else evaluate_answer, name='evaluate_answer'),
+    path('class/', evaluate_class_async if settings.ASYNC_VIEWS else evaluate_class, name='evaluate_class'),
+    path('cache/audit/', answer_cache_audit, name='answer_cache_audit'),
+    path('cache/override/', override_cached_grade, name='override_cached_grade'),
+]
@@ -1,52 +1,94 @@
+import asyncio
+import contextvars
+import logging
 import requests
 import json
 import re
-from django.http import JsonResponse
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.conf import settings
+from pymongo import MongoClient
 
-@csrf_exempt
-def evaluate_answer(request):
-    if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+from Evaluate.answer_cache import CachedAnswer, cache_enabled
+from Evaluate.batch import batch_prefix, batch_prompt, batches, feedback_item, parse_grades, question_groups
+from Grader.aio import get_http_client, get_mongo_db
+from Grader.analytics import abulk_upsert_feedback, bulk_upsert_feedback, upsert_feedback
+from Grader.metrics import increment, timed
+from Grader.ratelimit import estimate_tokens, get_scheduler, model_priority, priority_from_request
+from Grader.responses import JsonResponse, loads
 
-    try:
-        data = json.loads(request.body)
-        exam_type = data.get('exam_type')  # optional, can be used in prompt if needed
-        subject = data.get('subject')      # optional, can be used in prompt if needed
-        questions = data.get('questions')
-        total = data.get('total')  # optional, can be used in prompt if needed
-        if not questions or not isinstance(questions, list):
-            return JsonResponse({'error': 'Missing or invalid "questions" array'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': 'Invalid JSON payload', 'details': str(e)}, status=400)
+logger = logging.getLogger(__name__)
 
-    results = []
+mongo_client = MongoClient(settings.MONGO_URI)
+db = mongo_client['GraderPro']
+answer_cache_collection = db['AnswerCache']
+answer_cache_audit_collection = db['AnswerCacheAudit']
+students_collection = db['students']
+analytics_collection = db['ClassAnalytics']
 
-    for idx, q in enumerate(questions):
-        question = q.get('question')
-        answer = q.get('answer')
-        total_marks = total
+RUBRIC_GRADING_PROMPT = """Grade the student's answer out of {total_marks} marks against the rubric.
+Award marks only for the rubric's key points that the answer makes; be conservative.
+Respond in JSON format:
+{{
+    "score": <numeric_score>,
+    "feedback": "<one or two sentences on the points made and missed>"
+}}
 
-        if not all([question, answer, total_marks]):
-            results.append({
-                'index': idx,
-                'error': 'Missing one or more required fields (question, answer, total_marks)'
-            })
-            continue
+Question: {question}
+Rubric:
+{rubric}
 
-        try:
-            total_marks = int(total_marks)
-        except ValueError:
-            results.append({
-                'index': idx,
-                'error': 'total_marks must be an integer'
-            })
-            continue
+Student's answer:
+{answer}
+"""
+
+
+def grading_request(idx, q, total):
+    """Return (payload, headers) for the model call that grades q, or (None, error_entry)."""
+    question = q.get('question')
+    answer = q.get('answer')
+    total_marks = total
+
+    if not all([question, answer, total_marks]):
+        return None, {
+            'index': idx,
+            'error': 'Missing one or more required fields (question, answer, total_marks)'
+        }
+
+    try:
+        total_marks = int(total_marks)
+    except ValueError:
+        return None, {
+            'index': idx,
+            'error': 'total_marks must be an integer'
+        }
+
+    headers = groq_headers()
 
-        prompt = ""  # Add any specific prompt text here if needed, or pass from client
+    rubric = q.get('rubric')
+    if rubric:
+        if isinstance(answer, list):
+            answer = "\n\n".join(str(part) for part in answer)
+        # Everything but the answer is the same for the whole class, so it leads the prompt
+        payload = {
+            "model": "llama3-70b-8192",
+            "messages": [{"role": "user", "content": RUBRIC_GRADING_PROMPT.format(
+                total_marks=total_marks, question=question, rubric=rubric, answer=answer)}],
+            "temperature": 0
+        }
+        return payload, headers
 
-        full_prompt = f"""
+    prompt = ""  # Add any specific prompt text here if needed, or pass from client
+
+    full_prompt = f"""
 {prompt}
 
 Question: {question}
@@ -60,70 +102,553 @@ Respond in JSON format:
 }}
 """
 
-        headers = {
-            "Authorization": f"Bearer {settings.GROQ_API_KEY}",
-            "Content-Type": "application/json"
+    payload = {
+        "model": "llama3-70b-8192",
+        "messages": [{"role": "user", "content": full_prompt}]
+    }
+    return payload, headers
+
+
+def grading_result(idx, question, response):
+    """Turn the model's HTTP response (requests or httpx) into a result entry."""
+    if response.status_code != 200:
+        try:
+            error_details = response.json()
+        except Exception:
+            error_details = response.text
+        return {
+            'index': idx,
+            'error': 'Groq API error',
+            'details': error_details,
+            'status_code': response.status_code
         }
 
-        payload = {
-            "model": "llama3-70b-8192",
-            "messages": [{"role": "user", "content": full_prompt}]
+    try:
+        content = response.json()['choices'][0]['message']['content']
+        # Extract JSON from the content (using regex)
+        json_str_match = re.search(r'\{.*\}', content, re.DOTALL)
+        if not json_str_match:
+            return {
+                'index': idx,
+                'error': 'Model response not in expected JSON format',
+                'response': content
+            }
+
+        json_str = json_str_match.group(0)
+        result = json.loads(json_str)
+        return {
+            'index': idx,
+            'question': question,
+            'score': result.get('score'),
+            'feedback': result.get('feedback')
         }
 
-        try:
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
+    except Exception as e:
+        return {
+            'index': idx,
+            'error': 'Failed to parse model response',
+            'details': str(e),
+            'response': content if 'content' in locals() else None
+        }
+
+
+@timed('grade_question')
+def grade_question(idx, q, total):
+    """Grade one question with the model and return its result entry."""
+    payload, headers = grading_request(idx, q, total)
+    if payload is None:
+        return headers
+
+    try:
+        response = get_scheduler(payload["model"]).call(
+            lambda: requests.post(
+                f"{settings.GROQ_BASE_URL}/openai/v1/chat/completions",
                 json=payload,
                 headers=headers,
                 timeout=30
+            ),
+            estimate_tokens(payload["messages"])
+        )
+    except requests.RequestException as e:
+        return {
+            'index': idx,
+            'error': f'Groq API request failed: {str(e)}'
+        }
+
+    return grading_result(idx, q.get('question'), response)
+
+
+def grade_or_reuse(idx, q, total, data):
+    """grade_question(), or the grade of a near-identical earlier answer when the answer cache is on."""
+    if not cache_enabled(data, q):
+        return grade_question(idx, q, total)
+
+    cached = CachedAnswer(data, q, total)
+    try:
+        with timed('answer_cache_lookup'):
+            result = cached.lookup(answer_cache_collection, answer_cache_audit_collection, idx)
+    except Exception as e:
+        # The cache only saves model calls; without it the answer is graded as usual
+        logger.warning(f"Answer cache lookup failed: {e}")
+        cached.vector = result = None
+    increment('answer_cache_requests', result='hit' if result else 'miss')
+    if result is None:
+        result = grade_question(idx, q, total)
+        cached.store(answer_cache_collection, result)
+    return result
+
+
+async def grade_question_async(idx, q, total):
+    payload, headers = grading_request(idx, q, total)
+    if payload is None:
+        return headers
+
+    client = get_http_client()
+    with timed('grade_question'):
+        try:
+            response = await get_scheduler(payload["model"]).acall(
+                lambda: client.post(
+                    f"{settings.GROQ_BASE_URL}/openai/v1/chat/completions",
+                    json=payload,
+                    headers=headers,
+                    timeout=30
+                ),
+                estimate_tokens(payload["messages"])
             )
-        except requests.RequestException as e:
-            results.append({
+        except httpx.HTTPError as e:
+            return {
                 'index': idx,
                 'error': f'Groq API request failed: {str(e)}'
-            })
+            }
+
+    return grading_result(idx, q.get('question'), response)
+
+
+async def grade_or_reuse_async(idx, q, total, data):
+    if not cache_enabled(data, q):
+        return await grade_question_async(idx, q, total)
+
+    db = get_mongo_db()
+    cached = CachedAnswer(data, q, total)
+    try:
+        with timed('answer_cache_lookup'):
+            result = await cached.alookup(db['AnswerCache'], db['AnswerCacheAudit'], idx)
+    except Exception as e:
+        logger.warning(f"Answer cache lookup failed: {e}")
+        cached.vector = result = None
+    increment('answer_cache_requests', result='hit' if result else 'miss')
+    if result is None:
+        result = await grade_question_async(idx, q, total)
+        await cached.astore(db['AnswerCache'], result)
+    return result
+
+
+def groq_headers():
+    return {
+        "Authorization": f"Bearer {settings.GROQ_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+def batch_grading_request(entries, total_marks):
+    q = entries[0]['q']
+    prompt = batch_prompt(batch_prefix(q.get('question'), q.get('rubric'), total_marks),
+                          [entry['q'].get('answer') for entry in entries])
+    return {
+        "model": settings.BATCH_GRADING_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0,
+        "response_format": {"type": "json_object"},
+        "max_completion_tokens": settings.BATCH_GRADING_TOKENS_PER_ANSWER * len(entries)
+    }
+
+
+def batch_content(response):
+    """The reply's text, or None when the call failed (its answers are then graded alone)."""
+    if response.status_code != 200:
+        logger.warning(f"Batch grading call failed with status {response.status_code}: {response.text[:200]}")
+        return None
+    try:
+        return response.json()['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError) as e:
+        logger.warning(f"Batch grading reply could not be read: {e}")
+        return None
+
+
+def batched_results(entries, content, total_marks):
+    """[(entry, result or None)], None for each answer the reply did not grade properly."""
+    grades = parse_grades(content, len(entries), total_marks) if content is not None else {}
+    increment('batch_graded_answers', result='batched', amount=len(grades))
+    increment('batch_graded_answers', result='alone', amount=len(entries) - len(grades))
+    results = []
+    for position, entry in enumerate(entries):
+        grade = grades.get(position)
+        if grade is None:
+            results.append((entry, None))
             continue
+        score, feedback = grade
+        results.append((entry, {
+            'index': entry['index'],
+            'qno': entry['q'].get('qno', entry['index'] + 1),
+            'question': entry['q'].get('question'),
+            'score': score,
+            'feedback': feedback,
+            'batched': True
+        }))
+    return results
+
+
+def grade_batch(entries, total_marks):
+    """Grade answers to one question in one model call. Returns [(entry, result)]."""
+    payload = batch_grading_request(entries, total_marks)
+    content = None
+    try:
+        with timed('grade_batch'):
+            response = get_scheduler(payload["model"]).call(
+                lambda: requests.post(
+                    f"{settings.GROQ_BASE_URL}/openai/v1/chat/completions",
+                    json=payload,
+                    headers=groq_headers(),
+                    timeout=60
+                ),
+                estimate_tokens(payload["messages"], payload["max_completion_tokens"])
+            )
+        content = batch_content(response)
+    except requests.RequestException as e:
+        logger.warning(f"Batch grading call failed: {e}")
+    return [(entry, result or grade_question(entry['index'], entry['q'], total_marks))
+            for entry, result in batched_results(entries, content, total_marks)]
 
-        if response.status_code != 200:
+
+async def grade_batch_async(entries, total_marks):
+    payload = batch_grading_request(entries, total_marks)
+    client = get_http_client()
+    content = None
+    try:
+        with timed('grade_batch'):
+            response = await get_scheduler(payload["model"]).acall(
+                lambda: client.post(
+                    f"{settings.GROQ_BASE_URL}/openai/v1/chat/completions",
+                    json=payload,
+                    headers=groq_headers(),
+                    timeout=60
+                ),
+                estimate_tokens(payload["messages"], payload["max_completion_tokens"])
+            )
+        content = batch_content(response)
+    except httpx.HTTPError as e:
+        logger.warning(f"Batch grading call failed: {e}")
+    results = batched_results(entries, content, total_marks)
+    graded_alone = iter(await asyncio.gather(*(grade_question_async(entry['index'], entry['q'], total_marks)
+                                               for entry, result in results if result is None)))
+    return [(entry, result or next(graded_alone)) for entry, result in results]
+
+
+def class_jobs(students):
+    """
+    [(question group, batch)] for the model calls that grade the class, and the
+    results of the answers that cannot be graded (no question or answer).
+    """
+    jobs = []
+    invalid = []
+    for group_no, entries in enumerate(question_groups(students)):
+        gradable = []
+        for entry in entries:
+            if entry['q'].get('question') and entry['q'].get('answer'):
+                gradable.append(entry)
+            else:
+                invalid.append((entry, {
+                    'index': entry['index'],
+                    'error': 'Missing one or more required fields (question, answer, total_marks)'
+                }))
+        jobs.extend((group_no, batch) for batch in batches(gradable))
+    return jobs, invalid
+
+
+def class_results(students, graded):
+    """Every student's results in the order of their questions"""
+    results = {student['usn']: [None] * len(student['questions']) for student in students}
+    for entry, result in graded:
+        results[entry['usn']][entry['index']] = result
+    return [{'usn': usn, 'results': student_results} for usn, student_results in results.items()]
+
+
+def stored_feedback(graded, total_marks):
+    """{usn: feedback items} of one question's graded answers, for bulk_upsert_feedback()"""
+    items = {}
+    for entry, result in graded:
+        if 'error' not in result and result.get('score') is not None:
+            items.setdefault(entry['usn'], []).append(feedback_item(entry, result, total_marks))
+    return items
+
+
+def failed_batch(batch, error):
+    """[(entry, result)] of a batch whose grading raised: an error for each of its answers."""
+    logger.error(f"Grading a batch of {len(batch)} answers failed: {error}")
+    increment('batch_graded_answers', result='failed', amount=len(batch))
+    return [(entry, {'index': entry['index'], 'error': f'Grading failed: {error}'}) for entry in batch]
+
+
+def grade_class(data, priority):
+    """
+    Grade every student's answers question by question, BATCH_GRADING_WORKERS
+    calls at a time. With "store", each question's grades are written to the
+    students' feedback as soon as all of them are in, in one bulk write. A
+    batch that raises gets an error for each of its answers; the other
+    batches' grades are kept.
+    """
+    total_marks = data['total']
+    jobs, graded = class_jobs(data['students'])
+    remaining = Counter(group_no for group_no, _ in jobs)
+    pending = defaultdict(list)
+    workers = max(1, min(settings.BATCH_GRADING_WORKERS, len(jobs)))
+    with model_priority(priority), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, grade_batch, batch, total_marks): (group_no, batch)
+            for group_no, batch in jobs
+        }
+        for future in as_completed(futures):
+            group_no, batch = futures[future]
             try:
-                error_details = response.json()
-            except Exception:
-                error_details = response.text
-            results.append({
-                'index': idx,
-                'error': 'Groq API error',
-                'details': error_details,
-                'status_code': response.status_code
-            })
+                pending[group_no].extend(future.result())
+            except Exception as e:
+                pending[group_no].extend(failed_batch(batch, e))
+            remaining[group_no] -= 1
+            if remaining[group_no]:
+                continue
+            # Written from this thread only, so no two writes of one student overlap
+            if data.get('store'):
+                bulk_upsert_feedback(students_collection, analytics_collection, data['subject'],
+                                     data['exam_type'], stored_feedback(pending[group_no], total_marks))
+            graded.extend(pending.pop(group_no))
+    return {'results': class_results(data['students'], graded), 'batches': len(jobs)}
+
+
+async def grade_class_async(data, priority):
+    total_marks = data['total']
+    jobs, graded = class_jobs(data['students'])
+    remaining = Counter(group_no for group_no, _ in jobs)
+    pending = defaultdict(list)
+    semaphore = asyncio.Semaphore(max(1, settings.BATCH_GRADING_WORKERS))
+
+    async def job(group_no, batch):
+        async with semaphore:
+            try:
+                return group_no, await grade_batch_async(batch, total_marks)
+            except Exception as e:
+                return group_no, failed_batch(batch, e)
+
+    with model_priority(priority):
+        tasks = [asyncio.create_task(job(group_no, batch)) for group_no, batch in jobs]
+    db = get_mongo_db()
+    for task in asyncio.as_completed(tasks):
+        group_no, results = await task
+        pending[group_no].extend(results)
+        remaining[group_no] -= 1
+        if remaining[group_no]:
             continue
+        if data.get('store'):
+            await abulk_upsert_feedback(db['students'], db['ClassAnalytics'], data['subject'],
+                                        data['exam_type'], stored_feedback(pending[group_no], total_marks))
+        graded.extend(pending.pop(group_no))
+    return {'results': class_results(data['students'], graded), 'batches': len(jobs)}
 
-        try:
-            content = response.json()['choices'][0]['message']['content']
-            # Extract JSON from the content (using regex)
-            json_str_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if not json_str_match:
-                results.append({
-                    'index': idx,
-                    'error': 'Model response not in expected JSON format',
-                    'response': content
-                })
-                continue
 
-            json_str = json_str_match.group(0)
-            result = json.loads(json_str)
-            results.append({
-                'index': idx,
-                'question': question,
-                'score': result.get('score'),
-                'feedback': result.get('feedback')
-            })
+def stream_results(questions, total, data, priority):
+    """Yield one NDJSON line per graded question as soon as it is ready."""
+    with model_priority(priority):
+        for idx, q in enumerate(questions):
+            yield json.dumps({'event': 'result', **grade_or_reuse(idx, q, total, data)}) + '\n'
+    yield json.dumps({'event': 'done', 'count': len(questions)}) + '\n'
 
-        except Exception as e:
-            results.append({
-                'index': idx,
-                'error': 'Failed to parse model response',
-                'details': str(e),
-                'response': content if 'content' in locals() else None
-            })
+
+async def stream_results_async(questions, total, data, priority):
+    """stream_results() with every question graded concurrently, still yielded in order."""
+    with model_priority(priority):
+        tasks = [asyncio.create_task(grade_or_reuse_async(idx, q, total, data)) for idx, q in enumerate(questions)]
+    try:
+        for task in tasks:
+            yield json.dumps({'event': 'result', **await task}) + '\n'
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield json.dumps({'event': 'done', 'count': len(questions)}) + '\n'
+
+
+def read_evaluation_request(request):
+    """Return (data, None) for a valid grading request, or (None, error_response)."""
+    if request.method != 'POST':
+        return None, JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    try:
+        data = loads(request.body)
+        exam_type = data.get('exam_type')  # optional, can be used in prompt if needed
+        subject = data.get('subject')      # optional, can be used in prompt if needed
+        questions = data.get('questions')
+        if not questions or not isinstance(questions, list):
+            return None, JsonResponse({'error': 'Missing or invalid "questions" array'}, status=400)
+    except Exception as e:
+        return None, JsonResponse({'error': 'Invalid JSON payload', 'details': str(e)}, status=400)
+    return data, None
+
+
+@csrf_exempt
+def evaluate_answer(request):
+    data, error = read_evaluation_request(request)
+    if error:
+        return error
+    questions = data['questions']
+    total = data.get('total')  # optional, can be used in prompt if needed
+
+    # Streaming mode: one JSON object per line, each question as soon as it is graded
+    if data.get('stream'):
+        return StreamingHttpResponse(
+            stream_results(questions, total, data, priority_from_request(request)),
+            content_type='application/x-ndjson'
+        )
+
+    results = [grade_or_reuse(idx, q, total, data) for idx, q in enumerate(questions)]
+
+    return JsonResponse({'results': results})
+
+
+@csrf_exempt
+async def evaluate_answer_async(request):
+    data, error = read_evaluation_request(request)
+    if error:
+        return error
+    questions = data['questions']
+    total = data.get('total')
+
+    if data.get('stream'):
+        return StreamingHttpResponse(
+            stream_results_async(questions, total, data, priority_from_request(request)),
+            content_type='application/x-ndjson'
+        )
+
+    results = await asyncio.gather(*(grade_or_reuse_async(idx, q, total, data) for idx, q in enumerate(questions)))
 
     return JsonResponse({'results': results})
+
+
+def audit_entry(audit):
+    return {
+        **{key: value for key, value in audit.items() if key not in ('_id', 'source_id', 'key')},
+        'audit_id': str(audit['_id']),
+        'source_id': str(audit['source_id']),
+    }
+
+
+def read_batch_request(request):
+    """Return (data, None) for a valid class grading request, or (None, error_response)."""
+    if request.method != 'POST':
+        return None, JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    try:
+        data = loads(request.body)
+        students = data.get('students')
+        if not students or not isinstance(students, list):
+            return None, JsonResponse({'error': 'Missing or invalid "students" array'}, status=400)
+        usns = [student['usn'] for student in students]
+        if not all(isinstance(student.get('questions'), list) for student in students):
+            return None, JsonResponse({'error': 'Every student needs a "questions" array'}, status=400)
+        data['total'] = int(data['total'])
+    except (KeyError, TypeError, ValueError) as e:
+        return None, JsonResponse({'error': 'Invalid class grading payload', 'details': str(e)}, status=400)
+
+    if len(set(usns)) != len(usns):
+        return None, JsonResponse({'error': 'Each student may only appear once'}, status=400)
+    if data.get('store') and not (data.get('subject') and data.get('exam_type')):
+        return None, JsonResponse({'error': 'subject and exam_type are required to store the grades'}, status=400)
+    return data, None
+
+
+@csrf_exempt
+def evaluate_class(request):
+    """
+    POST {"total", "students": [{"usn", "questions"}], ["subject", "exam_type", "store"]}:
+    grade a whole class question by question, several answers per model call
+    (see Evaluate/batch.py). Each student's results are in their questions' order.
+    """
+    data, error = read_batch_request(request)
+    if error:
+        return error
+    return JsonResponse(grade_class(data, priority_from_request(request)))
+
+
+@csrf_exempt
+async def evaluate_class_async(request):
+    data, error = read_batch_request(request)
+    if error:
+        return error
+    return JsonResponse(await grade_class_async(data, priority_from_request(request)))
+
+
+@csrf_exempt
+def answer_cache_audit(request):
+    """GET ?subject=&exam_type=[&qno=][&overridden=0|1]: the grades reused from the answer cache, newest first."""
+    subject = request.GET.get('subject')
+    exam_type = request.GET.get('exam_type')
+    if not subject or not exam_type:
+        return JsonResponse({'error': 'subject and exam_type are required'}, status=400)
+
+    query = {'subject': subject, 'exam_type': exam_type}
+    try:
+        if request.GET.get('qno'):
+            query['qno'] = int(request.GET['qno'])
+    except ValueError:
+        return JsonResponse({'error': 'qno must be an integer'}, status=400)
+    if request.GET.get('overridden') is not None:
+        query['overridden'] = request.GET['overridden'].lower() in ('1', 'true', 'yes')
+
+    audits = answer_cache_audit_collection.find(query).sort('created_at', -1).limit(settings.ANSWER_CACHE_AUDIT_LIMIT)
+    return JsonResponse({'reuses': [audit_entry(audit) for audit in audits]})
+
+
+@csrf_exempt
+@require_POST
+def override_cached_grade(request):
+    """
+    POST {"audit_id", "score", ["feedback"], ["invalidate"]}: replace a reused
+    grade in the student's feedback. With invalidate, the cached grade it came
+    from is no longer reused for later answers.
+    """
+    try:
+        data = loads(request.body)
+        audit_id = ObjectId(data['audit_id'])
+        score = float(data['score'])
+    except (KeyError, TypeError, ValueError, InvalidId) as e:
+        return JsonResponse({'error': 'audit_id and a numeric score are required', 'details': str(e)}, status=400)
+
+    audit = answer_cache_audit_collection.find_one({'_id': audit_id})
+    if not audit:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    feedback = data.get('feedback') or audit['feedback']
+
+    answer_cache_audit_collection.update_one({'_id': audit_id}, {'$set': {
+        'overridden': True,
+        'override_score': score,
+        'override_feedback': feedback,
+        'overridden_at': time.time(),
+    }})
+
+    # The student's stored feedback for that question, through the class analytics so they stay in step
+    student = students_collection.find_one(
+        {'usn': audit['usn'], 'subject': audit['subject'], 'exam_type': audit['exam_type']},
+        {'feedbacks': {'$elemMatch': {'qno': audit['qno']}}})
+    items = (student or {}).get('feedbacks') or []
+    student_updated = bool(items)
+    if student_updated:
+        upsert_feedback(students_collection, analytics_collection, audit['usn'], audit['subject'],
+                        audit['exam_type'], [{**items[0], 'score': score, 'feedback': feedback}])
+
+    invalidated = False
+    if data.get('invalidate'):
+        invalidated = answer_cache_collection.delete_one({'_id': audit['source_id']}).deleted_count > 0
+
+    return JsonResponse({
+        'audit_id': str(audit_id),
+        'score': score,
+        'student_updated': student_updated,
+        'invalidated': invalidated,
+    })
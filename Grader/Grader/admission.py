@@ -0,0 +1,281 @@
+"""
+Admission control for the expensive endpoints.
+
+Each class of endpoint in ADMISSION_LIMITS (answer-script OCR, RAG ingestion,
+diagram evaluation, class grading) runs at most `concurrency` requests at a
+time and queues at most `queue` more, first come first served. Heavy requests,
+running or queued, never take more than (1 - ADMISSION_RESERVED_SHARE) of
+ADMISSION_WORKER_SLOTS between them; the rest of the workers stay free for
+everything else, the Student reads above all (and the hops the heavy pipelines
+make back into this server).
+
+A request whose class's queue is full is turned away at once with 429; one
+that finds the heavy share used up, or waits longer than its class's `timeout`
+in the queue, gets 503. Both carry Retry-After, estimated from how long the
+class's requests have been taking. The limits are per process.
+"""
+import asyncio
+import collections
+import itertools
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from Grader.metrics import increment, observe
+from Grader.responses import JsonResponse, after_streaming
+
+# Guards every class's counters and queue, and the heavy total
+_condition = threading.Condition()
+_async_waiters = {}
+_counter = itertools.count()
+_heavy = 0
+_endpoints = {}
+
+# Weight of the newest request in a class's running mean duration
+_MEAN_WEIGHT = 0.2
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, error, retry_after):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+
+
+class Endpoint:
+    """The running requests and the queue of one class of endpoint."""
+
+    def __init__(self, name, paths, concurrency, queue, timeout):
+        self.name = name
+        self.paths = tuple(paths)
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = collections.deque()
+        self.mean_seconds = None
+
+    def retry_after(self):
+        # Seconds until the requests already queued have had their turn, at the class's pace
+        mean = self.mean_seconds or 1.0
+        return max(1, math.ceil(mean * (len(self.waiting) + 1) / max(self.concurrency, 1)))
+
+    def record(self, seconds):
+        if self.mean_seconds is None:
+            self.mean_seconds = seconds
+        else:
+            self.mean_seconds += _MEAN_WEIGHT * (seconds - self.mean_seconds)
+
+
+def heavy_slots():
+    return max(1, int(settings.ADMISSION_WORKER_SLOTS * (1 - settings.ADMISSION_RESERVED_SHARE)))
+
+
+def endpoint_for(path):
+    """The Endpoint that admits requests for this path, or None when it is never held back."""
+    if not settings.ADMISSION_CONTROL:
+        return None
+    for name, limits in settings.ADMISSION_LIMITS.items():
+        if path.startswith(tuple(limits['paths'])):
+            with _condition:
+                if name not in _endpoints:
+                    _endpoints[name] = Endpoint(name, **limits)
+                return _endpoints[name]
+    return None
+
+
+class Slot:
+    """One admitted request. Release it (once, later calls do nothing) when the response is done."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.held = True
+
+    def release(self):
+        global _heavy
+        with _condition:
+            if not self.held:
+                return
+            self.held = False
+            self.endpoint.running -= 1
+            self.endpoint.record(time.perf_counter() - self.start)
+            _heavy -= 1
+            _wake()
+
+
+def _wake():
+    # Called with the condition held: let the head of each queue check for a free slot
+    _condition.notify_all()
+    for loop, woken in _async_waiters.values():
+        loop.call_soon_threadsafe(woken.set)
+
+
+def _arrive(endpoint):
+    """Called with the condition held: a Slot, or a ticket to wait in the queue with."""
+    global _heavy
+    if endpoint.running < endpoint.concurrency and not endpoint.waiting and _heavy < heavy_slots():
+        endpoint.running += 1
+        _heavy += 1
+        increment('admission_requests', endpoint=endpoint.name, result='admitted')
+        return Slot(endpoint), None
+    if len(endpoint.waiting) >= endpoint.queue:
+        increment('admission_requests', endpoint=endpoint.name, result='queue_full')
+        raise AdmissionRejected(429, f"Too many {endpoint.name} requests in progress, try again later",
+                                endpoint.retry_after())
+    if _heavy >= heavy_slots():
+        increment('admission_requests', endpoint=endpoint.name, result='capacity')
+        raise AdmissionRejected(503, "The server is at capacity, try again later", endpoint.retry_after())
+    ticket = next(_counter)
+    endpoint.waiting.append(ticket)
+    # A queued request already holds a worker under WSGI, so it counts against the heavy share
+    _heavy += 1
+    return None, ticket
+
+
+def _try_promote(endpoint, ticket):
+    """Called with the condition held: a Slot once the ticket is at the head and a slot is free."""
+    if endpoint.waiting[0] != ticket or endpoint.running >= endpoint.concurrency:
+        return None
+    endpoint.waiting.popleft()
+    endpoint.running += 1
+    increment('admission_requests', endpoint=endpoint.name, result='queued')
+    # The next ticket may fit too, when several slots came free at once
+    _wake()
+    return Slot(endpoint)
+
+
+def _leave_queue(endpoint, ticket):
+    # Called with the condition held, for a ticket that gives up its place
+    global _heavy
+    endpoint.waiting.remove(ticket)
+    _heavy -= 1
+    _wake()
+
+
+def _time_out(endpoint, ticket):
+    _leave_queue(endpoint, ticket)
+    increment('admission_requests', endpoint=endpoint.name, result='timeout')
+    return AdmissionRejected(503, f"Timed out waiting for a {endpoint.name} slot, try again later",
+                             endpoint.retry_after())
+
+
+def admit(endpoint):
+    """A Slot for a request of this class, waiting in its queue if need be. Raises AdmissionRejected."""
+    start = time.perf_counter()
+    with _condition:
+        slot, ticket = _arrive(endpoint)
+        deadline = start + endpoint.timeout
+        while slot is None:
+            slot = _try_promote(endpoint, ticket)
+            if slot is not None:
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise _time_out(endpoint, ticket)
+            _condition.wait(remaining)
+    observe('admission_wait', time.perf_counter() - start)
+    return slot
+
+
+async def aadmit(endpoint):
+    start = time.perf_counter()
+    with _condition:
+        slot, ticket = _arrive(endpoint)
+    if slot is not None:
+        observe('admission_wait', time.perf_counter() - start)
+        return slot
+
+    woken = asyncio.Event()
+    with _condition:
+        _async_waiters[ticket] = (asyncio.get_running_loop(), woken)
+    try:
+        deadline = start + endpoint.timeout
+        while True:
+            with _condition:
+                # Cleared under the lock so a wake-up after this check is not lost
+                woken.clear()
+                slot = _try_promote(endpoint, ticket)
+                remaining = deadline - time.perf_counter()
+                if slot is None and remaining <= 0:
+                    raise _time_out(endpoint, ticket)
+            if slot is not None:
+                observe('admission_wait', time.perf_counter() - start)
+                return slot
+            try:
+                await asyncio.wait_for(woken.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    except asyncio.CancelledError:
+        # The client went away while queued: give the place up
+        with _condition:
+            if ticket in endpoint.waiting:
+                _leave_queue(endpoint, ticket)
+        raise
+    finally:
+        with _condition:
+            del _async_waiters[ticket]
+
+
+def rejected_response(rejected):
+    response = JsonResponse({'error': rejected.error, 'retry_after': rejected.retry_after}, status=rejected.status)
+    response['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
+def _hold_until_sent(response, slot):
+    # A streamed response does its work (OCR, grading, ...) while it is sent, so keep the slot until then
+    if response.streaming:
+        after_streaming(response, slot.release)
+    else:
+        slot.release()
+    return response
+
+
+class AdmissionMiddleware:
+    """Admit requests for the endpoints in ADMISSION_LIMITS within their limits; see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Stay async under ASGI so queued requests wait on the loop instead of a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        endpoint = endpoint_for(request.path)
+        if endpoint is None:
+            return self.get_response(request)
+        try:
+            slot = admit(endpoint)
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            slot.release()
+            raise
+        return _hold_until_sent(response, slot)
+
+    async def _acall(self, request):
+        endpoint = endpoint_for(request.path)
+        if endpoint is None:
+            return await self.get_response(request)
+        try:
+            slot = await aadmit(endpoint)
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            slot.release()
+            raise
+        return _hold_until_sent(response, slot)
@@ -0,0 +1,55 @@
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+
+# Async clients are bound to the event loop they were first used on, so each
+# loop gets its own set. Under ASGI that is one set per worker process.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _loop_clients():
+    loop = asyncio.get_running_loop()
+    clients = _clients.get(loop)
+    if clients is None:
+        clients = _clients[loop] = {}
+    return clients
+
+
+def get_http_client():
+    """Pooled httpx client for the model API and calls between the apps"""
+    clients = _loop_clients()
+    if 'http' not in clients:
+        clients['http'] = httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(
+                max_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return clients['http']
+
+
+def get_groq_client():
+    clients = _loop_clients()
+    if 'groq' not in clients:
+        from groq import AsyncGroq
+
+        # Retries are left to the rate-limit scheduler
+        clients['groq'] = AsyncGroq(
+            api_key=settings.GROQ_API_KEY,
+            base_url=settings.GROQ_BASE_URL,
+            max_retries=0,
+            http_client=get_http_client(),
+        )
+    return clients['groq']
+
+
+def get_mongo_db():
+    clients = _loop_clients()
+    if 'mongo' not in clients:
+        from pymongo import AsyncMongoClient
+
+        clients['mongo'] = AsyncMongoClient(settings.MONGO_URI)
+    return clients['mongo']['GraderPro']
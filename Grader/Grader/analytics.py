@@ -0,0 +1,343 @@
+"""
+Class analytics kept in one summary document per (subject, exam_type) in the
+ClassAnalytics collection. Every feedback write (a whole student with
+record_feedback, or some of their questions in place with upsert_feedback and
+bulk_upsert_feedback) applies the difference between the student's old and new
+scores with $inc, so reading the analytics costs O(questions) however many
+students there are:
+
+    {"subject", "exam_type",
+     "questions": {"<qno>": {"count", "sum", "max_total", "hist": {"<half marks>": n}}},
+     "overall": {"count", "sum", "hist": {...}}}
+
+Per-student totals are kept on the students documents as total_score, indexed
+for the top/bottom performer queries. Each write also invalidates the student's
+cached dashboard (Grader/dashboard_cache.py).
+"""
+from collections import Counter
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from Grader.dashboard_cache import ainvalidate, invalidate
+
+# Pairs of (students, summaries) collections whose indexes exist, by full name
+_indexed = set()
+
+
+def total_score(feedbacks):
+    return sum(float(item.get('score') or 0) for item in feedbacks or [])
+
+
+def _bin(score):
+    # Histogram buckets are half marks, stored as integer keys
+    return str(round(float(score or 0) * 2))
+
+
+def _entries(feedbacks):
+    """Counter of summary field -> contribution of one student's feedback."""
+    counts = Counter()
+    for item in feedbacks or []:
+        prefix = f"questions.{int(item.get('qno', 0))}"
+        counts[f"{prefix}.count"] += 1
+        counts[f"{prefix}.sum"] += float(item.get('score') or 0)
+        counts[f"{prefix}.hist.{_bin(item.get('score'))}"] += 1
+    if feedbacks:
+        total = total_score(feedbacks)
+        counts["overall.count"] += 1
+        counts["overall.sum"] += total
+        counts[f"overall.hist.{_bin(total)}"] += 1
+    return counts
+
+
+def summary_update(old_feedbacks, new_feedbacks):
+    """The update that moves a summary from a student's old feedback to the new one."""
+    return combined_summary_update([(old_feedbacks, new_feedbacks)])
+
+
+def combined_summary_update(changes):
+    """summary_update() for many students at once, from their (old feedback, new feedback) pairs."""
+    increments = Counter()
+    maxima = {}
+    for old_feedbacks, new_feedbacks in changes:
+        increments.update(_entries(new_feedbacks))
+        increments.subtract(_entries(old_feedbacks))
+        for item in new_feedbacks or []:
+            field = f"questions.{int(item.get('qno', 0))}.max_total"
+            maxima[field] = max(maxima.get(field, 0), int(item.get('total') or 0))
+    update = {'$inc': {field: value for field, value in increments.items() if value}}
+    if maxima:
+        update['$max'] = maxima
+    return update if update['$inc'] or maxima else None
+
+
+def merge_feedback(old_feedbacks, items):
+    """A student's feedback after upserting items into it by qno, in question order."""
+    qnos = {item.get('qno') for item in items}
+    merged = [item for item in old_feedbacks or [] if item.get('qno') not in qnos] + list(items)
+    return sorted(merged, key=lambda item: int(item.get('qno', 0)))
+
+
+def _upsert_pipeline(items):
+    """Replace the feedback entries with the items' qnos, or add them, then recount total_score."""
+    qnos = [item.get('qno') for item in items]
+    return [
+        {'$set': {'feedbacks': {'$sortArray': {
+            'input': {'$concatArrays': [
+                {'$filter': {
+                    'input': {'$ifNull': ['$feedbacks', []]},
+                    'cond': {'$not': [{'$in': ['$$this.qno', qnos]}]},
+                }},
+                # Answers and feedback are data, even when they start with '$'
+                {'$literal': list(items)},
+            ]},
+            'sortBy': {'qno': 1},
+        }}}},
+        {'$set': {'total_score': {'$sum': '$feedbacks.score'}}},
+    ]
+
+
+# What of a student's feedback the summary needs from before a write
+BEFORE_PROJECTION = {'_id': 0, 'usn': 1, 'feedbacks.qno': 1, 'feedbacks.score': 1}
+
+
+def _ensure_indexes(students, summaries):
+    key = (students.full_name, summaries.full_name)
+    if key not in _indexed:
+        students.create_index([('subject', ASCENDING), ('exam_type', ASCENDING), ('total_score', DESCENDING)])
+        summaries.create_index([('subject', ASCENDING), ('exam_type', ASCENDING)], unique=True)
+        _indexed.add(key)
+
+
+async def _aensure_indexes(students, summaries):
+    key = (students.full_name, summaries.full_name)
+    if key not in _indexed:
+        await students.create_index([('subject', ASCENDING), ('exam_type', ASCENDING), ('total_score', DESCENDING)])
+        await summaries.create_index([('subject', ASCENDING), ('exam_type', ASCENDING)], unique=True)
+        _indexed.add(key)
+
+
+def record_feedback(students, summaries, usn, subject, exam_type, feedbacks):
+    """Replace a student's feedback and fold the change into the class summary."""
+    _ensure_indexes(students, summaries)
+    # The document as it was before this write, so concurrent writes each see their own old state
+    before = students.find_one_and_update(
+        {'usn': usn, 'subject': subject, 'exam_type': exam_type},
+        {'$set': {
+            'usn': usn,
+            'subject': subject,
+            'exam_type': exam_type,
+            'feedbacks': feedbacks,
+            'total_score': total_score(feedbacks),
+        }},
+        projection=BEFORE_PROJECTION,
+        upsert=True,
+    )
+    invalidate(usn)
+    update = summary_update((before or {}).get('feedbacks'), feedbacks)
+    if update:
+        summaries.update_one({'subject': subject, 'exam_type': exam_type}, update, upsert=True)
+
+
+async def arecord_feedback(students, summaries, usn, subject, exam_type, feedbacks):
+    await _aensure_indexes(students, summaries)
+    before = await students.find_one_and_update(
+        {'usn': usn, 'subject': subject, 'exam_type': exam_type},
+        {'$set': {
+            'usn': usn,
+            'subject': subject,
+            'exam_type': exam_type,
+            'feedbacks': feedbacks,
+            'total_score': total_score(feedbacks),
+        }},
+        projection=BEFORE_PROJECTION,
+        upsert=True,
+    )
+    await ainvalidate(usn)
+    update = summary_update((before or {}).get('feedbacks'), feedbacks)
+    if update:
+        await summaries.update_one({'subject': subject, 'exam_type': exam_type}, update, upsert=True)
+
+
+def upsert_feedback(students, summaries, usn, subject, exam_type, items):
+    """
+    Write some of a student's question results in place, keyed by qno, leaving
+    their other questions as they are, and fold the change into the class summary.
+    """
+    _ensure_indexes(students, summaries)
+    before = students.find_one_and_update(
+        {'usn': usn, 'subject': subject, 'exam_type': exam_type},
+        _upsert_pipeline(items),
+        projection=BEFORE_PROJECTION,
+        upsert=True,
+    )
+    invalidate(usn)
+    old_feedbacks = (before or {}).get('feedbacks')
+    update = summary_update(old_feedbacks, merge_feedback(old_feedbacks, items))
+    if update:
+        summaries.update_one({'subject': subject, 'exam_type': exam_type}, update, upsert=True)
+
+
+async def aupsert_feedback(students, summaries, usn, subject, exam_type, items):
+    await _aensure_indexes(students, summaries)
+    before = await students.find_one_and_update(
+        {'usn': usn, 'subject': subject, 'exam_type': exam_type},
+        _upsert_pipeline(items),
+        projection=BEFORE_PROJECTION,
+        upsert=True,
+    )
+    await ainvalidate(usn)
+    old_feedbacks = (before or {}).get('feedbacks')
+    update = summary_update(old_feedbacks, merge_feedback(old_feedbacks, items))
+    if update:
+        await summaries.update_one({'subject': subject, 'exam_type': exam_type}, update, upsert=True)
+
+
+def _bulk_upserts(subject, exam_type, results):
+    return [
+        UpdateOne({'usn': usn, 'subject': subject, 'exam_type': exam_type}, _upsert_pipeline(items), upsert=True)
+        for usn, items in results.items()
+    ]
+
+
+def _bulk_summary_update(before, results):
+    old = {document['usn']: document.get('feedbacks') for document in before}
+    return combined_summary_update(
+        [(old.get(usn), merge_feedback(old.get(usn), items)) for usn, items in results.items()])
+
+
+def bulk_upsert_feedback(students, summaries, subject, exam_type, results):
+    """
+    upsert_feedback() for many students of one exam, results being {usn: items},
+    in three round trips: one read of their scores, one bulk_write of every
+    student's update and one summary update. The read and the writes are not one
+    atomic step, so a student written concurrently from elsewhere can leave the
+    summary off until rebuild_summary().
+    """
+    if not results:
+        return
+    _ensure_indexes(students, summaries)
+    query = {'subject': subject, 'exam_type': exam_type}
+    before = students.find({**query, 'usn': {'$in': list(results)}}, BEFORE_PROJECTION)
+    update = _bulk_summary_update(before, results)
+    students.bulk_write(_bulk_upserts(subject, exam_type, results), ordered=False)
+    invalidate(*results)
+    if update:
+        summaries.update_one(query, update, upsert=True)
+
+
+async def abulk_upsert_feedback(students, summaries, subject, exam_type, results):
+    if not results:
+        return
+    await _aensure_indexes(students, summaries)
+    query = {'subject': subject, 'exam_type': exam_type}
+    before = await students.find({**query, 'usn': {'$in': list(results)}}, BEFORE_PROJECTION).to_list()
+    update = _bulk_summary_update(before, results)
+    await students.bulk_write(_bulk_upserts(subject, exam_type, results), ordered=False)
+    await ainvalidate(*results)
+    if update:
+        await summaries.update_one(query, update, upsert=True)
+
+
+def _rebuild_pipeline():
+    return [{'$set': {'total_score': {'$sum': '$feedbacks.score'}}}]
+
+
+def _rebuilt_summary(subject, exam_type, documents):
+    increments = Counter()
+    maxima = {}
+    for document in documents:
+        feedbacks = document.get('feedbacks') or []
+        increments.update(_entries(feedbacks))
+        for item in feedbacks:
+            field = f"{int(item.get('qno', 0))}"
+            maxima[field] = max(maxima.get(field, 0), int(item.get('total') or 0))
+
+    summary = {'subject': subject, 'exam_type': exam_type, 'questions': {}, 'overall': {}}
+    for field, value in increments.items():
+        node = summary
+        *path, leaf = field.split('.')
+        for key in path:
+            node = node.setdefault(key, {})
+        node[leaf] = value
+    for qno, max_total in maxima.items():
+        summary['questions'].setdefault(qno, {})['max_total'] = max_total
+    return summary
+
+
+def rebuild_summary(students, summaries, subject, exam_type):
+    """
+    Recompute a class summary and the students' total_score from scratch, which
+    reads the whole class. For data written before the summaries existed, or
+    (manage.py rebuild_class_analytics) a summary a race left off; writers apply
+    their deltas with the functions above instead. Returns None, and keeps no
+    summary, when no student has results for the exam.
+    """
+    _ensure_indexes(students, summaries)
+    query = {'subject': subject, 'exam_type': exam_type}
+    students.update_many(query, _rebuild_pipeline())
+    documents = list(
+        students.find(query, {'_id': 0, 'feedbacks.qno': 1, 'feedbacks.score': 1, 'feedbacks.total': 1}))
+    if not documents:
+        summaries.delete_one(query)
+        return None
+    summary = _rebuilt_summary(subject, exam_type, documents)
+    summaries.replace_one(query, summary, upsert=True)
+    return summary
+
+
+async def arebuild_summary(students, summaries, subject, exam_type):
+    await _aensure_indexes(students, summaries)
+    query = {'subject': subject, 'exam_type': exam_type}
+    await students.update_many(query, _rebuild_pipeline())
+    documents = await students.find(
+        query, {'_id': 0, 'feedbacks.qno': 1, 'feedbacks.score': 1, 'feedbacks.total': 1}).to_list()
+    if not documents:
+        await summaries.delete_one(query)
+        return None
+    summary = _rebuilt_summary(subject, exam_type, documents)
+    await summaries.replace_one(query, summary, upsert=True)
+    return summary
+
+
+def describe(stats):
+    """Mean, median and histogram of one question (or of the totals) from its summary entry."""
+    count = stats.get('count', 0)
+    histogram = sorted(
+        (int(key) / 2, n) for key, n in (stats.get('hist') or {}).items() if n > 0
+    )
+    median = None
+    seen = 0
+    for score, n in histogram:
+        seen += n
+        if seen * 2 >= count:
+            median = score
+            break
+    return {
+        'count': count,
+        'mean': round(stats.get('sum', 0) / count, 2) if count else None,
+        'median': median,
+        'histogram': [{'score': score, 'count': n} for score, n in histogram],
+    }
+
+
+def analytics_payload(summary, top, bottom):
+    questions = summary.get('questions') or {}
+    return {
+        'subject': summary['subject'],
+        'exam_type': summary['exam_type'],
+        'overall': describe(summary.get('overall') or {}),
+        'questions': [
+            {'qno': int(qno), 'total': stats.get('max_total'), **describe(stats)}
+            for qno, stats in sorted(questions.items(), key=lambda item: int(item[0]))
+            if stats.get('count')
+        ],
+        'top': top,
+        'bottom': bottom,
+    }
+
+
+def performers_query(subject, exam_type):
+    return {'subject': subject, 'exam_type': exam_type, 'total_score': {'$exists': True}}
+
+
+PERFORMER_PROJECTION = {'_id': 0, 'usn': 1, 'total_score': 1}
@@ -0,0 +1,19 @@
+import threading
+
+from django.conf import settings
+
+# Process-wide sync clients, built on first use so importing the views stays
+# cheap. The async counterparts live in Grader.aio, one set per event loop.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_sync_groq_client():
+    """Shared Groq client for the sync views; its connection pool is thread-safe."""
+    with _clients_lock:
+        if 'groq' not in _clients:
+            from groq import Groq
+
+            # Retries are left to the rate-limit scheduler
+            _clients['groq'] = Groq(api_key=settings.GROQ_API_KEY, base_url=settings.GROQ_BASE_URL, max_retries=0)
+        return _clients['groq']
@@ -0,0 +1,93 @@
+"""
+Read-through cache of what the student dashboard reads (/student/subjects/ and
+GET /student/feedback/), kept in the 'dashboard' cache.
+
+A student's entries are keyed by their generation, which every feedback write
+for them replaces (see Grader/analytics.py). That drops all of that student's
+entries at once and nobody else's. A read that raced the write can only store
+its result under the retired generation, where no later read looks.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from Grader.metrics import increment
+
+_missing = object()
+
+
+def _cache():
+    return caches['dashboard']
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part or '').encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def _generation_key(usn):
+    return 'dashboard:generation:' + _digest(usn)
+
+
+def _new_generation():
+    return uuid.uuid4().hex
+
+
+def _entry_key(view, usn, generation, parts):
+    return f'dashboard:{view}:' + _digest(usn, generation, *parts)
+
+
+def _generation(cache, usn):
+    key = _generation_key(usn)
+    generation = cache.get(key)
+    if generation is None:
+        # Never fall back to a fixed value: entries stored under it before an eviction would come back
+        cache.add(key, _new_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+async def _ageneration(cache, usn):
+    key = _generation_key(usn)
+    generation = await cache.aget(key)
+    if generation is None:
+        await cache.aadd(key, _new_generation(), None)
+        generation = await cache.aget(key)
+    return generation
+
+
+def cached(view, usn, parts, load):
+    """What `view` shows the student for `parts`: from the cache, or load() then cached."""
+    cache = _cache()
+    key = _entry_key(view, usn, _generation(cache, usn), parts)
+    data = cache.get(key, _missing)
+    increment('dashboard_cache_requests', view=view, result='miss' if data is _missing else 'hit')
+    if data is _missing:
+        data = load()
+        cache.set(key, data, settings.DASHBOARD_CACHE_TIMEOUT)
+    return data
+
+
+async def acached(view, usn, parts, load):
+    """cached() with a coroutine function to load the data."""
+    cache = _cache()
+    key = _entry_key(view, usn, await _ageneration(cache, usn), parts)
+    data = await cache.aget(key, _missing)
+    increment('dashboard_cache_requests', view=view, result='miss' if data is _missing else 'hit')
+    if data is _missing:
+        data = await load()
+        await cache.aset(key, data, settings.DASHBOARD_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate(*usns):
+    """Drop every cached entry of these students. Call it after writing their documents."""
+    _cache().set_many({_generation_key(usn): _new_generation() for usn in usns}, None)
+
+
+async def ainvalidate(*usns):
+    await _cache().aset_many({_generation_key(usn): _new_generation() for usn in usns}, None)
@@ -0,0 +1,201 @@
+import base64
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageFilter, ImageOps
+
+from Grader.metrics import timed
+
+# Formats the vision model accepts as-is, keyed by PIL format name
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+
+# Page triage works on an edge map of the page scaled to this width
+TRIAGE_WIDTH = 400
+TRIAGE_EDGE_THRESHOLD = 40
+# Vertical strokes between these fractions of the page height: longer than a
+# line of handwriting, shorter than the margin rule and page border
+TRIAGE_MIN_STROKE = 0.05
+TRIAGE_MAX_STROKE = 0.3
+
+_pool = None
+
+
+def get_preprocess_options():
+    return {
+        'max_dimension': getattr(settings, 'IMAGE_MAX_DIMENSION', 1600),
+        'quality': getattr(settings, 'IMAGE_JPEG_QUALITY', 80),
+        'grayscale': getattr(settings, 'IMAGE_GRAYSCALE', False),
+        'autocontrast': getattr(settings, 'IMAGE_AUTOCONTRAST', False),
+    }
+
+
+def _open(source):
+    # source is a path to a spooled upload, raw bytes or a file object
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def _read(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read()
+    if isinstance(source, (bytes, memoryview)):
+        return source
+    source.seek(0)
+    return source.read()
+
+
+def _source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, memoryview)):
+        return len(source)
+    return source.size
+
+
+def sniff_mime_type(source):
+    with _open(source) as img:
+        return MIME_TYPES.get(img.format, 'image/jpeg')
+
+
+def preprocess_image(source, max_dimension=1600, quality=80, grayscale=False, autocontrast=False):
+    """
+    Rotate, downscale and re-encode one image. Returns (data, mime_type), where
+    data is the original source when re-encoding would not make it smaller.
+    """
+    with _open(source) as original:
+        original_mime = MIME_TYPES.get(original.format)
+        rotated = original.getexif().get(0x0112, 1) != 1
+        img = ImageOps.exif_transpose(original)
+        changed = rotated or grayscale or autocontrast
+
+        if grayscale:
+            img = img.convert('L')
+        elif img.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel, flatten onto white like a scanned page
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif img.mode != 'RGB' and img.mode != 'L':
+            img = img.convert('RGB')
+
+        if autocontrast:
+            img = ImageOps.autocontrast(img, cutoff=1)
+
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            changed = True
+
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=quality, optimize=True)
+
+    # Small line drawings often compress better in their original format
+    if not changed and original_mime and out.tell() >= _source_size(source):
+        return source, original_mime
+    return out.getbuffer(), 'image/jpeg'
+
+
+def to_data_url(data, mime_type):
+    """Base64-encode data (bytes, a path or a file) into a data URL."""
+    return f"data:{mime_type};base64,{base64.b64encode(_read(data)).decode('ascii')}"
+
+
+def _preprocess_to_data_url(source, options):
+    if options is None:
+        return to_data_url(source, sniff_mime_type(source))
+    return to_data_url(*preprocess_image(source, **options))
+
+
+def _upload_source(image_file):
+    # Spooled uploads are handed over by path so the content is never copied
+    # into this process; in-memory uploads are small enough to pass as bytes
+    if hasattr(image_file, 'temporary_file_path'):
+        return image_file.temporary_file_path()
+    image_file.seek(0)
+    return image_file.read()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # spawn keeps workers independent of the server's threads and sockets
+        _pool = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_PREPROCESS_WORKERS', 2),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _pool
+
+
+@timed('upload_decode')
+def encode_images(image_files):
+    """Return a data URL per uploaded image, in upload order."""
+    options = get_preprocess_options() if getattr(settings, 'IMAGE_PREPROCESS_ENABLED', True) else None
+
+    if options is None:
+        return [_preprocess_to_data_url(image_file, None) for image_file in image_files]
+
+    sources = [_upload_source(image_file) for image_file in image_files]
+    if len(sources) < 2 or getattr(settings, 'IMAGE_PREPROCESS_WORKERS', 2) < 1:
+        return [_preprocess_to_data_url(source, options) for source in sources]
+    return list(get_pool().map(_preprocess_to_data_url, sources, [options] * len(sources)))
+
+
+def encode_image(image_file):
+    return encode_images([image_file])[0]
+
+
+def _vertical_stroke_pixels(ink, min_length, max_length):
+    # Rotated so each column of the page is a row of bytes; 0 is an edge pixel
+    columns = ink.transpose(Image.Transpose.ROTATE_90)
+    data = columns.tobytes()
+    width = columns.width
+    stroke = re.compile(rb'\x00{%d,}' % min_length)
+    total = 0
+    for start in range(0, len(data), width):
+        for match in stroke.finditer(data, start, start + width):
+            if match.end() - match.start() <= max_length:
+                total += match.end() - match.start()
+    return total
+
+
+def diagram_score(source):
+    """
+    How likely a page is to hold a diagram rather than only handwriting: the
+    density of long vertical strokes (box sides, arrows, axes) against the
+    density of edges overall, which on an answer page is mostly text lines.
+    """
+    with _open(source) as original:
+        img = ImageOps.exif_transpose(original).convert('L')
+    height = max(1, round(img.height * TRIAGE_WIDTH / img.width))
+    img = img.resize((TRIAGE_WIDTH, height))
+
+    edges = ImageOps.autocontrast(img.filter(ImageFilter.FIND_EDGES))
+    ink = edges.point(lambda p: 0 if p > TRIAGE_EDGE_THRESHOLD else 255)
+    # Thicken the edges so a hand-drawn line does not break into short pieces
+    ink = ink.filter(ImageFilter.MinFilter(3))
+
+    area = TRIAGE_WIDTH * height
+    strokes = _vertical_stroke_pixels(ink, int(TRIAGE_MIN_STROKE * height), int(TRIAGE_MAX_STROKE * height)) / area
+    text = ink.histogram()[0] / area
+    return strokes / max(text, 0.01)
+
+
+@timed('page_triage')
+def rank_diagram_pages(image_files):
+    """Return (index, score) per uploaded page, the likeliest diagram page first."""
+    sources = [_upload_source(image_file) for image_file in image_files]
+    if len(sources) < 2 or getattr(settings, 'IMAGE_PREPROCESS_WORKERS', 2) < 1:
+        scores = [diagram_score(source) for source in sources]
+    else:
+        scores = list(get_pool().map(diagram_score, sources))
+    return sorted(enumerate(scores), key=lambda item: -item[1])
@@ -0,0 +1,133 @@
+import bisect
+import contextlib
+import logging
+import random
+import reprlib
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+# Upper bounds in seconds, from cheap database reads up to slow model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+_payload_repr = reprlib.Repr()
+_payload_repr.maxstring = 200
+_payload_repr.maxother = 200
+_payload_repr.maxlist = 20
+_payload_repr.maxdict = 20
+_payload_repr.maxlevel = 4
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def observe(stage, seconds):
+    """Record one duration for a processing stage."""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+
+def increment(name, amount=1, **labels):
+    """Add to a counter, e.g. increment('cache_requests', result='hit')."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextlib.contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def render():
+    """All metrics of this process in the Prometheus text exposition format."""
+    lines = [
+        '# HELP grader_stage_duration_seconds Time spent in each processing stage.',
+        '# TYPE grader_stage_duration_seconds histogram',
+    ]
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'grader_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'grader_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'grader_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        seen = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE grader_{name}_total counter')
+            lines.append(f'grader_{name}_total{_labels(labels)} {value}')
+
+        ratios = _hit_ratios()
+        if ratios:
+            lines.append('# HELP grader_cache_hit_ratio Share of cache lookups answered from the cache.')
+            lines.append('# TYPE grader_cache_hit_ratio gauge')
+        for labels, (hits, requests) in sorted(ratios.items()):
+            lines.append(f'grader_cache_hit_ratio{_labels(labels)} {hits / requests}')
+    return '\n'.join(lines) + '\n'
+
+
+def _hit_ratios():
+    """{labels: [hits, lookups]} from the <cache>_cache_requests counters, by cache and their other labels."""
+    ratios = {}
+    for (name, labels), value in _counters.items():
+        if not name.endswith('_cache_requests'):
+            continue
+        result = dict(labels).get('result')
+        key = (('cache', name[:-len('_cache_requests')]),) + tuple(pair for pair in labels if pair[0] != 'result')
+        counts = ratios.setdefault(key, [0, 0])
+        counts[0] += value if result == 'hit' else 0
+        counts[1] += value
+    return ratios
+
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def log_payload(logger, message, payload):
+    """
+    Log a request/response payload at DEBUG level, for a sample of calls only
+    (PAYLOAD_LOG_SAMPLE_RATE) and abbreviated so large bodies stay cheap.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= getattr(settings, 'PAYLOAD_LOG_SAMPLE_RATE', 0.01):
+        return
+    text = _payload_repr.repr(payload)
+    limit = getattr(settings, 'PAYLOAD_LOG_MAX_CHARS', 2000)
+    if len(text) > limit:
+        text = text[:limit] + '...'
+    logger.debug(f"{message}: {text}")
@@ -0,0 +1,363 @@
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import fcntl
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from Grader.metrics import increment, timed
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower values are served first
+INTERACTIVE = 0
+BULK = 1
+
+PRIORITY_HEADER = 'X-Grading-Priority'
+
+# Rough cost of one image in a vision request, in tokens
+IMAGE_TOKEN_ESTIMATE = 1500
+DEFAULT_COMPLETION_TOKENS = 1024
+
+_priority = contextvars.ContextVar('model_call_priority', default=INTERACTIVE)
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+class LocalStore:
+    """Bucket state shared by the threads of one process."""
+
+    # transact() only takes an in-memory lock, so it is fine to call on an event loop
+    blocking = False
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def transact(self, fn):
+        with self._lock:
+            return fn(self._state)
+
+
+class FileStore:
+    """Bucket state shared by every process that points at the same file."""
+
+    # transact() waits on flock and does file I/O, so async callers run it in a thread
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def transact(self, fn):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {}
+                result = fn(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ModelCallScheduler:
+    """
+    Token-bucket scheduler for one model's requests-per-minute and
+    tokens-per-minute limits. Waiting calls are served in priority order
+    (INTERACTIVE before BULK, then first come first served) within a process,
+    whether they wait in a thread (call) or on an event loop (acall); the
+    bucket levels themselves can be shared across processes via FileStore.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, store=None, max_retries=4):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.store = store or LocalStore()
+        self.max_retries = max_retries
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        # ticket -> (loop, asyncio.Event) for callers waiting in acquire_async
+        self._async_waiters = {}
+
+    def _refill(self, state, now):
+        elapsed = now - state.get('updated', now)
+        state['requests'] = min(self.requests_per_minute,
+                                state.get('requests', self.requests_per_minute) + elapsed * self.requests_per_minute / 60)
+        state['tokens'] = min(self.tokens_per_minute,
+                              state.get('tokens', self.tokens_per_minute) + elapsed * self.tokens_per_minute / 60)
+        state['updated'] = now
+
+    def _try_consume(self, tokens):
+        """Take one request and `tokens` tokens, or return the seconds to wait."""
+        def consume(state):
+            now = time.time()
+            self._refill(state, now)
+            blocked = state.get('blocked_until', 0) - now
+            if blocked > 0:
+                return blocked
+            wait = max(
+                (1 - state['requests']) * 60 / self.requests_per_minute,
+                (tokens - state['tokens']) * 60 / self.tokens_per_minute,
+            )
+            if wait > 0:
+                return wait
+            state['requests'] -= 1
+            state['tokens'] -= tokens
+            return 0
+        return self.store.transact(consume)
+
+    def acquire(self, tokens, priority=None):
+        tokens = min(tokens, self.tokens_per_minute)
+        ticket = (_priority.get() if priority is None else priority, next(self._counter))
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    if self._queue[0] != ticket:
+                        self._condition.wait()
+                        continue
+                    wait = self._try_consume(tokens)
+                    if wait <= 0:
+                        return
+                    # A higher-priority arrival wakes us up and takes the head
+                    self._condition.wait(min(wait, 1.0))
+            finally:
+                self._leave(ticket)
+
+    async def acquire_async(self, tokens, priority=None):
+        tokens = min(tokens, self.tokens_per_minute)
+        ticket = (_priority.get() if priority is None else priority, next(self._counter))
+        woken = asyncio.Event()
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            self._async_waiters[ticket] = (asyncio.get_running_loop(), woken)
+        try:
+            while True:
+                with self._condition:
+                    # Cleared under the lock so a wake-up after this check is not lost
+                    woken.clear()
+                    at_head = self._queue[0] == ticket
+                    wait = self._try_consume(tokens) if at_head and not self.store.blocking else None
+                if at_head and self.store.blocking:
+                    wait = await self._off_loop(self._try_consume, tokens)
+                if wait is not None and wait <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(woken.wait(), None if wait is None else min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._condition:
+                del self._async_waiters[ticket]
+                self._leave(ticket)
+
+    async def _off_loop(self, fn, *args):
+        # Keep a FileStore's flock and file I/O off the event loop
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _leave(self, ticket):
+        # Called with the condition held: hand the head of the queue to the next waiter
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        self._condition.notify_all()
+        for loop, woken in self._async_waiters.values():
+            loop.call_soon_threadsafe(woken.set)
+
+    def settle(self, estimated, actual):
+        """Return over-estimated tokens to the bucket once the real usage is known."""
+        def refund(state):
+            state['tokens'] = min(self.tokens_per_minute, state.get('tokens', 0) + estimated - actual)
+        if actual is not None:
+            self.store.transact(refund)
+
+    def block(self, seconds):
+        """Pause every caller after the provider asked us to back off."""
+        def update(state):
+            state['blocked_until'] = max(state.get('blocked_until', 0), time.time() + seconds)
+        self.store.transact(update)
+
+    def call(self, fn, tokens, priority=None):
+        """
+        Run fn() once the limits allow it. A 429, raised by the Groq SDK or
+        returned as a requests.Response, is retried after Retry-After (or an
+        exponential backoff) up to max_retries times; the last one is then
+        raised or returned to the caller as before.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        for attempt in range(self.max_retries + 1):
+            with timed('rate_limit_wait'):
+                self.acquire(tokens, priority)
+            try:
+                with timed('model_call'):
+                    result = fn()
+            except Exception as e:
+                if getattr(e, 'status_code', None) != 429 or attempt == self.max_retries:
+                    raise
+                delay = retry_after(getattr(e, 'response', None), attempt)
+            else:
+                if getattr(result, 'status_code', None) != 429:
+                    self.settle(tokens, used_tokens(result))
+                    return result
+                if attempt == self.max_retries:
+                    return result
+                delay = retry_after(result, attempt)
+            logger.warning(f"Model API rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            increment('model_rate_limited')
+            self.block(delay)
+
+    async def acall(self, fn, tokens, priority=None):
+        """call() for a coroutine function, e.g. an AsyncGroq or httpx request."""
+        tokens = min(tokens, self.tokens_per_minute)
+        for attempt in range(self.max_retries + 1):
+            with timed('rate_limit_wait'):
+                await self.acquire_async(tokens, priority)
+            try:
+                with timed('model_call'):
+                    result = await fn()
+            except Exception as e:
+                if getattr(e, 'status_code', None) != 429 or attempt == self.max_retries:
+                    raise
+                delay = retry_after(getattr(e, 'response', None), attempt)
+            else:
+                if getattr(result, 'status_code', None) != 429:
+                    await self._off_loop(self.settle, tokens, used_tokens(result))
+                    return result
+                if attempt == self.max_retries:
+                    return result
+                delay = retry_after(result, attempt)
+            logger.warning(f"Model API rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            increment('model_rate_limited')
+            await self._off_loop(self.block, delay)
+
+
+def retry_after(response, attempt):
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('retry-after')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+
+def used_tokens(result):
+    """Total tokens reported by a Groq SDK completion or an OpenAI-style JSON response."""
+    usage = getattr(result, 'usage', None)
+    if usage is not None:
+        return getattr(usage, 'total_tokens', None)
+    if hasattr(result, 'json'):
+        try:
+            body = result.json()
+        except ValueError:
+            return None
+        return body.get('usage', {}).get('total_tokens') if isinstance(body, dict) else None
+    return None
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Approximate prompt plus completion tokens for the token bucket."""
+    tokens = 0
+    for message in messages:
+        content = message.get('content')
+        parts = content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]
+        for part in parts:
+            if part.get('type') == 'image_url':
+                tokens += IMAGE_TOKEN_ESTIMATE
+            else:
+                tokens += len(part.get('text', '')) // 4 + 1
+    return tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def get_scheduler(model):
+    with _schedulers_lock:
+        if model not in _schedulers:
+            limits = settings.MODEL_RATE_LIMITS.get(model, settings.MODEL_RATE_LIMITS['default'])
+            state_dir = settings.MODEL_RATE_LIMIT_STATE_DIR
+            store = None
+            if state_dir:
+                name = hashlib.sha1(model.encode('utf-8')).hexdigest()[:16]
+                store = FileStore(os.path.join(state_dir, f"ratelimit_{name}.json"))
+            _schedulers[model] = ModelCallScheduler(
+                limits['requests_per_minute'],
+                limits['tokens_per_minute'],
+                store=store,
+                max_retries=settings.MODEL_CALL_MAX_RETRIES,
+            )
+        return _schedulers[model]
+
+
+def create_completion(client, **kwargs):
+    """client.chat.completions.create() through the scheduler for kwargs['model']"""
+    tokens = estimate_tokens(kwargs['messages'], kwargs.get('max_completion_tokens') or kwargs.get('max_tokens'))
+    return get_scheduler(kwargs['model']).call(lambda: client.chat.completions.create(**kwargs), tokens)
+
+
+async def acreate_completion(client, **kwargs):
+    """create_completion() for an AsyncGroq client"""
+    tokens = estimate_tokens(kwargs['messages'], kwargs.get('max_completion_tokens') or kwargs.get('max_tokens'))
+    return await get_scheduler(kwargs['model']).acall(lambda: client.chat.completions.create(**kwargs), tokens)
+
+
+def priority_from_request(request):
+    value = request.headers.get(PRIORITY_HEADER, '')
+    return BULK if value.lower() == 'bulk' else INTERACTIVE
+
+
+def priority_header(priority=None):
+    priority = _priority.get() if priority is None else priority
+    return {PRIORITY_HEADER: 'bulk' if priority == BULK else 'interactive'}
+
+
+class PriorityMiddleware:
+    """Serve each request's model calls in the lane named by its X-Grading-Priority header."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Stay async under ASGI so async views are not pushed onto a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        with model_priority(priority_from_request(request)):
+            return self.get_response(request)
+
+    async def _acall(self, request):
+        with model_priority(priority_from_request(request)):
+            return await self.get_response(request)
+
+
+@contextlib.contextmanager
+def model_priority(priority):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
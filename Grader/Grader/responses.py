@@ -0,0 +1,122 @@
+import json
+import re
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # only gzip is offered
+    brotli = None
+
+# Streams that must reach the client event by event, and formats already compressed
+UNCOMPRESSED_TYPES = ('text/event-stream', 'application/x-ndjson', 'application/vnd.openxmlformats', 'image/')
+
+_accepts_brotli = re.compile(r'\bbr\b')
+_django_encoder = DjangoJSONEncoder()
+
+
+def _default(value):
+    # Whatever orjson does not know natively (Decimal, lazy strings, ...)
+    return _django_encoder.default(value)
+
+
+def dumps(data):
+    """Serialize data to JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def loads(data):
+    """Parse a JSON request body. Invalid input raises json.JSONDecodeError either way."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JsonResponse(HttpResponse):
+    """django.http.JsonResponse serialized through dumps()."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Brotli or gzip for response bodies of at least RESPONSE_COMPRESSION_MIN_SIZE
+    bytes, whichever the client accepts (brotli first, when installed). Event
+    streams are left alone so every event is delivered as soon as it is written.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if response.get('Content-Type', '').startswith(UNCOMPRESSED_TYPES):
+            return response
+        if not response.streaming and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is None or response.streaming or not _accepts_brotli.search(accept_encoding):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=settings.RESPONSE_BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+class _ClosingStream:
+    def __init__(self, content, callback):
+        self.content = content
+        # Django closes the streaming content with the response, even if it was never iterated
+        self.close = callback
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+
+class _AsyncClosingStream:
+    def __init__(self, content, callback):
+        self.content = content
+        self.close = callback
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            self.close()
+
+
+def after_streaming(response, callback):
+    """
+    Call callback() once the streaming response has been sent, or when it is
+    closed, also if the client went away before it was read. The callback may
+    run twice and must do nothing the second time.
+    """
+    stream = _AsyncClosingStream if response.is_async else _ClosingStream
+    response.streaming_content = stream(response.streaming_content, callback)
+    return response
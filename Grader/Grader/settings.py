@@ -10,13 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
-GROQ_API_KEY="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"
+GROQ_API_KEY=os.environ.get('GROQ_API_KEY', "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")
+GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL', 'https://api.groq.com')
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -29,7 +33,7 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
-OTHER_DJANGO_APP_URL = 'http://127.0.0.1:8000/evaluate/script/'
+OTHER_DJANGO_APP_URL = os.environ.get('OTHER_DJANGO_APP_URL', 'http://127.0.0.1:8000/evaluate/script/')
 
 
 # Application definition
@@ -52,6 +56,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'Grader.responses.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,7 +65,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'corsheaders.middleware.CorsMiddleware'
+    'corsheaders.middleware.CorsMiddleware',
+    'Grader.admission.AdmissionMiddleware',
+    'Grader.ratelimit.PriorityMiddleware',
 ]
 
 
@@ -96,7 +103,206 @@ WSGI_APPLICATION = 'Grader.wsgi.application'
 CORS_ALLOW_ALL_ORIGINS = True
 
 
-OTHER_APP_URL= 'http://127.0.0.1:8000/student/feedback/'
+OTHER_APP_URL= os.environ.get('OTHER_APP_URL', 'http://127.0.0.1:8000/student/feedback/')
+
+# Uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE (per request) are spooled to
+# temporary files; any single file over MAX_UPLOAD_FILE_SIZE is rejected with a 413
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'Grader.uploadhandlers.SizeLimitedUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+MAX_UPLOAD_FILE_SIZE = 15 * 1024 * 1024
+DATA_UPLOAD_MAX_NUMBER_FILES = 40
+
+# Image preprocessing before uploads are sent to the vision model
+# (EXIF rotation, downscaling, re-encoding as JPEG)
+IMAGE_PREPROCESS_ENABLED = True
+IMAGE_MAX_DIMENSION = 1600
+IMAGE_JPEG_QUALITY = 80
+IMAGE_GRAYSCALE = False
+IMAGE_AUTOCONTRAST = False
+IMAGE_PREPROCESS_WORKERS = 2
+
+# ImagePipe's evaluate_diagram_view ranks the student's pages locally by how
+# likely they are to hold a diagram and sends only this many of them to the
+# vision model (0 sends every page)
+DIAGRAM_TRIAGE_PAGES = 1
+
+# Student diagrams scored at once by /imgeval/batch/; the rate limiter still
+# paces the model calls
+DIAGRAM_BATCH_WORKERS = 8
+
+# OCR each answer-script page in its own request and cache the text per image,
+# so re-uploading one corrected page only re-extracts that page. A script with
+# pages that failed is not graded until a retry of the upload reads them; after
+# OCR_PAGE_MAX_ATTEMPTS failures a page is given up on and reported in failed_pages.
+OCR_PER_PAGE = True
+OCR_PAGE_WORKERS = 5
+OCR_PAGE_MAX_ATTEMPTS = 3
+OCR_PAGE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# Textbook context returned by /rag/search/ is cut down to the passages most
+# relevant to the query, at most RAG_CONTEXT_TOKEN_BUDGET tokens (0 for whole pages)
+RAG_CONTEXT_TOKEN_BUDGET = 800
+RAG_CONTEXT_SENTENCES_PER_PASSAGE = 3
+
+# Storage of new textbook indexes built by /rag/pipeline/ (overridable per
+# request with 'quantization'): 'flat' float32, 'fp16', 'sq8' (8-bit scalar) or
+# 'pq' with RAG_PQ_SUBQUANTIZERS bytes per page. Quantized indexes keep a
+# float32 .npy copy on disk; searches fetch RAG_RERANK_CANDIDATES candidates
+# and re-rank them against it at full precision (0 to skip re-ranking).
+RAG_INDEX_QUANTIZATION = 'flat'
+RAG_PQ_SUBQUANTIZERS = 48
+RAG_RERANK_CANDIDATES = 20
+
+# Runtime of the RAG embedding model (see ragpipe/embeddings.py): 'torch',
+# 'onnx' or 'openvino'. RAG_EMBEDDING_MODEL_FILE selects an exported graph for
+# the latter two, e.g. 'onnx/model_qint8_avx512_vnni.onnx' for int8. Threads
+# per worker (0 = the runtime's default of all cores) should be about the core
+# count divided by the worker processes. Pages are embedded
+# RAG_EMBEDDING_BATCH_SIZE at a time at ingestion.
+RAG_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+RAG_EMBEDDING_BACKEND = os.environ.get('RAG_EMBEDDING_BACKEND', 'torch')
+RAG_EMBEDDING_MODEL_FILE = os.environ.get('RAG_EMBEDDING_MODEL_FILE', '')
+RAG_EMBEDDING_THREADS = int(os.environ.get('RAG_EMBEDDING_THREADS', '0'))
+RAG_EMBEDDING_BATCH_SIZE = 64
+
+# Opt-in semantic answer cache of /evaluate/script/ (see Evaluate/answer_cache.py),
+# also enabled per request or per question with "answer_cache": true. An answer
+# reuses the grade of an earlier answer to the same question and total when their
+# embeddings' cosine similarity is at least ANSWER_CACHE_SIMILARITY and it has at
+# least ANSWER_CACHE_MIN_LENGTH_RATIO of that answer's words. Reuses are listed at
+# /evaluate/cache/audit/ and can be overridden at /evaluate/cache/override/.
+# Cached grades expire after ANSWER_CACHE_TTL seconds; each question keeps its
+# newest ANSWER_CACHE_MAX_ENTRIES, and loses them all when its rubric changes.
+ANSWER_CACHE_ENABLED = False
+ANSWER_CACHE_SIMILARITY = 0.95
+ANSWER_CACHE_MIN_LENGTH_RATIO = 0.8
+ANSWER_CACHE_AUDIT_LIMIT = 500
+ANSWER_CACHE_TTL = 90 * 24 * 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 200
+
+# Rubrics written per question at question-paper upload with generate_rubrics=1
+# (see UploadQP/rubrics.py), RUBRIC_WORKERS questions at a time; teachers can
+# edit them at /upload/rubrics/. Questions with a rubric are graded against it.
+RUBRIC_MODEL = 'llama3-70b-8192'
+RUBRIC_MAX_TOKENS = 400
+RUBRIC_WORKERS = 4
+
+# Question-major grading of a class at /evaluate/class/ (see Evaluate/batch.py):
+# the answers to one question are graded BATCH_GRADING_SIZE at a time (and at
+# most BATCH_GRADING_MAX_ANSWER_TOKENS of answer text) behind a shared prompt
+# prefix, BATCH_GRADING_WORKERS calls in flight.
+BATCH_GRADING_MODEL = 'llama3-70b-8192'
+BATCH_GRADING_SIZE = 8
+BATCH_GRADING_MAX_ANSWER_TOKENS = 4000
+BATCH_GRADING_TOKENS_PER_ANSWER = 120
+BATCH_GRADING_WORKERS = 4
+
+# Duplicate answer-script submissions (same USN, subject, exam type and page
+# images, or the same Idempotency-Key header) wait for the run in flight and
+# reuse its result for SUBMISSION_RESULT_TIMEOUT: up to SUBMISSION_WAIT_TIMEOUT
+# seconds on the async views, but only SUBMISSION_SYNC_WAIT_TIMEOUT on the sync
+# ones, where a waiting duplicate holds a worker thread; after that it gets a
+# 409 with Retry-After and picks the result up when it retries.
+# Post 'regrade=1' with the upload to grade it again anyway. Submissions are
+# tracked in the 'submissions' cache below, in local memory by default, which
+# only catches duplicates that reach the same worker process: with several
+# processes set SUBMISSION_CACHE_DIR to a directory they share.
+SUBMISSION_WAIT_TIMEOUT = 10 * 60
+SUBMISSION_SYNC_WAIT_TIMEOUT = 5
+SUBMISSION_PENDING_TIMEOUT = 15 * 60
+SUBMISSION_RESULT_TIMEOUT = 24 * 60 * 60
+
+# Every answer script's run is checkpointed in the GradingRuns collection (see
+# imgtotext/checkpoints.py): OCR text, parsed questions and each question's grade.
+# Retrying an upload only redoes the stages that failed or never ran; POST to
+# /imageto/runs/ resumes the failed runs of an exam, GRADING_RUN_RESUME_WORKERS
+# at a time. Checkpoints expire GRADING_RUN_TTL seconds after their last update.
+GRADING_RUN_TTL = 7 * 24 * 60 * 60
+GRADING_RUN_RESUME_WORKERS = 4
+
+# 'default' holds OCR page text; 'submissions' the claims and results of
+# answer-script submissions (see Grader/submissions.py); 'dashboard' the student
+# dashboard reads of /student/subjects/ and /student/feedback/ (see
+# Grader/dashboard_cache.py), dropped per student whenever their feedback is
+# written. Local memory is per process: with several worker processes set
+# DASHBOARD_CACHE_DIR to a directory they share, so a write seen by one worker
+# invalidates what the others serve.
+DASHBOARD_CACHE_DIR = os.environ.get('DASHBOARD_CACHE_DIR', '')
+DASHBOARD_CACHE_TIMEOUT = 10 * 60
+SUBMISSION_CACHE_DIR = os.environ.get('SUBMISSION_CACHE_DIR', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'submissions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SUBMISSION_CACHE_DIR,
+    } if SUBMISSION_CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'submissions',
+    },
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': DASHBOARD_CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    } if DASHBOARD_CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Shared limits for calls to the Groq API, per model. Waiting calls are served
+# interactive-first; clients mark class-wide jobs with 'X-Grading-Priority: bulk'.
+MODEL_RATE_LIMITS = {
+    'default': {'requests_per_minute': 30, 'tokens_per_minute': 6000},
+    'meta-llama/llama-4-scout-17b-16e-instruct': {'requests_per_minute': 30, 'tokens_per_minute': 30000},
+}
+# Set to a directory shared by all worker processes to enforce the limits across them
+MODEL_RATE_LIMIT_STATE_DIR = None
+MODEL_CALL_MAX_RETRIES = 4
+
+# Admission control of the expensive endpoints (see Grader/admission.py). Each
+# class runs at most 'concurrency' requests and queues 'queue' more for up to
+# 'timeout' seconds; beyond that clients get 429 or 503 with Retry-After.
+# Heavy requests, running or queued, keep to (1 - ADMISSION_RESERVED_SHARE) of
+# ADMISSION_WORKER_SLOTS (the server's threads per process, e.g. gunicorn
+# --threads), leaving the rest to the Student reads and to the /evaluate/script/
+# and /student/feedback/ hops that each answer script makes back into this server.
+# The limits are per process.
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1').lower() in ('1', 'true', 'yes')
+ADMISSION_WORKER_SLOTS = int(os.environ.get('ADMISSION_WORKER_SLOTS', '64'))
+ADMISSION_RESERVED_SHARE = 0.25
+ADMISSION_LIMITS = {
+    'ocr': {'paths': ['/imageto/text/'], 'concurrency': 6, 'queue': 6, 'timeout': 30},
+    'rag-ingest': {'paths': ['/rag/pipeline/'], 'concurrency': 1, 'queue': 2, 'timeout': 30},
+    'diagram': {'paths': ['/imageeval/', '/imgeval/'], 'concurrency': 4, 'queue': 4, 'timeout': 30},
+    'class-grading': {'paths': ['/evaluate/class/'], 'concurrency': 2, 'queue': 2, 'timeout': 30},
+}
+
+# Route the I/O-heavy endpoints (OCR, grading, diagram evaluation, student
+# records) to their async views. Only worthwhile when served under ASGI, e.g.
+# `uvicorn Grader.asgi:application`; under WSGI each request would get its own loop.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+ASYNC_HTTP_MAX_CONNECTIONS = 200
+
+# Student documents fetched per round trip by the marks export, which streams
+# CSV (or writes XLSX through XlsxWriter's constant-memory mode) row by row
+EXPORT_BATCH_SIZE = 500
+
+# Responses of at least this many bytes are compressed, with brotli when the
+# client accepts it and the brotli package is installed, gzip otherwise. JSON is
+# encoded and request bodies decoded with orjson when it is installed.
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+RESPONSE_BROTLI_QUALITY = 4
+
+# Request/response payloads are logged at DEBUG level for this fraction of
+# calls, abbreviated to at most PAYLOAD_LOG_MAX_CHARS characters
+PAYLOAD_LOG_SAMPLE_RATE = 0.01
+PAYLOAD_LOG_MAX_CHARS = 2000
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
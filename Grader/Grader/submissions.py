@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from Grader.metrics import increment
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Cache value of a submission that is still being processed
+PENDING = 'pending'
+POLL_INTERVAL = 0.5
+# Seconds a duplicate that was not kept waiting is told to come back after
+PENDING_RETRY_AFTER = 10
+
+
+def _cache():
+    return caches['submissions']
+
+
+def submission_fingerprint(usn, subject, exam_type, image_files):
+    """Identify an answer script by the student, the exam and the bytes of its pages, in order."""
+    digest = hashlib.sha256()
+    for field in (usn, subject, exam_type):
+        digest.update(str(field or '').encode('utf-8') + b'\0')
+    for image_file in image_files:
+        page = hashlib.sha256()
+        for chunk in image_file.chunks():
+            page.update(chunk)
+        image_file.seek(0)
+        digest.update(page.digest())
+    return digest.hexdigest()
+
+
+def submission_keys(request, fingerprint):
+    """
+    Cache keys a submission is known by: its content and, if sent, the client's
+    Idempotency-Key. request is None for a run the server resumes by itself.
+    """
+    keys = ['submission:' + fingerprint]
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER) if request is not None else None
+    if idempotency_key:
+        keys.insert(0, 'submission:key:' + hashlib.sha256(idempotency_key.encode('utf-8')).hexdigest())
+    return keys
+
+
+class Submission:
+    """
+    One answer-script submission shared by every request for the same keys.
+    The first request claims it and runs the pipeline; duplicates wait for it
+    to finish and reuse the stored result. A failed run is released so that a
+    retry starts afresh. Only processes sharing the 'submissions' cache see each
+    other's submissions; see SUBMISSION_CACHE_DIR.
+
+    Waiting holds a worker thread under WSGI, so claim() only waits a few
+    seconds (SUBMISSION_SYNC_WAIT_TIMEOUT) before telling the duplicate to come
+    back; aclaim() waits on the event loop for as long as SUBMISSION_WAIT_TIMEOUT.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.owner = False
+
+    def _lookup(self, values):
+        for key in self.keys:
+            if values.get(key) is not None:
+                return values[key]
+        return None
+
+    def claim(self, reuse=True):
+        """
+        Return the stored result, None once this request owns the run, or
+        PENDING when another request is still running it after the wait. With reuse=False (a
+        deliberate re-grade) the run is taken over straight away.
+        """
+        if not reuse:
+            _cache().set_many({key: PENDING for key in self.keys}, settings.SUBMISSION_PENDING_TIMEOUT)
+            self.owner = True
+            return None
+        deadline = time.monotonic() + settings.SUBMISSION_SYNC_WAIT_TIMEOUT
+        while True:
+            value = self._lookup(_cache().get_many(self.keys))
+            if value is None and _cache().add(self.keys[-1], PENDING, settings.SUBMISSION_PENDING_TIMEOUT):
+                _cache().set_many({key: PENDING for key in self.keys[:-1]}, settings.SUBMISSION_PENDING_TIMEOUT)
+                self.owner = True
+                return None
+            if value not in (None, PENDING):
+                increment('submission_reused')
+                return value
+            if time.monotonic() > deadline:
+                # A stuck run's claim lapses after SUBMISSION_PENDING_TIMEOUT, and a retry then takes over
+                increment('submission_pending')
+                return PENDING
+            time.sleep(POLL_INTERVAL)
+
+    async def aclaim(self, reuse=True):
+        if not reuse:
+            await _cache().aset_many({key: PENDING for key in self.keys}, settings.SUBMISSION_PENDING_TIMEOUT)
+            self.owner = True
+            return None
+        deadline = time.monotonic() + settings.SUBMISSION_WAIT_TIMEOUT
+        while True:
+            value = self._lookup(await _cache().aget_many(self.keys))
+            if value is None and await _cache().aadd(self.keys[-1], PENDING, settings.SUBMISSION_PENDING_TIMEOUT):
+                await _cache().aset_many({key: PENDING for key in self.keys[:-1]}, settings.SUBMISSION_PENDING_TIMEOUT)
+                self.owner = True
+                return None
+            if value not in (None, PENDING):
+                increment('submission_reused')
+                return value
+            if time.monotonic() > deadline:
+                increment('submission_pending')
+                return PENDING
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def complete(self, result):
+        _cache().set_many({key: result for key in self.keys}, settings.SUBMISSION_RESULT_TIMEOUT)
+        self.owner = False
+
+    async def acomplete(self, result):
+        await _cache().aset_many({key: result for key in self.keys}, settings.SUBMISSION_RESULT_TIMEOUT)
+        self.owner = False
+
+    def release(self):
+        if self.owner:
+            _cache().delete_many(self.keys)
+            self.owner = False
+
+    async def arelease(self):
+        if self.owner:
+            await _cache().adelete_many(self.keys)
+            self.owner = False
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+from Grader.responses import JsonResponse
+
+
+class SizeLimitedUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spools uploads to temporary files and skips any file larger than
+    MAX_UPLOAD_FILE_SIZE. Skipped file names are recorded on
+    ``request.rejected_uploads`` so views can answer with a 413.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if not hasattr(self.request, 'rejected_uploads'):
+            self.request.rejected_uploads = []
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.MAX_UPLOAD_FILE_SIZE:
+            self.request.rejected_uploads.append(self.file_name)
+            raise SkipFile()
+        return super().receive_data_chunk(raw_data, start)
+
+
+def rejected_upload_response(request):
+    rejected = getattr(request, 'rejected_uploads', None)
+    if rejected:
+        return JsonResponse({
+            'error': f'Files larger than {settings.MAX_UPLOAD_FILE_SIZE} bytes are not accepted',
+            'files': rejected
+        }, status=413)
+    return None
@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 
+from Grader.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('upload/', include('UploadQP.urls')),
@@ -27,4 +29,5 @@ urlpatterns = [
     path('student/', include('Student.urls')),
     path('imageto/', include('imgtotext.urls')),
     path('imageeval/',include('ImageEval.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
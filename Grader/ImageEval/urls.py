@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('run/', views.diagram_evaluation_view, name='diagram_evaluation_view'),
-]
\ No newline at end of file
+    path('run/', views.diagram_evaluation_view_async if settings.ASYNC_VIEWS else views.diagram_evaluation_view,
+         name='diagram_evaluation_view'),
+    path('batch/', views.batch_diagram_evaluation_view_async if settings.ASYNC_VIEWS
+         else views.batch_diagram_evaluation_view, name='batch_diagram_evaluation_view'),
+]
@@ -1,53 +1,66 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
 import os
-import base64
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from groq import Groq
+from pymongo import MongoClient
 
-# Initialize Groq client using settings
-client = Groq(api_key=settings.GROQ_API_KEY)
+from Grader.aio import get_groq_client, get_mongo_db
+from Grader.analytics import abulk_upsert_feedback, bulk_upsert_feedback
+from Grader.clients import get_sync_groq_client
+from Grader.imaging import encode_image, encode_images
+from Grader.metrics import timed
+from Grader.ratelimit import acreate_completion, create_completion
+from Grader.responses import JsonResponse
+from Grader.uploadhandlers import rejected_upload_response
+from Student.views import validate_usn
 
-# Utility to encode image to base64
-def encode_image(file_obj):
-    return base64.b64encode(file_obj.read()).decode("utf-8")
+logger = logging.getLogger(__name__)
 
-@csrf_exempt
-@require_POST
-def diagram_evaluation_view(request):
-    try:
-        reference_image_file = request.FILES.get('reference_image')
-        student_image_file = request.FILES.getlist('student_image')
+mongo_client = MongoClient(settings.MONGO_URI)
+db = mongo_client['GraderPro']
+references_collection = db['DiagramReference']
+students_collection = db['students']
+analytics_collection = db['ClassAnalytics']
 
-        if not reference_image_file or not student_image_file:
-            return JsonResponse({"error": "Both 'reference_image' and 'student_image' are required."}, status=400)
+SCORE_FIELDS = {
+    'correctness': 'Correctness',
+    'completeness': 'Completeness',
+    'labeling': 'Labeling',
+    'final_score': 'Final Score',
+}
 
-        # --- Stage 1: Get Reference Description ---
-        ref_base64 = encode_image(reference_image_file)
-
-        ref_completion = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Describe this diagram in detail. Mention all key components, labels, and structure."},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{ref_base64}"}}
-                    ]
-                }
-            ],
-            temperature=1,
-            # max_completion_tokens=1024,
-            top_p=1,
-            stream=False,
-        )
-        reference_description = ref_completion.choices[0].message.content
+REFERENCE_PROMPT = "Describe this diagram in detail. Mention all key components, labels, and structure."
+
+
+def diagram_request(prompt, image_url):
+    return {
+        "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]
+            }
+        ],
+        "temperature": 1,
+        # "max_completion_tokens": 1024,
+        "top_p": 1,
+        "stream": False,
+    }
 
-        # --- Stage 2: Evaluate Student Diagram ---
-        student_base64 = encode_image(student_image_file)
 
-        eval_prompt = f"""
+def evaluation_prompt(reference_description):
+    return f"""
         Reference Description:
         {reference_description}
 
@@ -76,22 +89,33 @@ def diagram_evaluation_view(request):
         <Short summary of evaluation>
         """
 
-        eval_completion = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": eval_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{student_base64}"}}
-                    ]
-                }
-            ],
-            temperature=1,
-            # max_completion_tokens=1024,
-            top_p=1,
-            stream=False,
-        )
+
+@csrf_exempt
+@require_POST
+def diagram_evaluation_view(request):
+    try:
+        reference_image_file = request.FILES.get('reference_image')
+        student_image_file = request.FILES.get('student_image')
+
+        rejected = rejected_upload_response(request)
+        if rejected:
+            return rejected
+
+        if not reference_image_file or not student_image_file:
+            return JsonResponse({"error": "Both 'reference_image' and 'student_image' are required."}, status=400)
+
+        # --- Stage 1: Get Reference Description ---
+        ref_image_url = encode_image(reference_image_file)
+
+        ref_completion = create_completion(get_sync_groq_client(), **diagram_request(REFERENCE_PROMPT, ref_image_url))
+        reference_description = ref_completion.choices[0].message.content
+
+        # --- Stage 2: Evaluate Student Diagram ---
+        student_image_url = encode_image(student_image_file)
+
+        eval_prompt = evaluation_prompt(reference_description)
+
+        eval_completion = create_completion(get_sync_groq_client(), **diagram_request(eval_prompt, student_image_url))
 
         evaluation_result = eval_completion.choices[0].message.content
 
@@ -103,3 +127,267 @@ def diagram_evaluation_view(request):
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def diagram_evaluation_view_async(request):
+    try:
+        reference_image_file = request.FILES.get('reference_image')
+        student_image_file = request.FILES.get('student_image')
+
+        rejected = rejected_upload_response(request)
+        if rejected:
+            return rejected
+
+        if not reference_image_file or not student_image_file:
+            return JsonResponse({"error": "Both 'reference_image' and 'student_image' are required."}, status=400)
+
+        encode = sync_to_async(encode_image, thread_sensitive=False)
+        groq_client = get_groq_client()
+
+        ref_image_url = await encode(reference_image_file)
+        ref_completion = await acreate_completion(groq_client, **diagram_request(REFERENCE_PROMPT, ref_image_url))
+        reference_description = ref_completion.choices[0].message.content
+
+        student_image_url = await encode(student_image_file)
+        eval_completion = await acreate_completion(
+            groq_client, **diagram_request(evaluation_prompt(reference_description), student_image_url))
+
+        return JsonResponse({
+            "reference_description": reference_description,
+            "evaluation_result": eval_completion.choices[0].message.content
+        })
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+# ---- Batch evaluation: one reference, a class of student diagrams ----
+def parse_evaluation(evaluation_result):
+    """Pull the rubric scores and the summary out of the model's evaluation text."""
+    parsed = {}
+    for field, label in SCORE_FIELDS.items():
+        match = re.search(rf"{label}:\s*(\d+)", evaluation_result)
+        parsed[field] = int(match.group(1)) if match else None
+    summary = re.search(r"Summary:\s*(.*)", evaluation_result, re.DOTALL)
+    parsed['summary'] = summary.group(1).strip() if summary else evaluation_result.strip()
+    return parsed
+
+
+def reference_id_for(image_file):
+    """Content hash of a reference image, so the same reference is only described once."""
+    digest = hashlib.sha256()
+    for chunk in image_file.chunks():
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def read_batch_request(request):
+    """
+    Return (fields, None) or (None, error_response). Student diagrams are sent
+    as files named 'student_<USN>'; the reference as 'reference_image' or the
+    'reference_id' returned by an earlier batch.
+    """
+    rejected = rejected_upload_response(request)
+    if rejected:
+        return None, rejected
+
+    students = {
+        name[len('student_'):]: request.FILES[name]
+        for name in request.FILES if name.startswith('student_')
+    }
+    fields = {
+        'reference_image': request.FILES.get('reference_image'),
+        'reference_id': request.POST.get('reference_id'),
+        'students': students,
+        'subject': request.POST.get('subject'),
+        'exam_type': request.POST.get('exam_type'),
+        'question': request.POST.get('question', 'Diagram'),
+    }
+    if not fields['reference_image'] and not fields['reference_id']:
+        return None, JsonResponse({"error": "Provide 'reference_image' or a stored 'reference_id'."}, status=400)
+    if not students:
+        return None, JsonResponse({"error": "Send each student's diagram as a 'student_<USN>' file."}, status=400)
+    invalid = sorted(f'student_{usn}' for usn in students if not validate_usn(usn))
+    if invalid:
+        return None, JsonResponse({"error": "Invalid USN", "invalid_fields": invalid}, status=400)
+    try:
+        fields['qno'] = int(request.POST.get('qno', 1))
+        fields['total'] = int(request.POST.get('total', 5))
+    except ValueError:
+        return None, JsonResponse({"error": "'qno' and 'total' must be integers."}, status=400)
+    if (fields['subject'] or fields['exam_type']) and not (fields['subject'] and fields['exam_type']):
+        return None, JsonResponse({"error": "'subject' and 'exam_type' are needed together."}, status=400)
+    if fields['reference_image'] and not fields['reference_id']:
+        fields['reference_id'] = reference_id_for(fields['reference_image'])
+    return fields, None
+
+
+def student_result(usn, evaluation_result, total):
+    parsed = parse_evaluation(evaluation_result)
+    final_score = parsed['final_score']
+    return {
+        'usn': usn,
+        **parsed,
+        # The rubric is out of 5, the question is worth 'total' marks
+        'score': round(final_score * total / 5, 2) if final_score is not None else None,
+        'total': total,
+        'evaluation_result': evaluation_result,
+    }
+
+
+def diagram_feedback(results, fields):
+    """
+    {usn: [item]} for bulk_upsert_feedback(): each scored diagram as question
+    'qno' of the student's feedback for the subject and exam, replacing an
+    earlier entry for it.
+    """
+    return {
+        result['usn']: [{
+            'qno': fields['qno'],
+            'question': fields['question'],
+            'answer': '[diagram]',
+            'feedback': result['summary'],
+            'score': result['score'],
+            'total': result['total'],
+        }]
+        for result in results if result.get('score') is not None
+    }
+
+
+def batch_response(fields, reference_description, results, stored):
+    return JsonResponse({
+        'reference_id': fields['reference_id'],
+        'reference_description': reference_description,
+        'results': results,
+        'stored': stored,
+    })
+
+
+def describe_reference(fields):
+    """The stored description for the batch's reference, describing a new reference once."""
+    stored = references_collection.find_one({'reference_id': fields['reference_id']})
+    if stored:
+        return stored['description']
+    if not fields['reference_image']:
+        return None
+    ref_image_url = encode_image(fields['reference_image'])
+    ref_completion = create_completion(get_sync_groq_client(), **diagram_request(REFERENCE_PROMPT, ref_image_url))
+    description = ref_completion.choices[0].message.content
+    references_collection.update_one(
+        {'reference_id': fields['reference_id']}, {'$set': {'description': description}}, upsert=True)
+    return description
+
+
+def evaluate_student(usn, image_url, eval_prompt, total):
+    try:
+        with timed('diagram_evaluation'):
+            completion = create_completion(get_sync_groq_client(), **diagram_request(eval_prompt, image_url))
+        return student_result(usn, completion.choices[0].message.content, total)
+    except Exception as e:
+        logger.error(f"Diagram evaluation failed for {usn}: {e}")
+        return {'usn': usn, 'error': str(e)}
+
+
+@csrf_exempt
+@require_POST
+def batch_diagram_evaluation_view(request):
+    fields, error = read_batch_request(request)
+    if error:
+        return error
+
+    try:
+        reference_description = describe_reference(fields)
+        if reference_description is None:
+            return JsonResponse({"error": "Unknown 'reference_id'."}, status=404)
+
+        usns = list(fields['students'])
+        image_urls = encode_images([fields['students'][usn] for usn in usns])
+        eval_prompt = evaluation_prompt(reference_description)
+
+        # Students are scored concurrently; the rate limiter paces the model calls
+        workers = max(1, min(settings.DIAGRAM_BATCH_WORKERS, len(usns)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, evaluate_student, usn, url, eval_prompt, fields['total'])
+                for usn, url in zip(usns, image_urls)
+            ]
+        results = [future.result() for future in futures]
+
+        feedback = diagram_feedback(results, fields) if fields['subject'] else {}
+        if feedback:
+            # Folds each student's change into the class summary and drops their cached dashboard
+            with timed('feedback_write'):
+                bulk_upsert_feedback(students_collection, analytics_collection,
+                                     fields['subject'], fields['exam_type'], feedback)
+        stored = len(feedback)
+
+        return batch_response(fields, reference_description, results, stored)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+async def describe_reference_async(fields):
+    references = get_mongo_db()['DiagramReference']
+    stored = await references.find_one({'reference_id': fields['reference_id']})
+    if stored:
+        return stored['description']
+    if not fields['reference_image']:
+        return None
+    ref_image_url = await sync_to_async(encode_image, thread_sensitive=False)(fields['reference_image'])
+    ref_completion = await acreate_completion(get_groq_client(), **diagram_request(REFERENCE_PROMPT, ref_image_url))
+    description = ref_completion.choices[0].message.content
+    await references.update_one(
+        {'reference_id': fields['reference_id']}, {'$set': {'description': description}}, upsert=True)
+    return description
+
+
+async def evaluate_student_async(usn, image_url, eval_prompt, total, semaphore):
+    try:
+        async with semaphore:
+            with timed('diagram_evaluation'):
+                completion = await acreate_completion(get_groq_client(), **diagram_request(eval_prompt, image_url))
+        return student_result(usn, completion.choices[0].message.content, total)
+    except Exception as e:
+        logger.error(f"Diagram evaluation failed for {usn}: {e}")
+        return {'usn': usn, 'error': str(e)}
+
+
+@csrf_exempt
+@require_POST
+async def batch_diagram_evaluation_view_async(request):
+    fields, error = await sync_to_async(read_batch_request, thread_sensitive=False)(request)
+    if error:
+        return error
+
+    try:
+        reference_description = await describe_reference_async(fields)
+        if reference_description is None:
+            return JsonResponse({"error": "Unknown 'reference_id'."}, status=404)
+
+        usns = list(fields['students'])
+        image_urls = await sync_to_async(encode_images, thread_sensitive=False)(
+            [fields['students'][usn] for usn in usns])
+        eval_prompt = evaluation_prompt(reference_description)
+
+        semaphore = asyncio.Semaphore(max(1, settings.DIAGRAM_BATCH_WORKERS))
+        results = await asyncio.gather(*(
+            evaluate_student_async(usn, url, eval_prompt, fields['total'], semaphore)
+            for usn, url in zip(usns, image_urls)
+        ))
+
+        feedback = diagram_feedback(results, fields) if fields['subject'] else {}
+        if feedback:
+            with timed('feedback_write'):
+                await abulk_upsert_feedback(get_mongo_db()['students'], get_mongo_db()['ClassAnalytics'],
+                                            fields['subject'], fields['exam_type'], feedback)
+        stored = len(feedback)
+
+        return batch_response(fields, reference_description, results, stored)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path
-from .views import evaluate_diagram_view
+from .views import evaluate_diagram_view, evaluate_diagram_view_async
 
 urlpatterns = [
-    path('evaluate/', evaluate_diagram_view, name='evaluate_diagram_view'),
-]
\ No newline at end of file
+    path('evaluate/', evaluate_diagram_view_async if settings.ASYNC_VIEWS else evaluate_diagram_view,
+         name='evaluate_diagram_view'),
+]
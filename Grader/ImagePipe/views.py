@@ -1,70 +1,47 @@
-import base64
-import os
 import re
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
-from groq import Groq
 from django.conf import settings
-from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-load_dotenv()
-os.environ['GROQ_API_KEY']=settings.GROQ_API_KEY
-client = Groq()
-
-# Utility to encode image to base64
-def encode_image(image_file):
-    return base64.b64encode(image_file.read()).decode("utf-8")
-
-# -------------------------------
-# Main Diagram Evaluation View
-# -------------------------------
-@csrf_exempt
-@require_POST
-def evaluate_diagram_view(request):
-    try:
-        # Load files from request
-        reference_image = request.FILES.get("reference_image")
-        student_images = [request.FILES.get(f"student_image{i}") for i in range(1, 6)]
+from Grader.aio import get_groq_client
+from Grader.clients import get_sync_groq_client
+from Grader.imaging import encode_image, encode_images, rank_diagram_pages
+from Grader.ratelimit import acreate_completion, create_completion
+from Grader.responses import JsonResponse
+from Grader.uploadhandlers import rejected_upload_response
 
-        if not reference_image or not all(student_images):
-            return JsonResponse({"error": "All 6 images (1 reference and 5 student pages) are required."}, status=400)
-
-        # -------------------------------
-        # Step 1: Generate Reference Description
-        # -------------------------------
-        reference_base64 = encode_image(reference_image)
-        ref_completion = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Describe this diagram in detail. Mention all key components, labels, and structure."},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{reference_base64}"}}
-                    ]
-                }
-            ],
-            temperature=1,
-            # max_completion_tokens=1024,
-            top_p=1,
-            stream=False,
-        )
-        reference_description = ref_completion.choices[0].message.content
-
-        # -------------------------------
-        # Step 2: Evaluate Student Pages
-        # -------------------------------
-        student_images_base64 = [
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(img)}"}}
-            for img in student_images
-        ]
+load_dotenv()
 
-        eval_prompt = f"""
+MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+REFERENCE_PROMPT = "Describe this diagram in detail. Mention all key components, labels, and structure."
+
+
+def completion_request(prompt, image_urls):
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}] + [
+                    {"type": "image_url", "image_url": {"url": image_url}} for image_url in image_urls
+                ]
+            }
+        ],
+        "temperature": 1,
+        # "max_completion_tokens": 1024,
+        "top_p": 1,
+        "stream": False,
+    }
+
+
+def evaluation_prompt(reference_description, page_count):
+    return f"""
 Reference Description:
 {reference_description}
 
-You are an expert AI diagram evaluator. A student has submitted 5 pages. Your task is to:
+You are an expert AI diagram evaluator. A student has submitted {page_count} page(s). Your task is to:
 1. **Identify the page that contains the diagram** (only one page will have it).
 2. **Strictly evaluate** that diagram against the reference description.
 
@@ -97,31 +74,120 @@ Summary:
 <One paragraph summary explaining your evaluation>
 """
 
-        eval_completion = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": eval_prompt}] + student_images_base64
-                }
-            ],
-            temperature=1,
-            # max_completion_tokens=1024,
-            top_p=1,
-            stream=False,
+
+def student_pages(request):
+    """Uploaded answer pages: 'student_images' (repeated), or the numbered student_image1, student_image2, ..."""
+    pages = request.FILES.getlist("student_images")
+    if not pages:
+        numbered = sorted(
+            (int(match.group(1)), name) for name in request.FILES
+            for match in [re.fullmatch(r"student_image(\d+)", name)] if match
         )
+        pages = [request.FILES[name] for _, name in numbered]
+    return pages
+
+
+def triage_pages(pages):
+    """
+    Keep the DIAGRAM_TRIAGE_PAGES pages most likely to hold the diagram, in
+    upload order. Returns (pages, page_numbers, scores by page number).
+    """
+    count = settings.DIAGRAM_TRIAGE_PAGES
+    if not count or len(pages) <= count:
+        return pages, list(range(1, len(pages) + 1)), {}
+    ranking = rank_diagram_pages(pages)
+    kept = sorted(index for index, _ in ranking[:count])
+    scores = {index + 1: round(score, 4) for index, score in ranking}
+    return [pages[index] for index in kept], [index + 1 for index in kept], scores
+
+
+def evaluation_response(reference_description, evaluation_result, page_numbers, page_scores):
+    # Extract Final Score
+    match = re.search(r"Final Score:\s*(\d+)", evaluation_result)
+    final_score = int(match.group(1)) if match else None
+
+    return JsonResponse({
+        "reference_description": reference_description,
+        "evaluation_result": evaluation_result,
+        "final_score": final_score,
+        "pages_sent": page_numbers,
+        "page_scores": page_scores
+    })
+
+
+# -------------------------------
+# Main Diagram Evaluation View
+# -------------------------------
+@csrf_exempt
+@require_POST
+def evaluate_diagram_view(request):
+    try:
+        # Load files from request
+        reference_image = request.FILES.get("reference_image")
+        student_images = student_pages(request)
+
+        rejected = rejected_upload_response(request)
+        if rejected:
+            return rejected
+
+        if not reference_image or not student_images:
+            return JsonResponse({"error": "A reference image and at least one student page are required."}, status=400)
+
+        # -------------------------------
+        # Step 1: Generate Reference Description
+        # -------------------------------
+        client = get_sync_groq_client()
+        reference_image_url = encode_image(reference_image)
+        ref_completion = create_completion(client, **completion_request(REFERENCE_PROMPT, [reference_image_url]))
+        reference_description = ref_completion.choices[0].message.content
+
+        # -------------------------------
+        # Step 2: Evaluate Student Pages
+        # -------------------------------
+        # Only the page(s) most likely to hold the diagram are sent
+        student_images, page_numbers, page_scores = triage_pages(student_images)
+        student_image_urls = encode_images(student_images)
+
+        eval_prompt = evaluation_prompt(reference_description, len(student_images))
+
+        eval_completion = create_completion(client, **completion_request(eval_prompt, student_image_urls))
 
         evaluation_result = eval_completion.choices[0].message.content
+        return evaluation_response(reference_description, evaluation_result, page_numbers, page_scores)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
 
-        # Extract Final Score
-        match = re.search(r"Final Score:\s*(\d+)", evaluation_result)
-        final_score = int(match.group(1)) if match else None
+@csrf_exempt
+@require_POST
+async def evaluate_diagram_view_async(request):
+    try:
+        reference_image = request.FILES.get("reference_image")
+        student_images = student_pages(request)
+
+        rejected = rejected_upload_response(request)
+        if rejected:
+            return rejected
+
+        if not reference_image or not student_images:
+            return JsonResponse({"error": "A reference image and at least one student page are required."}, status=400)
+
+        groq_client = get_groq_client()
+        student_images, page_numbers, page_scores = await sync_to_async(triage_pages, thread_sensitive=False)(
+            student_images)
+        reference_image_url, *student_image_urls = await sync_to_async(encode_images, thread_sensitive=False)(
+            [reference_image] + student_images)
+
+        ref_completion = await acreate_completion(
+            groq_client, **completion_request(REFERENCE_PROMPT, [reference_image_url]))
+        reference_description = ref_completion.choices[0].message.content
 
-        return JsonResponse({
-            "reference_description": reference_description,
-            "evaluation_result": evaluation_result,
-            "final_score": final_score
-        })
+        eval_completion = await acreate_completion(
+            groq_client,
+            **completion_request(evaluation_prompt(reference_description, len(student_images)), student_image_urls))
+        return evaluation_response(
+            reference_description, eval_completion.choices[0].message.content, page_numbers, page_scores)
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
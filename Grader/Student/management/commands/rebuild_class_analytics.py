@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import MongoClient
+
+from Grader.analytics import rebuild_summary
+
+
+class Command(BaseCommand):
+    help = "Recompute the class analytics summary of an exam from the students' stored results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('subject')
+        parser.add_argument('exam_type')
+
+    def handle(self, *args, **options):
+        db = MongoClient(settings.MONGO_URI)['GraderPro']
+        summary = rebuild_summary(db['students'], db['ClassAnalytics'], options['subject'], options['exam_type'])
+        if summary is None:
+            raise CommandError(f"No results for {options['subject']} {options['exam_type']}")
+        count = (summary.get('overall') or {}).get('count', 0)
+        self.stdout.write(f"Rebuilt the summary of {options['subject']} {options['exam_type']} from {count} students")
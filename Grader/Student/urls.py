@@ -1,10 +1,22 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     path('paper/', views.add_or_get_paper),
-    path('feedback/', views.add_or_get_feedback_marks),
-    path('signup/', views.signup, name='signup'),
-    path('login/', views.login, name='login'),
-    path('subjects/', views.get_registered_subjects, name='subjects'),
-]
\ No newline at end of file
+    path('feedback/',
+         views.add_or_get_feedback_marks_async if settings.ASYNC_VIEWS else views.add_or_get_feedback_marks),
+    path('feedback/questions/',
+         views.upsert_question_feedback_async if settings.ASYNC_VIEWS else views.upsert_question_feedback,
+         name='upsert_question_feedback'),
+    path('feedback/bulk/',
+         views.bulk_upsert_question_feedback_async if settings.ASYNC_VIEWS else views.bulk_upsert_question_feedback,
+         name='bulk_upsert_question_feedback'),
+    path('signup/', views.signup_async if settings.ASYNC_VIEWS else views.signup, name='signup'),
+    path('login/', views.login_async if settings.ASYNC_VIEWS else views.login, name='login'),
+    path('subjects/', views.get_registered_subjects_async if settings.ASYNC_VIEWS else views.get_registered_subjects,
+         name='subjects'),
+    path('analytics/', views.class_analytics_async if settings.ASYNC_VIEWS else views.class_analytics,
+         name='class_analytics'),
+    path('export/', views.export_marks_async if settings.ASYNC_VIEWS else views.export_marks, name='export_marks'),
+]
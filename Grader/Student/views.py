@@ -1,21 +1,39 @@
 from django.shortcuts import render
 
 # Create your views here.
-from django.http import JsonResponse
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from pymongo import MongoClient
 import base64
+import csv
 import json
+import os
 import re
+import tempfile
 import bcrypt
 
+from Grader.aio import get_mongo_db
+from Grader.dashboard_cache import acached, cached, invalidate
+from Grader.analytics import (PERFORMER_PROJECTION, abulk_upsert_feedback, analytics_payload, arebuild_summary,
+                              arecord_feedback, aupsert_feedback, bulk_upsert_feedback, performers_query,
+                              rebuild_summary, record_feedback, upsert_feedback)
+from Grader.metrics import log_payload, timed
+from Grader.responses import JsonResponse, loads
+
+logger = logging.getLogger(__name__)
+
 # ✅ MongoDB Atlas URI (Replace this with your real URI)
-MONGO_URI = "mongodb://localhost:27017"
+MONGO_URI = settings.MONGO_URI
 client = MongoClient(MONGO_URI)
 
 # MongoDB setup
 db = client['GraderPro']
 collection = db['students']
+analytics_collection = db['ClassAnalytics']
 
 # Validate USN format
 def validate_usn(usn):
@@ -24,30 +42,53 @@ def validate_usn(usn):
 @csrf_exempt
 def login(request):
 
-    MONGO_URI = "mongodb://localhost:27017"
+    MONGO_URI = settings.MONGO_URI
     client = MongoClient(MONGO_URI)
 
 # MongoDB setup
     db = client['GraderPro']
     collection = db['Login']
+    usn, password, error = read_credentials(request, 'USN and password required')
+    if error:
+        return error
+
+    # Find user and include password hash
+    student = collection.find_one({"usn": usn}, {"_id": 0, "password": 1})
+    return login_response(usn, password, student)
+
+
+@csrf_exempt
+async def login_async(request):
+    usn, password, error = read_credentials(request, 'USN and password required')
+    if error:
+        return error
+
+    student = await get_mongo_db()['Login'].find_one({"usn": usn}, {"_id": 0, "password": 1})
+    # bcrypt is deliberately slow, check it on a worker thread
+    return await sync_to_async(login_response, thread_sensitive=False)(usn, password, student)
+
+
+def read_credentials(request, missing_message):
+    """Return (usn, password, None) or (None, None, error_response)."""
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+        return None, None, JsonResponse({'error': 'Only POST allowed'}, status=405)
 
     try:
-        data = json.loads(request.body)
+        data = loads(request.body)
         usn = data.get('usn')
         password = data.get('password')
     except (json.JSONDecodeError, KeyError):
-        return JsonResponse({'error': 'Invalid request format'}, status=400)
+        return None, None, JsonResponse({'error': 'Invalid request format'}, status=400)
 
     if not usn or not password:
-        return JsonResponse({'error': 'USN and password required'}, status=400)
+        return None, None, JsonResponse({'error': missing_message}, status=400)
 
     if not validate_usn(usn):
-        return JsonResponse({'error': 'Invalid USN format'}, status=400)
+        return None, None, JsonResponse({'error': 'Invalid USN format'}, status=400)
+    return usn, password, None
 
-    # Find user and include password hash
-    student = collection.find_one({"usn": usn}, {"_id": 0, "password": 1})
+
+def login_response(usn, password, student):
     if not student:
         return JsonResponse({'error': 'User not found'}, status=404)
 
@@ -63,28 +104,16 @@ def login(request):
 @csrf_exempt
 def signup(request):
 
-    MONGO_URI = "mongodb://localhost:27017"
+    MONGO_URI = settings.MONGO_URI
     client = MongoClient(MONGO_URI)
 
 # MongoDB setup
     db = client['GraderPro']
     collection = db['Login']
-    if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST allowed'}, status=405)
-
-    try:
-        data = json.loads(request.body)
-        usn = data.get('usn')
-        password = data.get('password')
-    except (json.JSONDecodeError, KeyError):
-        return JsonResponse({'error': 'Invalid request format'}, status=400)
-
     # Basic validation
-    if not usn or not password:
-        return JsonResponse({'error': 'USN and password are required'}, status=400)
-
-    if not validate_usn(usn):
-        return JsonResponse({'error': 'Invalid USN format'}, status=400)
+    usn, password, error = read_credentials(request, 'USN and password are required')
+    if error:
+        return error
 
     # Check if user already exists
     if collection.find_one({"usn": usn}):
@@ -102,6 +131,26 @@ def signup(request):
     return JsonResponse({"message": "Signup successful"}, status=201)
 
 
+@csrf_exempt
+async def signup_async(request):
+    usn, password, error = read_credentials(request, 'USN and password are required')
+    if error:
+        return error
+
+    collection = get_mongo_db()['Login']
+    if await collection.find_one({"usn": usn}):
+        return JsonResponse({'error': 'USN already registered'}, status=409)
+
+    hashed_password = await sync_to_async(bcrypt.hashpw, thread_sensitive=False)(
+        password.encode('utf-8'), bcrypt.gensalt())
+    await collection.insert_one({
+        "usn": usn,
+        "password": hashed_password.decode('utf-8')
+    })
+
+    return JsonResponse({"message": "Signup successful"}, status=201)
+
+
 @csrf_exempt
 def get_registered_subjects(request):
     if request.method != 'POST':
@@ -109,11 +158,11 @@ def get_registered_subjects(request):
     try:
         # Parse request body
         try:
-            data = json.loads(request.body)
+            data = loads(request.body)
             usn = data.get('usn')
-            print(f"Received USN: {usn}")
+            logger.debug(f"Received USN: {usn}")
         except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
+            logger.debug(f"JSON decode error: {e}")
             return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
             
         if not usn:
@@ -122,67 +171,97 @@ def get_registered_subjects(request):
         if not validate_usn(usn):
             return JsonResponse({'error': 'Invalid USN format'}, status=400)
         
-        # Connect to MongoDB
-        MONGO_URI = "mongodb://localhost:27017"
-        client = MongoClient(MONGO_URI)
-        db = client['GraderPro']
-        collection = db['students']
-        
-        # Find all records for this student
-        student_records = list(collection.find({"usn": usn}))
-        print(f"Found {len(student_records)} records for USN: {usn}")
-        
-        if not student_records:
-            return JsonResponse({'subjects': []})  # Empty subjects array
-        
-        # Group by subject and collect exam types
-        subject_data = {}
-        for record in student_records:
-            if "subject" in record and record["subject"]:
-                subject_name = record["subject"]
-                exam_type = record.get("exam_type", "Unknown")
-                
-                if subject_name not in subject_data:
-                    # Initialize subject data structure
-                    subject_data[subject_name] = {
-                        "subject": subject_name,
-                        "sem": "1",  # Default value, adjust if you have semester info
-                        "paperTypes": []
-                    }
-                
-                # Add exam type if it doesn't exist already
-                if exam_type not in subject_data[subject_name]["paperTypes"]:
-                    subject_data[subject_name]["paperTypes"].append(exam_type)
-        
-        # Extract simple subject names for DashboardPage
-        subject_names = list(subject_data.keys())
-        
-        # Convert subject_data to list for SubjectPage
-        subjects_with_details = list(subject_data.values())
-        
-        # The response format that works for both components
-        response_data = {
-            'subjects': subject_names,
-            'subjectsData': subjects_with_details
-        }
-        
-        print(f"Response data: {response_data}")
-        return JsonResponse(response_data)
+        # Find all records for this student, unless their dashboard is cached
+        def load():
+            student_records = list(collection.find({"usn": usn}, SUBJECTS_PROJECTION))
+            logger.debug(f"Found {len(student_records)} records for USN: {usn}")
+            return subjects_payload(student_records)
+
+        return JsonResponse(cached('subjects', usn, (), load))
+
+    except Exception as e:
+        logger.exception(f"Error in get_registered_subjects: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+async def get_registered_subjects_async(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+    try:
+        try:
+            usn = loads(request.body).get('usn')
+        except json.JSONDecodeError as e:
+            logger.debug(f"JSON decode error: {e}")
+            return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+        if not usn:
+            return JsonResponse({'error': 'USN is required'}, status=400)
+
+        if not validate_usn(usn):
+            return JsonResponse({'error': 'Invalid USN format'}, status=400)
+
+        async def load():
+            student_records = await get_mongo_db()['students'].find({"usn": usn}, SUBJECTS_PROJECTION).to_list()
+            logger.debug(f"Found {len(student_records)} records for USN: {usn}")
+            return subjects_payload(student_records)
+
+        return JsonResponse(await acached('subjects', usn, (), load))
 
     except Exception as e:
-        print(f"Error in get_registered_subjects: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in get_registered_subjects: {str(e)}")
         return JsonResponse({'error': str(e)}, status=500)
 
 
+# Only what the subjects list is built from, not every feedback of the student
+SUBJECTS_PROJECTION = {"_id": 0, "subject": 1, "exam_type": 1}
+
+
+def subjects_payload(student_records):
+    if not student_records:
+        return {'subjects': []}  # Empty subjects array
+
+    # Group by subject and collect exam types
+    subject_data = {}
+    for record in student_records:
+        if "subject" in record and record["subject"]:
+            subject_name = record["subject"]
+            exam_type = record.get("exam_type", "Unknown")
+            
+            if subject_name not in subject_data:
+                # Initialize subject data structure
+                subject_data[subject_name] = {
+                    "subject": subject_name,
+                    "sem": "1",  # Default value, adjust if you have semester info
+                    "paperTypes": []
+                }
+            
+            # Add exam type if it doesn't exist already
+            if exam_type not in subject_data[subject_name]["paperTypes"]:
+                subject_data[subject_name]["paperTypes"].append(exam_type)
+    
+    # Extract simple subject names for DashboardPage
+    subject_names = list(subject_data.keys())
+    
+    # Convert subject_data to list for SubjectPage
+    subjects_with_details = list(subject_data.values())
+    
+    # The response format that works for both components
+    response_data = {
+        'subjects': subject_names,
+        'subjectsData': subjects_with_details
+    }
+    
+    log_payload(logger, "Response data", response_data)
+    return response_data
+
 
 # ---- Add or Get Paper (Image + Sem) ----
 @csrf_exempt
 def add_or_get_paper(request):
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = loads(request.body)
             usn = data['usn']
             subject = data['subject']
             paper_type = data['paper_type']  # CIE / SEE
@@ -202,6 +281,8 @@ def add_or_get_paper(request):
             }
 
             collection.update_one({"usn": usn}, update, upsert=True)
+            # The student's subjects are read from the same collection
+            invalidate(usn)
             return JsonResponse({"message": "Paper image added to array"})
 
         except Exception as e:
@@ -229,30 +310,37 @@ def add_or_get_paper(request):
 
 
 # ---- Add or Get Feedback & Marks ----
+FEEDBACKS_PROJECTION = {"_id": 0, "feedbacks": 1}
+
+
+def clean_feedbacks(feedbacks_raw):
+    # Only keep items that have 'question' and 'feedback'
+    return [
+        {
+            # Results of a partial or resumed run carry their question number
+            'qno': int(item['qno']) if item.get('qno') is not None else item.get('index', 0) + 1,
+            'question': item['question'],
+            'answer': item['answer'],
+            'feedback': item['feedback'],
+            'score': item.get('score', 0) ,
+            'total': int(item.get('total', 0))
+        }
+        for item in feedbacks_raw
+        if 'question' in item and 'feedback' in item
+    ]
+
+
 @csrf_exempt
 def add_or_get_feedback_marks(request):
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = loads(request.body)
             usn = data['usn']
             subject = data['subject']
             exam_type = data['exam_type']  # e.g., 'CIE' or 'SEE'
             
             # Get feedbacks from 'feedbacks' or 'results'
-            feedbacks_raw = data.get('feedback')
-# Only keep items that have 'question' and 'feedback'
-            feedbacks = [
-                {
-                    'qno': item.get('index', 0) + 1,
-                    'question': item['question'],
-                    'answer': item['answer'],
-                    'feedback': item['feedback'],
-                    'score': item.get('score', 0) ,
-                    'total': int(item.get('total', 0))
-                }
-                for item in feedbacks_raw
-                if 'question' in item and 'feedback' in item
-            ]
+            feedbacks = clean_feedbacks(data.get('feedback'))
 
            
             if not validate_usn(usn):
@@ -260,24 +348,10 @@ def add_or_get_feedback_marks(request):
             if not isinstance(feedbacks, list):
                 return JsonResponse({'error': 'feedbacks must be a list'}, status=400)
 
-            # Find if a document already exists with the same usn, subject, and exam_type
-            query = {
-                "usn": usn,
-                "subject": subject,
-                "exam_type": exam_type
-            }
-            
-            # Update or insert the document with the new feedbacks array
-            update = {
-                "$set": {
-                    "usn": usn,
-                    "subject": subject,
-                    "exam_type": exam_type,
-                    "feedbacks": feedbacks
-                }
-            }
-            
-            collection.update_one(query, update, upsert=True)
+            # Update or insert the document with the new feedbacks array, and
+            # apply the change in scores to the class analytics
+            with timed('feedback_write'):
+                record_feedback(collection, analytics_collection, usn, subject, exam_type, feedbacks)
             return JsonResponse({"message": "Feedbacks added successfully"})
 
         except Exception as e:
@@ -291,20 +365,394 @@ def add_or_get_feedback_marks(request):
         if not validate_usn(usn):
             return JsonResponse({'error': 'Invalid USN'}, status=400)
 
-        # Find the document matching the query criteria
+        # Find the document matching the query criteria, unless the student's dashboard is cached
         query = {
             "usn": usn,
             "subject": subject,
             "exam_type": exam_type
         }
-        
-        result = collection.find_one(query, {"_id": 0})
-        if not result:
+
+        def load():
+            result = collection.find_one(query, FEEDBACKS_PROJECTION)
+            return result.get("feedbacks", []) if result else None
+
+        feedbacks = cached('feedback', usn, (subject, exam_type), load)
+        if feedbacks is None:
             return JsonResponse({'error': 'Not found'}, status=404)
 
         # Return the feedbacks array
         return JsonResponse({
+            "feedbacks": feedbacks
+        })
+
+
+@csrf_exempt
+async def add_or_get_feedback_marks_async(request):
+    collection = get_mongo_db()['students']
+
+    if request.method == 'POST':
+        try:
+            data = loads(request.body)
+            usn = data['usn']
+            subject = data['subject']
+            exam_type = data['exam_type']
+            feedbacks = clean_feedbacks(data.get('feedback'))
+
+            if not validate_usn(usn):
+                return JsonResponse({'error': 'Invalid USN'}, status=400)
+
+            with timed('feedback_write'):
+                await arecord_feedback(
+                    collection, get_mongo_db()['ClassAnalytics'], usn, subject, exam_type, feedbacks)
+            return JsonResponse({"message": "Feedbacks added successfully"})
+
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    elif request.method == 'GET':
+        usn = request.GET.get("usn")
+        subject = request.GET.get("subject")
+        exam_type = request.GET.get("exam_type")
+
+        if not validate_usn(usn):
+            return JsonResponse({'error': 'Invalid USN'}, status=400)
 
-            "feedbacks": result.get("feedbacks", [])
+        query = {
+            "usn": usn,
+            "subject": subject,
+            "exam_type": exam_type
+        }
+
+        async def load():
+            result = await collection.find_one(query, FEEDBACKS_PROJECTION)
+            return result.get("feedbacks", []) if result else None
+
+        feedbacks = await acached('feedback', usn, (subject, exam_type), load)
+        if feedbacks is None:
+            return JsonResponse({'error': 'Not found'}, status=404)
+
+        return JsonResponse({
+            "feedbacks": feedbacks
         })
 
+
+# ---- Write some question results in place ----
+def by_qno(items):
+    """One result per question, the last one sent winning"""
+    return list({item['qno']: item for item in items}.values())
+
+
+def read_question_feedback(request):
+    """
+    POST {"usn", "subject", "exam_type", "feedback": [results]}. Return
+    ((usn, subject, exam_type, items), None), or (None, error_response).
+    """
+    if request.method != 'POST':
+        return None, JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    try:
+        data = loads(request.body)
+        usn = data['usn']
+        subject = data['subject']
+        exam_type = data['exam_type']
+        items = by_qno(clean_feedbacks(data['feedback']))
+    except (KeyError, TypeError, ValueError) as e:
+        return None, JsonResponse(
+            {'error': 'usn, subject, exam_type and feedback are required', 'details': str(e)}, status=400)
+    if not validate_usn(usn):
+        return None, JsonResponse({'error': 'Invalid USN'}, status=400)
+    if not items:
+        return None, JsonResponse({'error': 'No question results to write'}, status=400)
+    return (usn, subject, exam_type, items), None
+
+
+@csrf_exempt
+def upsert_question_feedback(request):
+    """Write the posted question results over the student's, by qno; their other questions are kept."""
+    fields, error = read_question_feedback(request)
+    if error:
+        return error
+    usn, subject, exam_type, items = fields
+    with timed('feedback_write'):
+        upsert_feedback(collection, analytics_collection, usn, subject, exam_type, items)
+    return JsonResponse({'message': 'Feedbacks updated successfully', 'qnos': [item['qno'] for item in items]})
+
+
+@csrf_exempt
+async def upsert_question_feedback_async(request):
+    fields, error = read_question_feedback(request)
+    if error:
+        return error
+    usn, subject, exam_type, items = fields
+    with timed('feedback_write'):
+        await aupsert_feedback(
+            get_mongo_db()['students'], get_mongo_db()['ClassAnalytics'], usn, subject, exam_type, items)
+    return JsonResponse({'message': 'Feedbacks updated successfully', 'qnos': [item['qno'] for item in items]})
+
+
+def read_bulk_feedback(request):
+    """
+    POST {"subject", "exam_type", "students": [{"usn", "feedback": [results]}]}.
+    Return ((subject, exam_type, {usn: items}), None), or (None, error_response).
+    """
+    if request.method != 'POST':
+        return None, JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    try:
+        data = loads(request.body)
+        subject = data['subject']
+        exam_type = data['exam_type']
+        results = {}
+        for student in data['students']:
+            results.setdefault(student['usn'], []).extend(clean_feedbacks(student['feedback']))
+    except (KeyError, TypeError, ValueError) as e:
+        return None, JsonResponse(
+            {'error': 'subject, exam_type and students are required', 'details': str(e)}, status=400)
+    invalid = [usn for usn in results if not validate_usn(usn)]
+    if invalid:
+        return None, JsonResponse({'error': 'Invalid USN', 'usns': invalid}, status=400)
+    results = {usn: by_qno(items) for usn, items in results.items() if items}
+    return (subject, exam_type, results), None
+
+
+def bulk_response(results):
+    return JsonResponse({
+        'message': 'Feedbacks updated successfully',
+        'students': len(results),
+        'questions': sum(len(items) for items in results.values()),
+    })
+
+
+@csrf_exempt
+def bulk_upsert_question_feedback(request):
+    """upsert_question_feedback() for a whole class, in a handful of round trips"""
+    fields, error = read_bulk_feedback(request)
+    if error:
+        return error
+    subject, exam_type, results = fields
+    with timed('feedback_bulk_write'):
+        bulk_upsert_feedback(collection, analytics_collection, subject, exam_type, results)
+    return bulk_response(results)
+
+
+@csrf_exempt
+async def bulk_upsert_question_feedback_async(request):
+    fields, error = read_bulk_feedback(request)
+    if error:
+        return error
+    subject, exam_type, results = fields
+    with timed('feedback_bulk_write'):
+        await abulk_upsert_feedback(
+            get_mongo_db()['students'], get_mongo_db()['ClassAnalytics'], subject, exam_type, results)
+    return bulk_response(results)
+
+
+# ---- Class analytics for a subject and exam ----
+def read_analytics_request(request):
+    """Return (subject, exam_type, top, None) or (None, None, None, error_response)."""
+    if request.method != 'GET':
+        return None, None, None, JsonResponse({'error': 'Only GET allowed'}, status=405)
+    subject = request.GET.get("subject")
+    exam_type = request.GET.get("exam_type")
+    if not subject or not exam_type:
+        return None, None, None, JsonResponse({'error': 'subject and exam_type are required'}, status=400)
+    try:
+        top = max(0, int(request.GET.get("top", 5)))
+    except ValueError:
+        return None, None, None, JsonResponse({'error': 'top must be an integer'}, status=400)
+    return subject, exam_type, top, None
+
+
+@csrf_exempt
+def class_analytics(request):
+    subject, exam_type, top, error = read_analytics_request(request)
+    if error:
+        return error
+
+    with timed('analytics_read'):
+        summary = analytics_collection.find_one({"subject": subject, "exam_type": exam_type}, {"_id": 0})
+        if summary is None:
+            # Results stored before the summaries were kept
+            summary = rebuild_summary(collection, analytics_collection, subject, exam_type)
+        if summary is None:
+            return JsonResponse({'error': 'No results for this subject and exam_type'}, status=404)
+        query = performers_query(subject, exam_type)
+        best = list(collection.find(query, PERFORMER_PROJECTION).sort("total_score", -1).limit(top)) if top else []
+        worst = list(collection.find(query, PERFORMER_PROJECTION).sort("total_score", 1).limit(top)) if top else []
+
+    return JsonResponse(analytics_payload(summary, best, worst))
+
+
+@csrf_exempt
+async def class_analytics_async(request):
+    subject, exam_type, top, error = read_analytics_request(request)
+    if error:
+        return error
+
+    students = get_mongo_db()['students']
+    summaries = get_mongo_db()['ClassAnalytics']
+    with timed('analytics_read'):
+        summary = await summaries.find_one({"subject": subject, "exam_type": exam_type}, {"_id": 0})
+        if summary is None:
+            summary = await arebuild_summary(students, summaries, subject, exam_type)
+        if summary is None:
+            return JsonResponse({'error': 'No results for this subject and exam_type'}, status=404)
+        query = performers_query(subject, exam_type)
+        best = worst = []
+        if top:
+            best = await students.find(query, PERFORMER_PROJECTION).sort("total_score", -1).limit(top).to_list()
+            worst = await students.find(query, PERFORMER_PROJECTION).sort("total_score", 1).limit(top).to_list()
+
+    return JsonResponse(analytics_payload(summary, best, worst))
+
+
+# ---- Marks export for a subject and exam ----
+EXPORT_PROJECTION = {'_id': 0, 'usn': 1, 'feedbacks.qno': 1, 'feedbacks.score': 1, 'feedbacks.total': 1}
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a stream"""
+
+    def write(self, value):
+        return value
+
+
+def read_export_request(request):
+    """Return (fields, None) or (None, error_response)."""
+    if request.method != 'GET':
+        return None, JsonResponse({'error': 'Only GET allowed'}, status=405)
+    subject = request.GET.get("subject")
+    exam_type = request.GET.get("exam_type")
+    export_format = request.GET.get("format", "csv").lower()
+    if not subject or not exam_type:
+        return None, JsonResponse({'error': 'subject and exam_type are required'}, status=400)
+    if export_format not in ('csv', 'xlsx'):
+        return None, JsonResponse({'error': 'format must be csv or xlsx'}, status=400)
+
+    query = {"subject": subject, "exam_type": exam_type}
+    # Sections are selected by USN prefix, e.g. ?section=1RV22CS&section=1RV22IS
+    sections = request.GET.getlist("section")
+    if sections:
+        query["usn"] = {"$in": [re.compile("^" + re.escape(section)) for section in sections]}
+    return {
+        'query': query,
+        'class': {"subject": subject, "exam_type": exam_type},
+        'format': export_format,
+        'filename': re.sub(r'[^A-Za-z0-9_-]+', '_', f"{subject}_{exam_type}_marks"),
+    }, None
+
+
+def export_columns(qnos):
+    return ["USN"] + [f"Q{qno}" for qno in qnos] + ["Total", "Max Total"]
+
+
+def export_row(document, qnos):
+    scores = {}
+    max_total = 0
+    for item in document.get("feedbacks") or []:
+        scores[item.get("qno")] = item.get("score")
+        max_total += int(item.get("total") or 0)
+    total = sum(float(score or 0) for score in scores.values())
+    return [document.get("usn")] + [scores.get(qno, "") for qno in qnos] + [total, max_total]
+
+
+def export_qnos(summary, distinct_qnos):
+    # The class summary already lists the questions; fall back to the students' feedback
+    questions = (summary or {}).get("questions") or {}
+    qnos = [int(qno) for qno, stats in questions.items() if stats.get("count")]
+    return sorted(qnos or (int(qno) for qno in distinct_qnos if qno is not None))
+
+
+def export_cursor(fields):
+    return collection.find(fields['query'], EXPORT_PROJECTION).sort("usn", 1).batch_size(settings.EXPORT_BATCH_SIZE)
+
+
+def csv_lines(rows, qnos):
+    writer = csv.writer(Echo())
+    yield writer.writerow(export_columns(qnos))
+    for document in rows:
+        yield writer.writerow(export_row(document, qnos))
+
+
+async def acsv_lines(rows, qnos):
+    writer = csv.writer(Echo())
+    yield writer.writerow(export_columns(qnos))
+    async for document in rows:
+        yield writer.writerow(export_row(document, qnos))
+
+
+def write_xlsx(rows, qnos):
+    """
+    Write the sheet to a temporary file, row by row, and return it opened for
+    reading; the file is already unlinked so it goes away once the response is sent.
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        raise RuntimeError("XLSX export needs the XlsxWriter package")
+
+    handle, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(handle)
+    try:
+        # constant_memory flushes each row to disk once the next one starts
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        sheet = workbook.add_worksheet("Marks")
+        sheet.write_row(0, 0, export_columns(qnos))
+        for row_number, document in enumerate(rows, start=1):
+            sheet.write_row(row_number, 0, export_row(document, qnos))
+        workbook.close()
+        return open(path, 'rb')
+    finally:
+        os.unlink(path)
+
+
+def export_response(fields, content):
+    if fields['format'] == 'xlsx':
+        return FileResponse(content, as_attachment=True, filename=f"{fields['filename']}.xlsx",
+                            content_type=XLSX_CONTENT_TYPE)
+    response = StreamingHttpResponse(content, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{fields["filename"]}.csv"'
+    return response
+
+
+def sync_export_content(fields):
+    summary = analytics_collection.find_one(fields['class'], {"_id": 0, "questions": 1})
+    distinct_qnos = [] if summary else collection.distinct("feedbacks.qno", fields['query'])
+    qnos = export_qnos(summary, distinct_qnos)
+    if fields['format'] == 'xlsx':
+        with timed('marks_export'):
+            return write_xlsx(export_cursor(fields), qnos)
+    return csv_lines(export_cursor(fields), qnos)
+
+
+@csrf_exempt
+def export_marks(request):
+    fields, error = read_export_request(request)
+    if error:
+        return error
+    try:
+        return export_response(fields, sync_export_content(fields))
+    except Exception as e:
+        logger.exception(f"Error in export_marks: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+async def export_marks_async(request):
+    fields, error = read_export_request(request)
+    if error:
+        return error
+    try:
+        if fields['format'] == 'xlsx':
+            # The sheet is written by the synchronous driver on a worker thread
+            content = await sync_to_async(sync_export_content, thread_sensitive=False)(fields)
+            return export_response(fields, content)
+
+        students = get_mongo_db()['students']
+        summary = await get_mongo_db()['ClassAnalytics'].find_one(fields['class'], {"_id": 0, "questions": 1})
+        distinct_qnos = [] if summary else await students.distinct("feedbacks.qno", fields['query'])
+        qnos = export_qnos(summary, distinct_qnos)
+        rows = students.find(fields['query'], EXPORT_PROJECTION).sort("usn", 1).batch_size(settings.EXPORT_BATCH_SIZE)
+        return export_response(fields, acsv_lines(rows, qnos))
+    except Exception as e:
+        logger.exception(f"Error in export_marks: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
@@ -0,0 +1,78 @@
+"""
+Marking rubrics, written once per question when a paper is uploaded and
+stored on the question as "rubric" (with "rubric_source": "generated" or
+"teacher"). Evaluate grades against the rubric instead of re-deriving a full
+answer for every student.
+"""
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from Grader.clients import get_sync_groq_client
+from Grader.metrics import timed
+from Grader.ratelimit import create_completion
+
+logger = logging.getLogger(__name__)
+
+RUBRIC_PROMPT = """Write a compact marking rubric for this exam question{marks_clause}.
+First a model answer of at most 80 words, then at most 6 key points an answer must make{points_clause}.
+Plain text in exactly this layout, nothing before or after it:
+Model answer: <model answer>
+Key points:
+- <point>{point_marks}
+
+Question: {question}"""
+
+
+def rubric_prompt(question, marks=None):
+    if marks:
+        return RUBRIC_PROMPT.format(
+            question=question,
+            marks_clause=f" worth {marks} marks",
+            points_clause=f", with the marks each earns, totalling {marks}",
+            point_marks=" (<marks>)",
+        )
+    return RUBRIC_PROMPT.format(question=question, marks_clause="", points_clause=", most important first",
+                                point_marks="")
+
+
+def generate_rubric(question, marks=None):
+    with timed('rubric_generation'):
+        completion = create_completion(
+            get_sync_groq_client(),
+            model=settings.RUBRIC_MODEL,
+            messages=[{"role": "user", "content": rubric_prompt(question, marks)}],
+            temperature=0,
+            max_completion_tokens=settings.RUBRIC_MAX_TOKENS,
+        )
+    return completion.choices[0].message.content.strip()
+
+
+def _rubric_or_none(question):
+    try:
+        return generate_rubric(question['question'], question.get('marks'))
+    except Exception as e:
+        # The paper is stored either way; the rubric can be generated or written later
+        logger.error(f"Rubric generation failed for question {question.get('qno')}: {e}")
+        return None
+
+
+def add_generated_rubrics(questions):
+    """Fill in a rubric for every question that has none. Returns how many were generated."""
+    missing = [question for question in questions if not question.get('rubric')]
+    if not missing:
+        return 0
+    workers = max(1, min(settings.RUBRIC_WORKERS, len(missing)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Copied here rather than in the worker, so every call keeps the request's priority
+        futures = [executor.submit(contextvars.copy_context().run, _rubric_or_none, question) for question in missing]
+    rubrics = [future.result() for future in futures]
+    generated = 0
+    for question, rubric in zip(missing, rubrics):
+        if rubric:
+            question['rubric'] = rubric
+            question['rubric_source'] = 'generated'
+            generated += 1
+    return generated
@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import upload_question_paper_json
+from .views import question_rubrics, upload_question_paper_json
 
 urlpatterns = [
     path('upload_qp_json/', upload_question_paper_json, name='upload_qp_image'),
+    path('rubrics/', question_rubrics, name='question_rubrics'),
 ]
@@ -1,13 +1,18 @@
-from django.http import JsonResponse
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import pymongo
 from bson import Binary
 import json
 
-client = pymongo.MongoClient('mongodb://localhost:27017/')
+from Evaluate.answer_cache import forget_question
+from Grader.responses import JsonResponse, loads
+from UploadQP.rubrics import add_generated_rubrics, generate_rubric
+
+client = pymongo.MongoClient(settings.MONGO_URI)
 db = client['GraderPro']
 question_papers_collection = db['QuestionPaper']
+answer_cache_collection = db['AnswerCache']
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -18,7 +23,7 @@ def upload_question_paper_json(request):
         if not questions_json:
             return JsonResponse({'error': 'Missing questions field.'}, status=400)
 
-        questions = json.loads(questions_json)
+        questions = loads(questions_json)
         
         if not isinstance(questions, list):
             return JsonResponse({'error': 'Questions must be a list.'}, status=400)
@@ -49,11 +54,23 @@ def upload_question_paper_json(request):
                     'data': Binary(image_file.read())
                 }
 
-            processed_questions.append({
+            processed_question = {
                 'qno': qno,
                 'question': question_text,
                 'image': image_data
-            })
+            }
+            # Optional marks for the question, and a rubric the teacher wrote
+            if q.get('marks') is not None:
+                processed_question['marks'] = q['marks']
+            if q.get('rubric'):
+                processed_question['rubric'] = q['rubric']
+                processed_question['rubric_source'] = 'teacher'
+            processed_questions.append(processed_question)
+
+        # Rubrics are written once here, so grading does not re-derive them for every student
+        rubrics_generated = 0
+        if request.POST.get('generate_rubrics', '').lower() in ('1', 'true', 'yes'):
+            rubrics_generated = add_generated_rubrics(processed_questions)
 
         result = question_papers_collection.insert_one({
             'exam_type': exam_type,
@@ -61,9 +78,69 @@ def upload_question_paper_json(request):
             'questions': processed_questions
         })
 
-        return JsonResponse({'message': 'Question paper uploaded successfully!', 'id': str(result.inserted_id)}, status=201)
+        return JsonResponse({
+            'message': 'Question paper uploaded successfully!',
+            'id': str(result.inserted_id),
+            'rubrics_generated': rubrics_generated,
+        }, status=201)
 
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON format.'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "PUT"])
+def question_rubrics(request):
+    """
+    GET ?subject=&exam_type=: the rubric of every question of the paper.
+    PUT {"subject", "exam_type", "qno", "rubric"}: replace one question's rubric
+    with the teacher's; an empty rubric with "generate": true writes a new one.
+    """
+    if request.method == 'GET':
+        subject = request.GET.get('subject')
+        exam_type = request.GET.get('exam_type')
+        if not exam_type or not subject:
+            return JsonResponse({'error': 'Missing exam_type or subject field.'}, status=400)
+        paper = question_papers_collection.find_one(
+            {'subject': subject, 'exam_type': exam_type},
+            {'_id': 0, 'questions.qno': 1, 'questions.question': 1, 'questions.marks': 1,
+             'questions.rubric': 1, 'questions.rubric_source': 1})
+        if not paper:
+            return JsonResponse({'error': 'Question paper not found.'}, status=404)
+        return JsonResponse({'subject': subject, 'exam_type': exam_type, 'questions': paper.get('questions', [])})
+
+    try:
+        data = loads(request.body)
+        subject = data['subject']
+        exam_type = data['exam_type']
+        qno = data['qno']
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format.'}, status=400)
+    except KeyError as e:
+        return JsonResponse({'error': f'Missing {e.args[0]} field.'}, status=400)
+
+    query = {'subject': subject, 'exam_type': exam_type, 'questions.qno': qno}
+    rubric = (data.get('rubric') or '').strip()
+    source = 'teacher'
+    if not rubric:
+        if not data.get('generate'):
+            return JsonResponse({'error': 'Provide a rubric, or "generate": true.'}, status=400)
+        paper = question_papers_collection.find_one(query, {'questions.$': 1})
+        if not paper:
+            return JsonResponse({'error': 'Question not found.'}, status=404)
+        question = paper['questions'][0]
+        try:
+            rubric = generate_rubric(question['question'], question.get('marks'))
+        except Exception as e:
+            return JsonResponse({'error': 'Rubric generation failed', 'details': str(e)}, status=502)
+        source = 'generated'
+
+    result = question_papers_collection.update_one(
+        query, {'$set': {'questions.$.rubric': rubric, 'questions.$.rubric_source': source}})
+    if not result.matched_count:
+        return JsonResponse({'error': 'Question not found.'}, status=404)
+    # Grades cached against the old rubric must not be reused
+    forget_question(answer_cache_collection, subject, exam_type, qno)
+    return JsonResponse({'qno': qno, 'rubric': rubric, 'rubric_source': source})
@@ -0,0 +1,100 @@
+"""
+Measure the semantic answer cache offline, on answers that are already graded.
+
+The answers of each question are replayed in order through the same matching
+the live cache uses. An answer the cache would answer is a hit, scored against
+the grade the model actually gave it; a miss is "graded" and stored. No model
+calls are made and nothing is written.
+
+Answers come from the students collection (--subject/--exam-type), or from a
+JSON file, a list of {"question", "answer", "score", "total"} objects.
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_answer_cache --subject OS --exam-type CIE
+    python -m benchmarks.bench_answer_cache --file graded.json --thresholds 0.9 0.93 0.95 0.97
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from collections import defaultdict
+
+import django
+
+
+def graded_answers(args):
+    if args.file:
+        with open(args.file) as f:
+            return json.load(f)
+
+    from django.conf import settings
+    from pymongo import MongoClient
+
+    students = MongoClient(settings.MONGO_URI)['GraderPro']['students']
+    answers = []
+    query = {'subject': args.subject, 'exam_type': args.exam_type}
+    for document in students.find(query, {'_id': 0, 'usn': 1, 'feedbacks': 1}).sort('usn', 1):
+        for item in document.get('feedbacks') or []:
+            answers.append({**item, 'usn': document['usn']})
+    return answers
+
+
+def replay(answers, vectors, lengths, threshold, min_length_ratio):
+    from Evaluate.answer_cache import best_match
+
+    stored = defaultdict(list)
+    hits = []
+    for answer, vector, length in zip(answers, vectors, lengths):
+        key = (answer.get('question'), answer.get('total'))
+        match, _ = best_match(vector, length, stored[key], threshold, min_length_ratio)
+        if match is None:
+            stored[key].append({'embedding': vector, 'length': length, 'score': float(answer['score'])})
+        else:
+            hits.append((match['score'], float(answer['score'])))
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subject')
+    parser.add_argument('--exam-type')
+    parser.add_argument('--file', help='JSON list of graded answers instead of the students collection')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.9, 0.93, 0.95, 0.97, 0.99])
+    parser.add_argument('--min-length-ratio', type=float, help='defaults to ANSWER_CACHE_MIN_LENGTH_RATIO')
+    args = parser.parse_args()
+    if not args.file and not (args.subject and args.exam_type):
+        parser.error('give --file, or --subject and --exam-type')
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    from django.conf import settings
+    from Evaluate.answer_cache import normalize_answer
+    from ragpipe.views import get_embedding_model
+
+    answers = [a for a in graded_answers(args) if a.get('answer') and a.get('score') is not None]
+    texts = [normalize_answer(a['answer']) for a in answers]
+    vectors = get_embedding_model().encode(texts, normalize_embeddings=True)
+    lengths = [len(text.split()) for text in texts]
+    min_length_ratio = args.min_length_ratio
+    if min_length_ratio is None:
+        min_length_ratio = settings.ANSWER_CACHE_MIN_LENGTH_RATIO
+
+    print(f"{len(answers)} graded answers to {len({a.get('question') for a in answers})} questions, "
+          f"min length ratio {min_length_ratio}")
+    print(f"{'threshold':>9} {'hits':>6} {'hit rate':>9} {'same score':>11} {'within 0.5':>11} {'mean |diff|':>12}")
+    for threshold in args.thresholds:
+        hits = replay(answers, vectors, lengths, threshold, min_length_ratio)
+        if hits:
+            same = sum(reused == actual for reused, actual in hits) / len(hits)
+            close = sum(abs(reused - actual) <= 0.5 for reused, actual in hits) / len(hits)
+            diff = statistics.mean(abs(reused - actual) for reused, actual in hits)
+        else:
+            same = close = diff = float('nan')
+        print(f"{threshold:>9.2f} {len(hits):>6} {len(hits) / max(len(answers), 1):>9.2%} "
+              f"{same:>11.2%} {close:>11.2%} {diff:>12.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Estimate what question-major grading saves on a class, offline.
+
+Every answer is laid out the way /evaluate/script/ would send it (one model
+call per answer) and the way /evaluate/class/ would (the answers to a question
+batched behind a shared prefix), and the calls and prompt tokens of both are
+counted the way the rate limiter estimates them. No model calls are made.
+
+Answers come from the students collection (--subject/--exam-type), or from a
+JSON file, a list of {"usn", "qno", "question", "answer"} objects.
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_batch_grading --subject OS --exam-type CIE
+    python -m benchmarks.bench_batch_grading --file graded.json --sizes 4 8 16
+"""
+import argparse
+import json
+import os
+import sys
+
+import django
+
+
+def class_answers(args):
+    if args.file:
+        with open(args.file) as f:
+            return json.load(f)
+
+    from django.conf import settings
+    from pymongo import MongoClient
+
+    students = MongoClient(settings.MONGO_URI)['GraderPro']['students']
+    answers = []
+    query = {'subject': args.subject, 'exam_type': args.exam_type}
+    for document in students.find(query, {'_id': 0, 'usn': 1, 'feedbacks': 1}):
+        for item in document.get('feedbacks') or []:
+            answers.append({**item, 'usn': document['usn']})
+    return answers
+
+
+def students_payload(answers):
+    students = {}
+    for answer in answers:
+        students.setdefault(answer['usn'], []).append(
+            {'qno': answer.get('qno'), 'question': answer.get('question'), 'answer': answer.get('answer')})
+    return [{'usn': usn, 'questions': questions} for usn, questions in students.items()]
+
+
+def prompt_tokens(payload):
+    # The rate limiter's estimate, without the completion it budgets for
+    return sum(len(message['content']) // 4 + 1 for message in payload['messages'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subject')
+    parser.add_argument('--exam-type')
+    parser.add_argument('--file', help='JSON list of answers instead of the students collection')
+    parser.add_argument('--total', type=int, default=10)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args()
+    if not args.file and not (args.subject and args.exam_type):
+        parser.error('give --file, or --subject and --exam-type')
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    from django.test import override_settings
+    from Evaluate.batch import batch_prefix
+    from Evaluate.views import batch_grading_request, class_jobs, grading_request
+
+    students = students_payload([a for a in class_answers(args) if a.get('question') and a.get('answer')])
+    single = [grading_request(idx, q, args.total)[0] for student in students
+              for idx, q in enumerate(student['questions'])]
+    single_tokens = sum(prompt_tokens(payload) for payload in single)
+    print(f"{len(students)} students, {len(single)} answers; one call per answer: "
+          f"{len(single)} calls, ~{single_tokens} prompt tokens")
+
+    print(f"{'size':>5} {'calls':>6} {'prompt tokens':>14} {'saved':>7} {'prefix share':>13}")
+    for size in args.sizes:
+        with override_settings(BATCH_GRADING_SIZE=size):
+            jobs, _ = class_jobs(students)
+            payloads = [batch_grading_request(batch, args.total) for _, batch in jobs]
+        tokens = sum(prompt_tokens(payload) for payload in payloads)
+        # Prompt tokens in the per-question prefixes, which repeat across that question's calls
+        shared = sum(len(batch_prefix(batch[0]['q'].get('question'), batch[0]['q'].get('rubric'), args.total)) // 4
+                     for _, batch in jobs)
+        print(f"{size:>5} {len(payloads):>6} {tokens:>14} {1 - tokens / max(single_tokens, 1):>7.1%} "
+              f"{shared / max(tokens, 1):>13.1%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
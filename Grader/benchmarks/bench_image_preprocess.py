@@ -0,0 +1,103 @@
+"""
+Benchmark the image preprocessing stage.
+
+Reports the bytes that would be sent to the vision model for each image with and
+without preprocessing, and the time spent preprocessing serially and through the
+process pool. With --live the OCR request in imgtotext is sent to Groq for both
+variants and the end-to-end latency is reported as well (this spends API quota).
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_image_preprocess
+    python -m benchmarks.bench_image_preprocess ../1.jpeg ../2.jpeg --max-dimension 1280 --live
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+import django
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+DEFAULT_IMAGES = [REPO_ROOT / f"{i}.jpeg" for i in range(1, 6)]
+
+
+class NamedBytesIO(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', default=DEFAULT_IMAGES)
+    parser.add_argument('--max-dimension', type=int)
+    parser.add_argument('--quality', type=int)
+    parser.add_argument('--grayscale', action='store_true')
+    parser.add_argument('--autocontrast', action='store_true')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--live', action='store_true', help='also time the OCR request against Groq')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    from django.conf import settings
+    from Grader import imaging
+
+    if args.max_dimension:
+        settings.IMAGE_MAX_DIMENSION = args.max_dimension
+    if args.quality:
+        settings.IMAGE_JPEG_QUALITY = args.quality
+    if args.workers is not None:
+        settings.IMAGE_PREPROCESS_WORKERS = args.workers
+    settings.IMAGE_GRAYSCALE = args.grayscale
+    settings.IMAGE_AUTOCONTRAST = args.autocontrast
+
+    contents = [(Path(p).name, Path(p).read_bytes()) for p in args.images]
+
+    def uploads():
+        return [NamedBytesIO(data, name) for name, data in contents]
+
+    settings.IMAGE_PREPROCESS_ENABLED = False
+    raw_urls = imaging.encode_images(uploads())
+    settings.IMAGE_PREPROCESS_ENABLED = True
+
+    options = imaging.get_preprocess_options()
+    print(f"options: {options}")
+    print(f"{'image':<40} {'raw bytes':>12} {'sent before':>12} {'sent after':>12} {'ratio':>7}")
+    processed_urls = []
+    for (name, data), raw_url in zip(contents, raw_urls):
+        processed_url = imaging.to_data_url(*imaging.preprocess_image(data, **options))
+        processed_urls.append(processed_url)
+        print(f"{name:<40} {len(data):>12} {len(raw_url):>12} {len(processed_url):>12} "
+              f"{len(processed_url) / len(raw_url):>7.2f}")
+    before = sum(len(u) for u in raw_urls)
+    after = sum(len(u) for u in processed_urls)
+    print(f"{'total':<40} {sum(len(d) for _, d in contents):>12} {before:>12} {after:>12} {after / before:>7.2f}")
+
+    start = time.perf_counter()
+    for _, data in contents:
+        imaging.preprocess_image(data, **options)
+    serial = time.perf_counter() - start
+
+    imaging.encode_images(uploads())  # start the pool outside the timed run
+    start = time.perf_counter()
+    imaging.encode_images(uploads())
+    pooled = time.perf_counter() - start
+    print(f"preprocess time: serial {serial * 1000:.1f} ms, "
+          f"pool ({settings.IMAGE_PREPROCESS_WORKERS} workers) {pooled * 1000:.1f} ms")
+
+    if args.live:
+        from imgtotext.views import extract_text_from_images
+
+        for label, urls in (('before', raw_urls), ('after', processed_urls)):
+            start = time.perf_counter()
+            text = extract_text_from_images(urls)
+            elapsed = time.perf_counter() - start
+            print(f"OCR {label}: {elapsed:.2f} s, {len(text)} characters extracted")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark the local diagram-page triage used by ImagePipe.
+
+Each answer set is a list of student pages with the page that holds the
+diagram marked. Reports whether the triage ranks that page first (and within
+the top two), the time spent scoring, and the image bytes that would be sent
+to the vision model for all pages against the top page only.
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_page_triage
+    python -m benchmarks.bench_page_triage --set ../a1.jpeg ../a2.jpeg ../a3.jpeg --diagram-page 2
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+import django
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+ASSETS = REPO_ROOT / "Assests"
+# The sample answer scripts in Assests/: (pages, page holding the diagram)
+DEFAULT_SETS = [
+    ([ASSETS / f"image_{i}_os.jpeg" for i in range(1, 6)], 3),
+    ([ASSETS / f"image_cn_{i}.jpeg" for i in range(1, 6)], 3),
+    ([ASSETS / f"img_se_{i}.jpeg" for i in range(1, 6)], 3),
+]
+
+
+class NamedBytesIO(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--set', nargs='+', help='pages of one answer script, in order')
+    parser.add_argument('--diagram-page', type=int, help='1-based page of --set that holds the diagram')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    from Grader import imaging
+
+    sets = DEFAULT_SETS
+    if args.set:
+        if not args.diagram_page:
+            parser.error('--diagram-page is required with --set')
+        sets = [([Path(p) for p in args.set], args.diagram_page)]
+
+    print(f"{'set':<24} {'pages':>5} {'truth':>5} {'ranked':>12} {'top1':>5} {'top2':>5} "
+          f"{'ms/page':>8} {'bytes all':>10} {'bytes top':>10}")
+    hits_top1 = hits_top2 = 0
+    all_bytes = top_bytes = 0
+    total_time = total_pages = 0
+    for paths, truth in sets:
+        contents = [(p.name, p.read_bytes()) for p in paths]
+
+        start = time.perf_counter()
+        scores = [imaging.diagram_score(data) for _, data in contents]
+        elapsed = time.perf_counter() - start
+        ranking = sorted(range(len(scores)), key=lambda index: -scores[index])
+
+        urls = imaging.encode_images([NamedBytesIO(data, name) for name, data in contents])
+        sent_all = sum(len(url) for url in urls)
+        sent_top = len(urls[ranking[0]])
+
+        top1 = ranking[0] + 1 == truth
+        top2 = truth in [index + 1 for index in ranking[:2]]
+        hits_top1 += top1
+        hits_top2 += top2
+        all_bytes += sent_all
+        top_bytes += sent_top
+        total_time += elapsed
+        total_pages += len(contents)
+        print(f"{paths[0].name:<24} {len(contents):>5} {truth:>5} "
+              f"{','.join(str(index + 1) for index in ranking):>12} {'yes' if top1 else 'no':>5} "
+              f"{'yes' if top2 else 'no':>5} {elapsed / len(contents) * 1000:>8.1f} {sent_all:>10} {sent_top:>10}")
+
+    print(f"top-1 accuracy {hits_top1}/{len(sets)}, top-2 accuracy {hits_top2}/{len(sets)}, "
+          f"{total_time / total_pages * 1000:.1f} ms per page, "
+          f"vision payload {top_bytes / all_bytes:.2f} of sending every page")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Benchmark token-budgeted RAG context against whole textbook pages.
+
+For each question the top-k pages are fetched from a FAISS index built by
+/rag/pipeline/ and assembled at every budget (0 = whole pages, the old
+behaviour). Reports the context tokens and assembly time per budget. With
+--live each question is graded by the model at every budget, and the grading
+latency and agreement with the whole-page score are reported as well (this
+spends API quota).
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_rag_context --index os_index.faiss --meta os_meta.pkl
+    python -m benchmarks.bench_rag_context --index os_index.faiss --meta os_meta.pkl \\
+        --questions questions.json --budgets 0 400 800 --live
+
+questions.json is a list of {"question": ..., "answer": ...} objects.
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import statistics
+import sys
+import time
+
+import django
+
+DEFAULT_QUESTIONS = [
+    {
+        "question": "Explain the concept of a semaphore in operating systems?",
+        "answer": "A semaphore is a variable used to control access to a common resource in a parallel "
+                  "programming environment. It helps in process synchronization.",
+    },
+    {
+        "question": "What are the necessary conditions for deadlock?",
+        "answer": "Mutual exclusion, hold and wait, no preemption and circular wait must all hold at once.",
+    },
+    {
+        "question": "Differentiate between paging and segmentation.",
+        "answer": "Paging splits memory into fixed size frames while segmentation uses variable sized "
+                  "logical segments like code and stack. Paging avoids external fragmentation.",
+    },
+]
+
+GRADING_PROMPT = """You are a knowledgeable and conservative examiner.
+
+Grade the student's answer on a scale of 1 to 5 using the textbook context and your own knowledge.
+
+### Textbook Context:
+{context}
+
+### Question:
+{question}
+
+### Student's Answer:
+{answer}
+
+Respond strictly in the following format:
+Score: <number>
+Explanation: <short reasoning>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index', required=True, help='FAISS index written by /rag/pipeline/')
+    parser.add_argument('--meta', required=True, help='metadata pickle written by /rag/pipeline/')
+    parser.add_argument('--questions', help='JSON list of {"question", "answer"}')
+    parser.add_argument('--budgets', type=int, nargs='+', default=[0, 400, 800, 1200])
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--model', default='llama-3.3-70b-versatile')
+    parser.add_argument('--live', action='store_true', help='also grade every question against Groq')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    import faiss
+    import numpy as np
+    from django.conf import settings
+    from ragpipe.context import assemble_context
+    from ragpipe.views import get_embedding_model
+
+    embedding_model = get_embedding_model()
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = json.load(f)
+
+    index = faiss.read_index(args.index)
+    with open(args.meta, 'rb') as f:
+        pages = pickle.load(f)['pages']
+
+    # budget -> per-question rows
+    rows = {budget: [] for budget in args.budgets}
+    for item in questions:
+        query_embedding = np.array(embedding_model.encode([item['question']])).astype('float32')
+        _, I = index.search(query_embedding, args.top_k)
+        hits = [pages[idx] for idx in I[0] if idx != -1]
+        for budget in args.budgets:
+            start = time.perf_counter()
+            assembled = assemble_context(
+                item['question'], hits, budget, embedding_model.encode,
+                sentences_per_passage=settings.RAG_CONTEXT_SENTENCES_PER_PASSAGE,
+                query_embedding=query_embedding
+            )
+            rows[budget].append({
+                'item': item,
+                'context': assembled['context'],
+                'tokens': assembled['tokens_used'],
+                'assembly': time.perf_counter() - start,
+            })
+
+    if args.live:
+        from groq import Groq
+        from Grader.ratelimit import create_completion
+
+        client = Groq(api_key=settings.GROQ_API_KEY, base_url=settings.GROQ_BASE_URL, max_retries=0)
+        for budget in args.budgets:
+            for row in rows[budget]:
+                prompt = GRADING_PROMPT.format(context=row['context'], **row['item'])
+                start = time.perf_counter()
+                completion = create_completion(
+                    client,
+                    model=args.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                    max_completion_tokens=256,
+                )
+                row['latency'] = time.perf_counter() - start
+                match = re.search(r'Score:\s*(\d+)', completion.choices[0].message.content)
+                row['score'] = int(match.group(1)) if match else None
+
+    print(f"{len(questions)} questions, top_k={args.top_k}")
+    header = f"{'budget':>8} {'mean tokens':>12} {'max tokens':>11} {'assembly ms':>12}"
+    if args.live:
+        header += f" {'grade p50 s':>12} {'agreement':>10} {'mean |diff|':>12}"
+    print(header)
+    reference = rows[args.budgets[0]]
+    for budget in args.budgets:
+        budget_rows = rows[budget]
+        tokens = [row['tokens'] for row in budget_rows]
+        line = (f"{budget or 'full':>8} {statistics.mean(tokens):>12.0f} {max(tokens):>11} "
+                f"{statistics.mean(row['assembly'] for row in budget_rows) * 1000:>12.1f}")
+        if args.live:
+            # Agreement is measured against the first budget, the whole pages by default
+            pairs = [(row['score'], ref['score']) for row, ref in zip(budget_rows, reference)
+                     if row['score'] is not None and ref['score'] is not None]
+            agreement = sum(a == b for a, b in pairs) / len(pairs) if pairs else float('nan')
+            diff = statistics.mean(abs(a - b) for a, b in pairs) if pairs else float('nan')
+            line += (f" {statistics.median(row['latency'] for row in budget_rows):>12.2f}"
+                     f" {agreement:>10.2f} {diff:>12.2f}")
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
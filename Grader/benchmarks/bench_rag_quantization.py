@@ -0,0 +1,113 @@
+"""
+Benchmark quantized textbook indexes against the exact float32 flat index.
+
+Pages come from a metadata pickle written by /rag/pipeline/ and are embedded
+with the app's model, with one sentence of a random page per query. Without
+--meta, clustered random vectors stand in for the pages and queries, so the
+benchmark also runs where the embedding model is not installed.
+
+For every storage (flat, fp16, sq8, pq), with and without full-precision
+re-ranking, the report shows the index size, the build time, the search
+latency per query and the recall@k against the exact top k.
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_rag_quantization
+    python -m benchmarks.bench_rag_quantization --meta os_meta.pkl --queries 200 --rerank 20 50
+"""
+import argparse
+import os
+import pickle
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import django
+
+
+def synthetic(pages, queries, dim, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    # Pages cluster around topics, as chapters of a textbook do
+    topics = rng.normal(size=(max(1, pages // 20), dim))
+    vectors = topics[rng.integers(0, len(topics), pages)] + 0.6 * rng.normal(size=(pages, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    asked = vectors[rng.integers(0, pages, queries)] + 0.8 * rng.normal(size=(queries, dim)) / np.sqrt(dim)
+    return vectors.astype('float32'), asked.astype('float32')
+
+
+def from_meta(meta_file, queries, seed=0):
+    import numpy as np
+    from ragpipe.views import get_embedding_model
+
+    with open(meta_file, 'rb') as f:
+        pages = pickle.load(f)['pages']
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(queries):
+        sentences = [s for s in re.split(r'(?<=[.!?])\s+', rng.choice(pages)['text']) if len(s) > 30]
+        if sentences:
+            questions.append(rng.choice(sentences))
+    model = get_embedding_model()
+    vectors = np.array(model.encode([page['text'] for page in pages])).astype('float32')
+    return vectors, np.array(model.encode(questions)).astype('float32')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--meta', help='metadata pickle written by /rag/pipeline/')
+    parser.add_argument('--pages', type=int, default=2000, help='synthetic pages without --meta')
+    parser.add_argument('--dim', type=int, default=384, help='synthetic embedding size without --meta')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--rerank', type=int, nargs='*', default=[20], help='re-ranking candidate counts to try')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    import numpy as np
+    from django.conf import settings
+    from ragpipe.indexing import QUANTIZATIONS, build_index, index_bytes, load_vectors, search
+
+    if args.meta:
+        vectors, queries = from_meta(args.meta, args.queries)
+    else:
+        vectors, queries = synthetic(args.pages, args.queries, args.dim)
+    k = args.top_k
+
+    _, truth = build_index(vectors, 'flat').search(queries, k)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vectors_path = os.path.join(workdir, 'vectors.npy')
+        np.save(vectors_path, vectors)
+        full_precision = load_vectors(vectors_path)
+
+        print(f"{len(vectors)} pages of {vectors.shape[1]} dims, {len(queries)} queries, recall@{k}")
+        print(f"{'index':<8} {'rerank':>6} {'bytes':>11} {'bytes/page':>10} {'build ms':>9} "
+              f"{'search us':>10} {'recall':>7}")
+        for quantization in QUANTIZATIONS:
+            start = time.perf_counter()
+            index = build_index(vectors, quantization, pq_subquantizers=settings.RAG_PQ_SUBQUANTIZERS)
+            build_ms = (time.perf_counter() - start) * 1000
+            size = index_bytes(index)
+            for rerank in [0] + ([] if quantization == 'flat' else args.rerank):
+                latencies = []
+                found = []
+                # One query at a time, as similarity_search_view searches
+                for query in queries:
+                    start = time.perf_counter()
+                    _, ids = search(index, query[None, :], k, full_precision, rerank)
+                    latencies.append(time.perf_counter() - start)
+                    found.append(ids[0])
+                recall = statistics.mean(
+                    len(set(row) & set(expected)) / k for row, expected in zip(found, truth))
+                print(f"{quantization:<8} {rerank or '-':>6} {size:>11} {size / len(vectors):>10.0f} "
+                      f"{build_ms:>9.1f} {statistics.median(latencies) * 1e6:>10.1f} {recall:>7.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
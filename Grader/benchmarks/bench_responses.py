@@ -0,0 +1,93 @@
+"""
+Benchmark JSON encoding and response compression on the largest payloads the
+API returns: a question paper's page images as base64, a class's feedback
+lists, and the page text of a textbook sent back by /rag/pipeline/.
+
+Reports stdlib json against orjson (when installed) for dumps/loads, and the
+body size and time of gzip against brotli (when installed) at the configured
+quality.
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_responses
+    python -m benchmarks.bench_responses --students 300 --repeat 50
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+import django
+
+WORDS = ("process thread deadlock semaphore paging segment kernel scheduler memory frame "
+         "interrupt mutex buffer queue cache latency throughput socket packet router").split()
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.'
+
+
+def payloads(students, pages):
+    rng = random.Random(0)
+    paper = {'image_base64': [base64.b64encode(rng.randbytes(120_000)).decode() for _ in range(pages)]}
+    feedback = {'results': [
+        {
+            'usn': f"1MS21CS{index:03d}",
+            'feedbacks': [
+                {'qno': qno, 'score': rng.randint(0, 10) / 2, 'total': 5, 'feedback': sentence(rng, 40)}
+                for qno in range(1, 11)
+            ],
+        }
+        for index in range(students)
+    ]}
+    textbook = {'pages': [{'page': page, 'text': ' '.join(sentence(rng, 14) for _ in range(25))}
+                          for page in range(1, 301)]}
+    return {'paper': paper, 'feedback': feedback, 'textbook': textbook}
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=120)
+    parser.add_argument('--pages', type=int, default=5, help='question paper pages')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    from django.conf import settings
+    from Grader import responses
+
+    print(f"orjson {'installed' if responses.orjson else 'missing'}, "
+          f"brotli {'installed' if responses.brotli else 'missing'}")
+    print(f"{'payload':<10} {'bytes':>10} {'json dumps':>11} {'fast dumps':>11} {'json loads':>11} "
+          f"{'fast loads':>11} {'gzip bytes':>11} {'gzip ms':>8} {'br bytes':>10} {'br ms':>7}")
+    for name, data in payloads(args.students, args.pages).items():
+        body, json_dumps = timed(lambda: json.dumps(data).encode('utf-8'), args.repeat)
+        _, fast_dumps = timed(lambda: responses.dumps(data), args.repeat)
+        _, json_loads = timed(lambda: json.loads(body), args.repeat)
+        _, fast_loads = timed(lambda: responses.loads(body), args.repeat)
+        # The level GZipMiddleware uses
+        gzipped, gzip_ms = timed(lambda: gzip.compress(body, compresslevel=6), args.repeat)
+        line = (f"{name:<10} {len(body):>10} {json_dumps:>11.2f} {fast_dumps:>11.2f} {json_loads:>11.2f} "
+                f"{fast_loads:>11.2f} {len(gzipped):>11} {gzip_ms:>8.2f}")
+        if responses.brotli:
+            compressed, brotli_ms = timed(
+                lambda: responses.brotli.compress(body, quality=settings.RESPONSE_BROTLI_QUALITY), args.repeat)
+            line += f" {len(compressed):>10} {brotli_ms:>7.2f}"
+        print(line)
+    print("times are ms per call")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Benchmark cold start: django.setup() plus loading the URLconf, which imports
+the views of every app, the way manage.py runserver, gunicorn and every
+autoreload do.
+
+Each run is a fresh interpreter under `python -X importtime`. The report shows
+the wall time of both phases, the slowest imports and the import time of each
+app's views. The run fails (exit status 1) when the median start exceeds
+--budget-ms or when any of the heavy dependencies that the views import lazily
+(faiss, sentence_transformers/torch, PyPDF2, the Groq SDK, ...) is imported
+at startup, so it can guard cold start in CI.
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 5 --budget-ms 1500 --top 25
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+GRADER_DIR = Path(__file__).resolve().parent.parent
+
+# Imported on first use by the views; none of them may be loaded at startup
+LAZY_MODULES = ('faiss', 'torch', 'sentence_transformers', 'transformers', 'onnxruntime', 'openvino', 'PyPDF2',
+                'groq', 'numpy', 'xlsxwriter')
+
+APP_VIEWS = ('UploadQP.views', 'Student.views', 'Evaluate.views', 'ragpipe.views', 'imgtotext.views',
+             'ImageEval.views', 'ImagePipe.views')
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls = time.perf_counter()
+print(json.dumps({'setup': setup - start, 'urls': urls - setup, 'modules': sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr):
+    """{module: (self us, cumulative us, depth)} from `-X importtime` output."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return imports
+
+
+def start_once(env):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+        cwd=GRADER_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"startup failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters to start; the median is reported')
+    parser.add_argument('--budget-ms', type=float, default=1500, help='fail above this median startup time')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    args = parser.parse_args()
+
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'Grader.settings')}
+    runs = [start_once(env) for _ in range(args.runs)]
+    timings = [timing for timing, _ in runs]
+    # The import tree of the median run
+    median_run = sorted(runs, key=lambda run: run[0]['setup'] + run[0]['urls'])[len(runs) // 2]
+    timing, imports = median_run
+
+    setup_ms = statistics.median(t['setup'] for t in timings) * 1000
+    urls_ms = statistics.median(t['urls'] for t in timings) * 1000
+    total_ms = statistics.median(t['setup'] + t['urls'] for t in timings) * 1000
+    print(f"{args.runs} runs, median: django.setup() {setup_ms:.0f} ms, URLconf and views {urls_ms:.0f} ms, "
+          f"total {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    print(f"\n{'slowest imports':<48} {'cumulative ms':>14} {'self ms':>8}")
+    slowest = sorted(imports.items(), key=lambda item: -item[1][1])
+    # Top-level packages only, so a package and its own submodules are not listed twice
+    listed = [(name, t) for name, t in slowest if '.' not in name][:args.top]
+    for name, (self_us, cumulative_us, _) in listed:
+        print(f"{name:<48} {cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}")
+
+    print(f"\n{'app views':<48} {'cumulative ms':>14}")
+    for name in APP_VIEWS:
+        if name in imports:
+            print(f"{name:<48} {imports[name][1] / 1000:>14.1f}")
+        else:
+            print(f"{name:<48} {'not loaded':>14}")
+
+    loaded = set(timing['modules'])
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    failed = False
+    if eager:
+        print(f"\nFAIL: imported at startup but meant to be lazy: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"\nFAIL: startup {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
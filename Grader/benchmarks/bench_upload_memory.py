@@ -0,0 +1,95 @@
+"""
+Benchmark peak memory of handling one multi-page upload.
+
+Each scenario parses a multipart request carrying the answer-script pages,
+turns every page into a data URL and serialises the vision request body, with
+tracemalloc recording the peak Python allocation up to the encoded pages
+("upload peak") and for the whole request including the body ("request peak"):
+
+    legacy      files parsed into memory, file.read() + b64encode().decode()
+    spooled     files spooled to disk, base64 encoded without preprocessing
+    preprocess  spooled plus the preprocessing stage (run in-process so its
+                allocations are counted)
+
+Run from the Grader/ directory:
+    python -m benchmarks.bench_upload_memory
+    python -m benchmarks.bench_upload_memory ../1.jpeg ../2.jpeg --copies 4
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+import django
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+DEFAULT_IMAGES = [REPO_ROOT / f"{i}.jpeg" for i in range(1, 6)]
+
+
+def legacy_encode(image_file):
+    return f"data:image/png;base64,{base64.b64encode(image_file.read()).decode('utf-8')}"
+
+
+def build_request(paths, copies):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import RequestFactory
+
+    files = [
+        SimpleUploadedFile(f"{i}_{Path(p).name}", Path(p).read_bytes(), content_type='image/jpeg')
+        for i in range(copies) for p in paths
+    ]
+    return RequestFactory().post('/imageto/text/', {'subject': 'OS', 'exam_type': 'CIE', 'images': files})
+
+
+def measure(request, encode):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    image_files = request.FILES.getlist('images')
+    image_urls = encode(image_files)
+    _, encode_peak = tracemalloc.get_traced_memory()
+    content = [{"type": "text", "text": "prompt"}] + [
+        {"type": "image_url", "image_url": {"url": url}} for url in image_urls
+    ]
+    body = json.dumps({"messages": [{"role": "user", "content": content}]})
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return encode_peak, peak, len(body), len(image_files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', default=DEFAULT_IMAGES)
+    parser.add_argument('--copies', type=int, default=1, help='repeat the page set to simulate longer scripts')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Grader.settings')
+    django.setup()
+    from django.test import override_settings
+    from Grader import imaging
+
+    legacy_settings = override_settings(
+        FILE_UPLOAD_HANDLERS=[
+            'django.core.files.uploadhandler.MemoryFileUploadHandler',
+            'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+        ],
+        FILE_UPLOAD_MAX_MEMORY_SIZE=2621440,
+    )
+    scenarios = [
+        ('legacy', legacy_settings, lambda files: [legacy_encode(f) for f in files]),
+        ('spooled', override_settings(IMAGE_PREPROCESS_ENABLED=False), imaging.encode_images),
+        ('preprocess', override_settings(IMAGE_PREPROCESS_WORKERS=0), imaging.encode_images),
+    ]
+
+    print(f"{'scenario':<12} {'pages':>6} {'body bytes':>12} {'upload peak':>12} {'request peak':>13}")
+    for name, overrides, encode in scenarios:
+        with overrides:
+            encode_peak, peak, body_size, pages = measure(build_request(args.images, args.copies), encode)
+        print(f"{name:<12} {pages:>6} {body_size:>12} {encode_peak:>12} {peak:>13}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
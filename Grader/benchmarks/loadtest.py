@@ -0,0 +1,491 @@
+"""
+Offline end-to-end load test.
+
+Starts the mock Groq API (benchmarks.mock_groq), a throwaway MongoDB (a
+temporary `mongod`, unless --mongo-uri points at one you do not mind being
+written to), and the GraderPro server with both wired in through environment
+variables. It then drives each endpoint at the requested concurrency and
+reports p50/p95/p99 latency, throughput and the server's peak RSS while that
+endpoint was under load.
+
+Run from the Grader/ directory:
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --endpoints evaluate student-feedback --concurrency 16 --requests 200
+    python -m benchmarks.loadtest --output run.json --baseline baseline.json
+
+WSGI with a thread per request against the async views under ASGI, with the
+model rate limits lifted (benchmarks.settings) so only the server is measured:
+    python -m benchmarks.loadtest --server gunicorn --concurrency 200 --requests 400 \
+        --endpoints evaluate imageto student-feedback \
+        --env DJANGO_SETTINGS_MODULE=benchmarks.settings --output wsgi.json
+    python -m benchmarks.loadtest --server uvicorn --concurrency 200 --requests 400 \
+        --endpoints evaluate imageto student-feedback \
+        --env DJANGO_SETTINGS_MODULE=benchmarks.settings ASYNC_VIEWS=1 --baseline wsgi.json
+
+A grading storm: clients keep uploading answer scripts (--regrade, so none
+reuses an earlier result) while the Student reads are measured. Compare with
+admission control off to see what the light endpoints are spared:
+    python -m benchmarks.loadtest --server gunicorn --storm imageto --storm-concurrency 64 --regrade \
+        --endpoints student-login student-subjects student-feedback \
+        --env DJANGO_SETTINGS_MODULE=benchmarks.settings --output admitted.json
+    python -m benchmarks.loadtest --server gunicorn --storm imageto --storm-concurrency 64 --regrade \
+        --endpoints student-login student-subjects student-feedback \
+        --env DJANGO_SETTINGS_MODULE=benchmarks.settings ADMISSION_CONTROL=0 --baseline admitted.json
+
+Results are comparable between runs when the configuration block matches; the
+mock's latencies and 429s come from a seeded generator.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from benchmarks.mock_groq import MockGroqServer
+
+GRADER_DIR = Path(__file__).resolve().parent.parent
+REPO_ROOT = GRADER_DIR.parent
+PAGES = [REPO_ROOT / f"{i}.jpeg" for i in range(1, 6)]
+REFERENCE_IMAGE = REPO_ROOT / 'Assests' / 'reference_os_image.png'
+STUDENT_DIAGRAM = REPO_ROOT / 'Assests' / 'image_3_os.jpeg'
+
+SUBJECT = 'BENCH'
+EXAM_TYPE = 'CIE'
+PASSWORD = 'bench-password'
+STUDENT_COUNT = 50
+
+RAG_PAGES = [
+    "A semaphore is an integer variable used to control access to a shared resource by multiple processes.",
+    "Deadlock occurs when a set of processes are blocked because each holds a resource and waits for another.",
+    "Paging divides physical memory into fixed-size frames and logical memory into pages of the same size.",
+    "The TCP three-way handshake establishes a connection using SYN, SYN-ACK and ACK segments.",
+    "A process control block stores the state, program counter, registers and scheduling information of a process.",
+]
+
+SERVER_COMMANDS = {
+    'runserver': '{python} manage.py runserver 127.0.0.1:{port} --noreload',
+    'gunicorn': '{python} -m gunicorn Grader.wsgi:application --bind 127.0.0.1:{port} --workers 1 '
+                '--worker-class gthread --threads 64 --timeout 600',
+    'uvicorn': '{python} -m uvicorn Grader.asgi:application --host 127.0.0.1 --port {port} --workers 1',
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def usn(i):
+    return f"1RV22CS{i:03d}"
+
+
+def start_mongod(workdir):
+    mongod = shutil.which('mongod')
+    if not mongod:
+        raise SystemExit("mongod not found on PATH; install MongoDB or pass --mongo-uri of a throwaway instance")
+    port = free_port()
+    dbpath = Path(workdir) / 'db'
+    dbpath.mkdir()
+    proc = subprocess.Popen(
+        [mongod, '--dbpath', str(dbpath), '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+    return proc, f"mongodb://127.0.0.1:{port}/"
+
+
+def seed_mongo(uri, questions):
+    import bcrypt
+    from pymongo import MongoClient
+
+    db = MongoClient(uri)['GraderPro']
+    db['QuestionPaper'].delete_many({'subject': SUBJECT})
+    db['QuestionPaper'].insert_one({
+        'subject': SUBJECT,
+        'exam_type': EXAM_TYPE,
+        'questions': [{'qno': q, 'question': f"Explain concept {q}.", 'image': None} for q in range(1, questions + 1)],
+    })
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    db['Login'].delete_many({'usn': {'$in': [usn(i) for i in range(STUDENT_COUNT)]}})
+    db['Login'].insert_many([{'usn': usn(i), 'password': hashed} for i in range(STUDENT_COUNT)])
+    db['students'].delete_many({'subject': SUBJECT})
+    db['students'].insert_many([{
+        'usn': usn(i), 'subject': SUBJECT, 'exam_type': EXAM_TYPE,
+        'feedbacks': [{'qno': q, 'question': f"Explain concept {q}.", 'answer': 'An answer.',
+                       'feedback': 'Good.', 'score': 3, 'total': 5} for q in range(1, questions + 1)],
+    } for i in range(STUDENT_COUNT)])
+
+
+def build_rag_index(workdir, env):
+    """Build a tiny FAISS index with the app's own code; returns (index_file, meta_file) or None."""
+    script = (
+        "import django, json, sys; django.setup()\n"
+        "from ragpipe.views import embed_pages_and_save\n"
+        "pages = [{'page_number': i + 1, 'text': t} for i, t in enumerate(json.loads(sys.argv[1]))]\n"
+        "print(json.dumps(embed_pages_and_save(pages, sys.argv[2])))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', script, json.dumps(RAG_PAGES * 20), str(Path(workdir) / 'bench')],
+        cwd=GRADER_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(f"skipping rag-search: could not build an index ({result.stderr.strip().splitlines()[-1:]})")
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def make_scenarios(args, rag_files):
+    pages = [p.read_bytes() for p in PAGES[:args.pages]]
+    reference = REFERENCE_IMAGE.read_bytes()
+    diagram = STUDENT_DIAGRAM.read_bytes()
+    questions = [{'question': f"Explain concept {q}.", 'answer': 'A short answer about the concept.'}
+                 for q in range(1, args.questions + 1)]
+
+    def imageto(session, base, i):
+        files = [('images', (f"page{n}.jpeg", data, 'image/jpeg')) for n, data in enumerate(pages, 1)]
+        data = {'subject': SUBJECT, 'exam_type': EXAM_TYPE, 'total': '5', 'usn': usn(i % STUDENT_COUNT)}
+        if args.regrade:
+            data['regrade'] = '1'
+        return session.post(f"{base}/imageto/text/", data=data, files=files, timeout=600)
+
+    def evaluate(session, base, i):
+        body = {'subject': SUBJECT, 'exam_type': EXAM_TYPE, 'total': 5, 'questions': questions}
+        return session.post(f"{base}/evaluate/script/", json=body, timeout=600)
+
+    def imageeval(session, base, i):
+        files = {'reference_image': ('reference.png', reference, 'image/png'),
+                 'student_image': ('student.jpeg', diagram, 'image/jpeg')}
+        return session.post(f"{base}/imageeval/run/", files=files, timeout=600)
+
+    def rag_search(session, base, i):
+        body = {'query': RAG_PAGES[i % len(RAG_PAGES)].split(' is ')[0], 'index_file': rag_files[0],
+                'meta_file': rag_files[1]}
+        return session.post(f"{base}/rag/search/", json=body, timeout=600)
+
+    def student_login(session, base, i):
+        return session.post(f"{base}/student/login/", json={'usn': usn(i % STUDENT_COUNT), 'password': PASSWORD}, timeout=60)
+
+    def student_subjects(session, base, i):
+        return session.post(f"{base}/student/subjects/", json={'usn': usn(i % STUDENT_COUNT)}, timeout=60)
+
+    def student_feedback(session, base, i):
+        params = {'usn': usn(i % STUDENT_COUNT), 'subject': SUBJECT, 'exam_type': EXAM_TYPE}
+        return session.get(f"{base}/student/feedback/", params=params, timeout=60)
+
+    scenarios = {
+        'imageto': imageto,
+        'evaluate': evaluate,
+        'imageeval': imageeval,
+        'student-login': student_login,
+        'student-subjects': student_subjects,
+        'student-feedback': student_feedback,
+    }
+    if rag_files:
+        scenarios['rag-search'] = rag_search
+    return scenarios
+
+
+class RssSampler:
+    """Samples the resident set size of a process and its children."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _children(self):
+        children = []
+        for task in Path(f"/proc/{self.pid}/task").glob('*/children'):
+            try:
+                children.extend(int(c) for c in task.read_text().split())
+            except OSError:
+                pass
+        return children
+
+    def _run(self):
+        while not self._stop.is_set():
+            total = self._rss(self.pid) + sum(self._rss(c) for c in self._children())
+            self.peak = max(self.peak, total)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, fn, base, requests_count, concurrency, server_pid):
+    local = threading.local()
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = fn(local.session, base, i)
+            status = response.status_code
+            response.content
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            if status == 200 or status == 201:
+                latencies.append(elapsed)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    with RssSampler(server_pid) if server_pid else _NullSampler() as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, range(requests_count)))
+        wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': requests_count,
+        'ok': len(latencies),
+        'errors': errors,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'peak_rss_mb': round(sampler.peak / 2 ** 20, 1) if sampler.peak else None,
+    }
+
+
+class Storm:
+    """Keeps `concurrency` clients sending requests of one scenario, back to back, until stopped."""
+
+    def __init__(self, fn, base, concurrency):
+        self.fn = fn
+        self.base = base
+        self.latencies = []
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(concurrency)]
+
+    def _run(self):
+        session = requests.Session()
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            try:
+                response = self.fn(session, self.base, next(self._counter))
+                status = response.status_code
+                response.content
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                if status == 200 or status == 201:
+                    self.latencies.append(elapsed)
+                else:
+                    self.errors[str(status)] = self.errors.get(str(status), 0) + 1
+            if status in (429, 503):
+                # Back off as a well-behaved client would, instead of hammering the rejection path
+                time.sleep(float(response.headers.get('Retry-After') or 1))
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.wall = time.perf_counter() - self._start
+
+    def result(self):
+        latencies = sorted(self.latencies)
+        return {
+            'requests': len(latencies) + sum(self.errors.values()),
+            'ok': len(latencies),
+            'errors': self.errors,
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p95_ms': _ms(percentile(latencies, 95)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+            'throughput_rps': round(len(latencies) / self.wall, 2) if self.wall else None,
+            'peak_rss_mb': None,
+        }
+
+
+class _NullSampler:
+    peak = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_report(results, baseline=None):
+    columns = ['ok', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'peak_rss_mb']
+    print(f"{'endpoint':<18}" + ''.join(f"{c:>16}" for c in columns) + '  errors')
+    for name, result in results.items():
+        cells = []
+        for c in columns:
+            value = result[c]
+            cell = '-' if value is None else str(value)
+            base_value = (baseline or {}).get(name, {}).get(c)
+            if c != 'ok' and value is not None and base_value:
+                cell += f" ({(value - base_value) / base_value * 100:+.0f}%)"
+            cells.append(f"{cell:>16}")
+        print(f"{name:<18}" + ''.join(cells) + f"  {result['errors'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', nargs='*', help='subset of scenarios to run (default: all)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='requests per endpoint')
+    parser.add_argument('--pages', type=int, default=5, help='answer-script pages per /imageto/text/ request')
+    parser.add_argument('--questions', type=int, default=10, help='questions per script')
+    parser.add_argument('--latency', default='lognormal:0.8:0.4', help='mock model latency distribution')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of model calls answered with 429')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='runserver')
+    parser.add_argument('--base-url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='pid to sample RSS from when using --base-url')
+    parser.add_argument('--mongo-uri', help='throwaway MongoDB to use instead of starting mongod')
+    parser.add_argument('--storm', metavar='ENDPOINT',
+                        help='keep this scenario under load the whole time the others are measured')
+    parser.add_argument('--storm-concurrency', type=int, default=64)
+    parser.add_argument('--storm-warmup', type=float, default=5.0,
+                        help='seconds of storm before the first measurement')
+    parser.add_argument('--regrade', action='store_true',
+                        help='post regrade=1 with every upload so none reuses an earlier result')
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the server under test')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'server_pid', 'mongo_uri')}
+    workdir = tempfile.mkdtemp(prefix='grader-bench-')
+    mock = MockGroqServer(latency=args.latency, rate_limit=args.rate_limit,
+                          questions_per_script=args.questions, seed=args.seed).start()
+    mongod = server = None
+    try:
+        if args.mongo_uri:
+            mongo_uri = args.mongo_uri
+        else:
+            mongod, mongo_uri = start_mongod(workdir)
+        seed_mongo(mongo_uri, args.questions)
+
+        port = free_port()
+        base = args.base_url or f"http://127.0.0.1:{port}"
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='Grader.settings', GROQ_BASE_URL=mock.base_url,
+                   MONGO_URI=mongo_uri, OTHER_DJANGO_APP_URL=f"{base}/evaluate/script/",
+                   OTHER_APP_URL=f"{base}/student/feedback/")
+        env.update(item.split('=', 1) for item in args.env)
+        rag_files = build_rag_index(workdir, env)
+
+        server_pid = args.server_pid
+        if not args.base_url:
+            command = SERVER_COMMANDS[args.server].format(python=sys.executable, port=port)
+            server = subprocess.Popen(command.split(), cwd=GRADER_DIR, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_port(port)
+            server_pid = server.pid
+
+        scenarios = make_scenarios(args, rag_files)
+        if args.storm and args.storm not in scenarios:
+            parser.error(f"unknown or unavailable storm endpoint {args.storm}")
+        selected = [name for name in args.endpoints or list(scenarios) if name != args.storm]
+        results = {}
+        storm = Storm(scenarios[args.storm], base, args.storm_concurrency) if args.storm else None
+        with storm or contextlib.nullcontext():
+            if args.storm:
+                time.sleep(args.storm_warmup)
+            for name in selected:
+                if name not in scenarios:
+                    print(f"skipping unknown or unavailable endpoint {name}")
+                    continue
+                results[name] = run_scenario(name, scenarios[name], base, args.requests, args.concurrency,
+                                             server_pid)
+        if args.storm:
+            results[f"storm:{args.storm}"] = storm.result()
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline_run = json.load(f)
+            if baseline_run.get('config') != config:
+                print("warning: baseline was recorded with a different configuration")
+            baseline = baseline_run.get('results')
+        print(f"mock model calls: {mock.stats['requests']} ({mock.stats['rate_limited']} answered 429)")
+        print_report(results, baseline)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'config': config, 'results': results}, f, indent=2)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if mongod:
+            mongod.terminate()
+            mongod.wait()
+        mock.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Local stand-in for the Groq OpenAI-compatible chat completions API.
+
+Answers POST /openai/v1/chat/completions with content shaped like what
+GraderPro expects from each prompt (OCR text with '## QuestionN:' headings,
+JSON grades, diagram descriptions and scores), after a latency drawn from a
+configurable distribution. A fraction of requests can be answered with 429 and
+a Retry-After header. stream=True is answered with server-sent chunks.
+
+Standalone:
+    python -m benchmarks.mock_groq --port 8900 --latency lognormal:0.8:0.4 --rate-limit 0.05
+then run the server with GROQ_BASE_URL=http://127.0.0.1:8900
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyModel:
+    """
+    Parses 'fixed:SECONDS', 'uniform:LOW:HIGH' or 'lognormal:MEDIAN:SIGMA'
+    and samples delays from it with a seeded generator.
+    """
+
+    def __init__(self, spec, seed=0):
+        kind, *params = spec.split(':')
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self):
+        with self.lock:
+            if self.kind == 'fixed':
+                return self.params[0]
+            if self.kind == 'uniform':
+                return self.random.uniform(*self.params)
+            if self.kind == 'lognormal':
+                median, sigma = self.params
+                return self.random.lognormvariate(0, sigma) * median
+        raise ValueError(f"Unknown latency distribution: {self.kind}")
+
+    def chance(self, probability):
+        with self.lock:
+            return self.random.random() < probability
+
+
+def prompt_text(messages):
+    texts = []
+    images = 0
+    for message in messages:
+        content = message.get('content')
+        for part in content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]:
+            if part.get('type') == 'image_url':
+                images += 1
+            else:
+                texts.append(part.get('text', ''))
+    return '\n'.join(texts), images
+
+
+def completion_content(messages, questions_per_script):
+    text, images = prompt_text(messages)
+    if 'Final Score' in text:
+        return ("Correctness: 4\nCompleteness: 3\nLabeling: 4\nFinal Score: 4\n\n"
+                "Summary:\nMost components are present; one connection is missing.")
+    if 'Describe this diagram' in text:
+        return "The diagram shows a process moving between ready, running and waiting states with labelled transitions."
+    if images:
+        return '\n\n'.join(
+            f"## Question{q}:\nThe answer describes the concept with a definition and an example."
+            for q in range(1, questions_per_script + 1)
+        )
+    match = re.search(r'out of (\d+) marks', text)
+    total = int(match.group(1)) if match else 5
+    return json.dumps({
+        "question": "mock question",
+        "score": max(1, total - 2),
+        "feedback": "Covers the main idea but misses supporting detail."
+    })
+
+
+def make_handler(latency, rate_limit, retry_after, questions_per_script, stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_json(404, {'error': {'message': 'not found'}})
+                return
+
+            with stats['lock']:
+                stats['requests'] += 1
+            if latency.chance(rate_limit):
+                with stats['lock']:
+                    stats['rate_limited'] += 1
+                self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'tokens'}},
+                               {'retry-after': str(retry_after)})
+                return
+
+            time.sleep(latency.sample())
+            content = completion_content(request.get('messages', []), questions_per_script)
+            prompt_tokens = len(prompt_text(request.get('messages', []))[0]) // 4
+            completion_tokens = len(content) // 4
+            model = request.get('model', 'mock')
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+            if request.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                words = content.split(' ')
+                for i, word in enumerate(words):
+                    chunk = {
+                        'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': word + (' ' if i < len(words) - 1 else '')},
+                                     'finish_reason': None}],
+                    }
+                    self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.write_chunk(b"")
+                return
+
+            self.send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            })
+
+        def write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+class MockGroqServer:
+    def __init__(self, port=0, latency='lognormal:0.8:0.4', rate_limit=0.0, retry_after=1,
+                 questions_per_script=10, seed=0):
+        self.stats = {'requests': 0, 'rate_limited': 0, 'lock': threading.Lock()}
+        handler = make_handler(LatencyModel(latency, seed), rate_limit, retry_after, questions_per_script, self.stats)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', default='lognormal:0.8:0.4')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--questions', type=int, default=10, help='questions per OCR extraction')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockGroqServer(args.port, args.latency, args.rate_limit, args.retry_after, args.questions, args.seed)
+    print(f"Mock Groq API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+"""
+Settings for load tests against benchmarks.mock_groq: the real Groq rate
+limits would otherwise dominate every latency that is measured.
+"""
+from Grader.settings import *  # noqa: F401,F403
+
+MODEL_RATE_LIMITS = {
+    'default': {'requests_per_minute': 1_000_000, 'tokens_per_minute': 1_000_000_000},
+}
@@ -0,0 +1,193 @@
+"""
+Checkpoints of answer-script grading runs, so that a retry only redoes the
+stages that failed or never ran.
+
+Each script has one document in the GradingRuns collection, keyed by its
+submission fingerprint (the student, the exam and the bytes of its pages):
+
+    {"_id", "usn", "subject", "exam_type", "total", "status", "error",
+     "pages": [{"text", "attempts", "error"}], "extracted_text", "failed_pages", "questions",
+     "results": {"<qno>": {"status": "ok", "item"} | {"status": "final", "item", "error"}
+                          | {"status": "failed", "error", "details"}},
+     "notified", "attempts", "created_at", "updated_at"}
+
+"status" is "running" while a request works on the run, "failed" (with the
+error) when one gave up part way, and "complete" once every question is graded
+and the student app has stored the feedback ("notified"). The OCR text, the
+parsed questions and each graded question are written as soon as they exist;
+documents expire GRADING_RUN_TTL seconds after their last update.
+
+With OCR_PER_PAGE each page's text is kept in "pages" (text None while it
+failed), so a retry reads only the failed pages again. The questions are parsed
+once every page is read or has run out of attempts. A question that can never
+be graded (no question text, no answer, no valid total) is "final": it keeps
+no marks, like a graded question, and is not retried.
+"""
+import datetime
+
+from django.conf import settings
+from pymongo import ASCENDING
+
+from Grader.metrics import increment
+
+# Collections whose indexes exist, by full name (see Evaluate/answer_cache.py)
+_indexed = set()
+
+
+def now():
+    # A BSON date, so the TTL index can expire the document
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def new_run(fingerprint, fields):
+    created_at = now()
+    return {
+        "_id": fingerprint,
+        "usn": fields.get("usn"),
+        "subject": fields.get("subject"),
+        "exam_type": fields.get("exam_type"),
+        "total": fields.get("total"),
+        "status": "running",
+        "error": None,
+        "pages": None,
+        "extracted_text": None,
+        "failed_pages": [],
+        "questions": None,
+        "results": {},
+        "notified": False,
+        "attempts": 1,
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+def run_fields(document):
+    """The upload fields a run was started with, to resume it without the upload."""
+    return {key: document.get(key) for key in ("usn", "subject", "exam_type", "total")}
+
+
+def graded(item):
+    return {"status": "ok", "item": item}
+
+
+def final(item, error):
+    return {"status": "final", "item": item, "error": error}
+
+
+def failed(result):
+    return {"status": "failed", "error": result.get("error"), "details": result.get("details")}
+
+
+# Outcomes that end a question's grading; only "failed" ones are graded again
+DONE = ("ok", "final")
+
+
+def new_page():
+    return {"text": None, "attempts": 0, "error": None}
+
+
+class GradingRun:
+    """The checkpoint of one script's run. Changes are written through to the collection as they are made."""
+
+    def __init__(self, runs, document, resumed=False):
+        self.runs = runs
+        self.document = document
+        self.resumed = resumed
+
+    @classmethod
+    def open(cls, runs, fingerprint, fields, restart=False):
+        """The run of this script, picked up where it stopped, or started afresh if there is none (or restart)."""
+        _ensure_indexes(runs)
+        document = None if restart else runs.find_one({"_id": fingerprint})
+        if document is None:
+            document = new_run(fingerprint, fields)
+            runs.replace_one({"_id": fingerprint}, document, upsert=True)
+            return cls(runs, document)
+        increment('grading_run_resumed')
+        run = cls(runs, document, resumed=True)
+        run.save(status="running", error=None, attempts=document.get("attempts", 0) + 1)
+        return run
+
+    @classmethod
+    async def aopen(cls, runs, fingerprint, fields, restart=False):
+        await _aensure_indexes(runs)
+        document = None if restart else await runs.find_one({"_id": fingerprint})
+        if document is None:
+            document = new_run(fingerprint, fields)
+            await runs.replace_one({"_id": fingerprint}, document, upsert=True)
+            return cls(runs, document)
+        increment('grading_run_resumed')
+        run = cls(runs, document, resumed=True)
+        await run.asave(status="running", error=None, attempts=document.get("attempts", 0) + 1)
+        return run
+
+    def _apply(self, changes):
+        """Apply changes (dotted keys reach into "results") to the local copy; returns the $set for them."""
+        changes = {**changes, "updated_at": now()}
+        for key, value in changes.items():
+            target = self.document
+            *parents, name = key.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[name] = value
+        return {"$set": changes}
+
+    def save(self, **changes):
+        self.runs.update_one({"_id": self.document["_id"]}, self._apply(changes))
+
+    async def asave(self, **changes):
+        await self.runs.update_one({"_id": self.document["_id"]}, self._apply(changes))
+
+    def save_result(self, qno, outcome):
+        self.save(**{f"results.{qno}": outcome})
+
+    async def asave_result(self, qno, outcome):
+        await self.asave(**{f"results.{qno}": outcome})
+
+    def _outcome(self, question):
+        return self.document["results"].get(str(question["qno"])) or {}
+
+    def pending_questions(self):
+        """[(index, question)] of the questions that failed or were never graded."""
+        return [(idx, question) for idx, question in enumerate(self.document["questions"])
+                if self._outcome(question).get("status") not in DONE]
+
+    def feedback_list(self):
+        """The feedback of every graded (or ungradable) question, in question order."""
+        return [self._outcome(question)["item"] for question in self.document["questions"]
+                if self._outcome(question).get("status") in DONE]
+
+    def pages_to_read(self, page_count):
+        """Indexes of the pages to OCR: all of them at first, then the failed ones with attempts left."""
+        pages = self.document.get("pages")
+        if pages is None:
+            return list(range(page_count)) if self.document["extracted_text"] is None else []
+        # Without the text of any page there is nothing to grade, so those are always tried again
+        exhausted = self.document["extracted_text"] is not None
+        return [idx for idx, page in enumerate(pages) if page["text"] is None
+                and not (exhausted and page["attempts"] >= settings.OCR_PAGE_MAX_ATTEMPTS)]
+
+    def ocr_pending(self):
+        """Whether pages are still to be read before the questions can be parsed."""
+        if self.document["extracted_text"] is None:
+            return True
+        return bool(self.pages_to_read(len(self.document.get("pages") or [])))
+
+    def ungraded(self):
+        """[{"qno", "error"}] for the questions still without a grade."""
+        return [{"qno": question["qno"], "error": self._outcome(question).get("error") or "Not graded"}
+                for _, question in self.pending_questions()]
+
+
+def _ensure_indexes(runs):
+    if runs.full_name not in _indexed:
+        runs.create_index([("subject", ASCENDING), ("exam_type", ASCENDING), ("status", ASCENDING)])
+        runs.create_index("updated_at", expireAfterSeconds=settings.GRADING_RUN_TTL)
+        _indexed.add(runs.full_name)
+
+
+async def _aensure_indexes(runs):
+    if runs.full_name not in _indexed:
+        await runs.create_index([("subject", ASCENDING), ("exam_type", ASCENDING), ("status", ASCENDING)])
+        await runs.create_index("updated_at", expireAfterSeconds=settings.GRADING_RUN_TTL)
+        _indexed.add(runs.full_name)
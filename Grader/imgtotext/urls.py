@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from .views import process_exam_images
+from .views import grading_runs, process_exam_images, process_exam_images_async
 
 urlpatterns = [
-    path('text/', process_exam_images, name='process_exam_images'),
-]
\ No newline at end of file
+    path('text/', process_exam_images_async if settings.ASYNC_VIEWS else process_exam_images,
+         name='process_exam_images'),
+    path('runs/', grading_runs, name='grading_runs'),
+]
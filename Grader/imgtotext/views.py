@@ -1,107 +1,245 @@
-import base64
+import asyncio
+import contextvars
+import datetime
+import hashlib
 import logging
 import requests
 import re
+from concurrent.futures import ThreadPoolExecutor
 
+import httpx
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from groq import Groq
 from pymongo import MongoClient
 import json
 
+from Grader.aio import get_groq_client, get_http_client, get_mongo_db
+from Grader.clients import get_sync_groq_client
+from Grader.imaging import encode_images
+from Grader.metrics import log_payload, timed
+from Grader.ratelimit import (acreate_completion, create_completion, model_priority, priority_from_request,
+                              priority_header)
+from Grader.responses import JsonResponse, after_streaming, loads
+from Grader.submissions import PENDING, PENDING_RETRY_AFTER, Submission, submission_fingerprint, submission_keys
+from Grader.uploadhandlers import rejected_upload_response
+
+from . import checkpoints
+from .checkpoints import GradingRun, failed, final, graded, new_page, run_fields
+
 # Setup logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # Setup MongoDB client (ensure this is created once globally)
-mongo_client = MongoClient('mongodb://localhost:27017/')
+mongo_client = MongoClient(settings.MONGO_URI)
 db = mongo_client['GraderPro']
 questions_collection = db['QuestionPaper']
+grading_runs_collection = db['GradingRuns']
+# Question images are not needed to grade answers
+QUESTION_PROJECTION = {'questions.image': 0}
 
 
-def encode_image(image_file):
-    return base64.b64encode(image_file.read()).decode("utf-8")
-
-
-def get_question_text_from_db(subject, exam_type, qno):
-    doc = questions_collection.find_one({"subject": subject, "exam_type": exam_type})
+def find_question(doc, qno):
     if doc and 'questions' in doc:
         for question in doc['questions']:
             if question.get('qno') == int(qno):
-                return question.get('question')
-            
-    # return f"{subject} {exam_type} question {qno}"
+                return question
+    return {}
 
 
-def parse_and_add_questions(extracted_text, subject, exam_type):
-    question_blocks = re.split(r'## Question\d+:', extracted_text)
-    question_numbers = re.findall(r'## Question(\d+):', extracted_text)
-    
-    result = []
+def get_question_paper(subject, exam_type):
+    with timed('question_lookup'):
+        return questions_collection.find_one({"subject": subject, "exam_type": exam_type}, QUESTION_PROJECTION)
+
+
+def split_answers(extracted_text):
+    """Return [(qno, answer_parts)] for each '## QuestionN:' block of the text."""
+    with timed('parse'):
+        question_blocks = re.split(r'## Question\d+:', extracted_text)
+        question_numbers = re.findall(r'## Question(\d+):', extracted_text)
+
+    answers = []
     for i, qno in enumerate(question_numbers):
         text = question_blocks[i+1].strip() if i+1 < len(question_blocks) else ""
         answer_parts = [part.strip() for part in text.split('\n\n') if part.strip()]
+        answers.append((qno, answer_parts))
+    return answers
 
-        question_text = get_question_text_from_db(subject, exam_type, qno)
-
-        result.append({
-            "qno": int(qno),
-            "question": question_text,
-            "answer": answer_parts
-        })
-
-    return result
 
+def question_entry(doc, qno, answer_parts):
+    """The question as Evaluate grades it, with the paper's rubric when one was stored."""
+    question = find_question(doc, qno)
+    entry = {"qno": int(qno), "question": question.get('question'), "answer": answer_parts}
+    if question.get('rubric'):
+        entry["rubric"] = question['rubric']
+    return entry
 
-def extract_text_from_images(base64_images):
-    client = Groq(api_key=settings.GROQ_API_KEY)
-
-    prompt = (
-        "Extract only the visible text from these images, and organize it by question number.\n"
-        "- Identify each question based on its number (e.g., Q1, 1., 2., etc.).\n"
-        "- Group each answer under its respective question number using clear headings like 'Question 1:', 'Question 2:', etc.\n"
-        "- Do NOT generate or assume any new content—only extract what's actually visible in the image.\n"
-        "- Correct any spelling mistakes.\n"
-        "- Preserve logical structure (e.g., headings, bullet points, tables, equations) within each answer.\n"
-        "- Use clean and consistent formatting so the output is both human-readable and machine-readable.\n"
-        "- Ignore decorative elements, arrows, or icons unless they contain actual text.\n"
-        "- Ensure each answer appears immediately after its corresponding question number."
-    )
 
+def parse_and_add_questions(extracted_text, subject, exam_type):
+    doc = get_question_paper(subject, exam_type)
+    return [question_entry(doc, qno, answer_parts) for qno, answer_parts in split_answers(extracted_text)]
+
+
+async def parse_and_add_questions_async(extracted_text, subject, exam_type):
+    with timed('question_lookup'):
+        doc = await get_mongo_db()['QuestionPaper'].find_one(
+            {"subject": subject, "exam_type": exam_type}, QUESTION_PROJECTION)
+    return [question_entry(doc, qno, answer_parts) for qno, answer_parts in split_answers(extracted_text)]
+
+
+EXTRACTION_PROMPT = (
+    "Extract only the visible text from these images, and organize it by question number.\n"
+    "- Identify each question based on its number (e.g., Q1, 1., 2., etc.).\n"
+    "- Group each answer under its respective question number using clear headings like 'Question 1:', 'Question 2:', etc.\n"
+    "- Do NOT generate or assume any new content—only extract what's actually visible in the image.\n"
+    "- Correct any spelling mistakes.\n"
+    "- Preserve logical structure (e.g., headings, bullet points, tables, equations) within each answer.\n"
+    "- Use clean and consistent formatting so the output is both human-readable and machine-readable.\n"
+    "- Ignore decorative elements, arrows, or icons unless they contain actual text.\n"
+    "- Ensure each answer appears immediately after its corresponding question number."
+)
+
+PAGE_EXTRACTION_PROMPT = (
+    "Extract only the visible text from this page of an answer script, and organize it by question number.\n"
+    "- Identify each question based on its number (e.g., Q1, 1., 2., etc.).\n"
+    "- Start each answer with a heading written exactly like '## Question1:', '## Question2:', etc.\n"
+    "- If the page begins with text that continues an answer from the previous page, output that text first, without any heading.\n"
+    "- Do NOT generate or assume any new content—only extract what's actually visible in the image.\n"
+    "- Correct any spelling mistakes.\n"
+    "- Preserve logical structure (e.g., headings, bullet points, tables, equations) within each answer.\n"
+    "- Ignore decorative elements, arrows, or icons unless they contain actual text."
+)
+
+
+def text_extraction_request(prompt, image_urls):
     message_content = [{"type": "text", "text": prompt}]
-    for base64_img in base64_images:
+    for image_url in image_urls:
         message_content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/png;base64,{base64_img}"}
+            "image_url": {"url": image_url}
         })
 
-    logger.info("Sending images to Groq API for text extraction...")
+    return {
+        "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+        "messages": [{"role": "user", "content": message_content}],
+        "temperature": 0.2,
+        "top_p": 1,
+        "stream": False
+    }
 
-    response = client.chat.completions.create(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",
-        messages=[{"role": "user", "content": message_content}],
-        temperature=0.2,
-        top_p=1,
-        stream=False
-    )
 
-    logger.info("Received response from Groq API.")
+def request_text_extraction(prompt, image_urls):
+    response = create_completion(get_sync_groq_client(), **text_extraction_request(prompt, image_urls))
     return response.choices[0].message.content
 
 
-def trigger_another_app(payload):
-    """POST extracted data to another Django app"""
-    try:
-        logger.info(f"Triggering other app at {settings.OTHER_DJANGO_APP_URL} with payload.")
-        response = requests.post(settings.OTHER_DJANGO_APP_URL, json=payload, timeout=10)
-        logger.info(f"Received response from other app: status {response.status_code}")
-        return response.status_code, response.text
-    except requests.RequestException as e:
-        logger.error(f"Error triggering other app: {e}")
-        return 500, str(e)
+async def request_text_extraction_async(prompt, image_urls):
+    response = await acreate_completion(get_groq_client(), **text_extraction_request(prompt, image_urls))
+    return response.choices[0].message.content
+
+
+def extract_text_from_images(image_urls):
+    logger.info("Sending images to Groq API for text extraction...")
+    text = request_text_extraction(EXTRACTION_PROMPT, image_urls)
+    logger.info("Received response from Groq API.")
+    return text
+
+
+def page_cache_key(image_url):
+    return "ocr:page:" + hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+
+def extract_text_from_page(image_url):
+    """OCR a single page, reusing the cached text for an identical image."""
+    key = page_cache_key(image_url)
+    text = cache.get(key)
+    if text is None:
+        with timed('ocr_page'):
+            text = request_text_extraction(PAGE_EXTRACTION_PROMPT, [image_url])
+        cache.set(key, text, settings.OCR_PAGE_CACHE_TIMEOUT)
+    return text
+
+
+async def extract_text_from_page_async(image_url, semaphore):
+    key = page_cache_key(image_url)
+    text = await cache.aget(key)
+    if text is None:
+        async with semaphore:
+            with timed('ocr_page'):
+                text = await request_text_extraction_async(PAGE_EXTRACTION_PROMPT, [image_url])
+        await cache.aset(key, text, settings.OCR_PAGE_CACHE_TIMEOUT)
+    return text
+
+
+def stitch_pages(page_texts):
+    """Join per-page text in page order so it reads like one extraction."""
+    stitched = []
+    last_qno = None
+    for text in page_texts:
+        text = text.strip()
+        question_numbers = re.findall(r'## Question(\d+):', text)
+        # A page that repeats the heading of the answer it continues
+        if last_qno is not None and text.startswith(f"## Question{last_qno}:"):
+            text = text[len(f"## Question{last_qno}:"):].lstrip()
+        if question_numbers:
+            last_qno = question_numbers[-1]
+        stitched.append(text)
+    return "\n\n".join(stitched)
+
+
+def extract_text_per_page(image_urls):
+    """OCR pages concurrently. Returns each page's text, or the exception its extraction raised."""
+    logger.info(f"Extracting text from {len(image_urls)} pages individually...")
+    workers = max(1, min(settings.OCR_PAGE_WORKERS, len(image_urls)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each page runs in a copy of this context so it keeps the request's priority
+        futures = [
+            executor.submit(contextvars.copy_context().run, extract_text_from_page, url)
+            for url in image_urls
+        ]
+
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+
+async def extract_text_per_page_async(image_urls):
+    logger.info(f"Extracting text from {len(image_urls)} pages individually...")
+    semaphore = asyncio.Semaphore(max(1, settings.OCR_PAGE_WORKERS))
+    return await asyncio.gather(
+        *(extract_text_from_page_async(url, semaphore) for url in image_urls),
+        return_exceptions=True
+    )
 
 
+def page_changes(run, page_count, unread, outcomes):
+    """
+    The checkpoint fields once the unread pages were OCR'd (outcomes are their
+    texts or exceptions): every page's text and attempts, and the text of the
+    pages read so far stitched in page order, skipping those that failed.
+    """
+    pages = [dict(page) for page in run.document.get('pages') or [new_page() for _ in range(page_count)]]
+    for idx, outcome in zip(unread, outcomes):
+        pages[idx]['attempts'] += 1
+        if isinstance(outcome, Exception):
+            logger.error(f"Text extraction failed for page {idx + 1}: {outcome}")
+            pages[idx]['error'] = str(outcome)
+        else:
+            pages[idx].update(text=outcome, error=None)
+
+    texts = [page['text'] for page in pages if page['text'] is not None]
+    return {
+        'pages': pages,
+        'extracted_text': stitch_pages(texts) if texts else None,
+        'failed_pages': [page_no for page_no, page in enumerate(pages, start=1) if page['text'] is None],
+    }
 
 
 def trigger_another_app2(payload):
@@ -115,10 +253,463 @@ def trigger_another_app2(payload):
         logger.error(f"Error triggering other app: {e}")
         return 500, str(e)
 
-@csrf_exempt
-def process_exam_images(request):
+async def post_to_app_async(url, payload, headers=None):
+    """trigger_another_app2() over the shared async client"""
+    try:
+        logger.info(f"Triggering other app at {url} with payload.")
+        response = await get_http_client().post(url, json=payload, headers=headers, timeout=10)
+        logger.info(f"Received response from other app: status {response.status_code}")
+        return response.status_code, response.text
+    except httpx.HTTPError as e:
+        logger.error(f"Error triggering other app: {e}")
+        return 500, str(e)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_evaluation(payload):
+    """POST to the Evaluate app in streaming mode and yield each result as it is graded"""
+    logger.info(f"Streaming evaluation from {settings.OTHER_DJANGO_APP_URL}.")
+    with requests.post(settings.OTHER_DJANGO_APP_URL, json={**payload, 'stream': True},
+                       headers=priority_header(), timeout=60, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            message = json.loads(line)
+            if message.pop('event', None) == 'result':
+                yield message
+
+
+async def stream_evaluation_async(payload):
+    logger.info(f"Streaming evaluation from {settings.OTHER_DJANGO_APP_URL}.")
+    async with get_http_client().stream('POST', settings.OTHER_DJANGO_APP_URL, json={**payload, 'stream': True},
+                                        headers=priority_header(), timeout=60) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            message = json.loads(line)
+            if message.pop('event', None) == 'result':
+                yield message
+
+
+def read_exam_pages(run, image_files):
+    """Encode and OCR the uploaded pages the run has no text for, and save their text to its checkpoint."""
+    if not settings.OCR_PER_PAGE and run.document.get('pages') is None:
+        image_urls = encode_images(image_files)
+        with timed('ocr'):
+            run.save(extracted_text=extract_text_from_images(image_urls), failed_pages=[])
+    else:
+        unread = run.pages_to_read(len(image_files))
+        image_urls = encode_images([image_files[idx] for idx in unread])
+        with timed('ocr'):
+            outcomes = extract_text_per_page(image_urls)
+        run.save(**page_changes(run, len(image_files), unread, outcomes))
+    logger.info(f"Extracted text length: {len(run.document['extracted_text'] or '')} characters")
+
+
+async def read_exam_pages_async(run, image_files):
+    # Decoding and resizing is CPU work, keep it off the event loop
+    encode = sync_to_async(encode_images, thread_sensitive=False)
+    if not settings.OCR_PER_PAGE and run.document.get('pages') is None:
+        image_urls = await encode(image_files)
+        with timed('ocr'):
+            await run.asave(extracted_text=await request_text_extraction_async(EXTRACTION_PROMPT, image_urls),
+                            failed_pages=[])
+    else:
+        unread = run.pages_to_read(len(image_files))
+        image_urls = await encode([image_files[idx] for idx in unread])
+        with timed('ocr'):
+            outcomes = await extract_text_per_page_async(image_urls)
+        await run.asave(**page_changes(run, len(image_files), unread, outcomes))
+    logger.info(f"Extracted text length: {len(run.document['extracted_text'] or '')} characters")
+
+
+def build_feedback_item(idx, result, refined_payload, total):
+    """Shape one Evaluate result into the feedback entry stored for the student"""
+    # Find corresponding question from refined_payload if possible
+    question_data = None
+    qno = result.get("qno", idx + 1)
+
+    for q in refined_payload:
+        if q.get("qno") == qno:
+            question_data = q
+            break
+
+    # Get answer from question_data if available
+    answer = ""
+    if question_data and "answer" in question_data:
+        if isinstance(question_data["answer"], list):
+            answer = " ".join(question_data["answer"])
+        else:
+            answer = str(question_data["answer"])
+
+    # Get question text
+    question_text = result.get("question", "")
+    if not question_text and question_data:
+        question_text = question_data.get("question", f"Question {qno}")
+
+    # Create feedback item with all required fields
+    return {
+        "index": idx,
+        "qno": qno,
+        "question": question_text,
+        "answer": result.get("answer", answer),  # Use answer from result or from question_data
+        "feedback": result.get("feedback", ""),
+        "score": float(result.get("score", 0)),  # Convert to float to handle decimal scores
+        "total": int(result.get("total", total) if result.get("total") else total)  # Use question total or overall total
+    }
+
+
+class PipelineError(Exception):
+    """A stage of a grading run failed; the run's checkpoint keeps every stage done before it."""
+
+    def __init__(self, status, payload):
+        super().__init__(payload['error'])
+        self.status = status
+        self.payload = payload
+
+
+def evaluation_payload(document, questions):
+    return {
+        'exam_type': document['exam_type'],
+        'subject': document['subject'],
+        'total': document['total'],
+        'usn': document['usn'],
+        'questions': questions
+    }
+
+
+def student_payload(document, feedback_list):
+    return {
+        'usn': document['usn'],
+        'subject': document['subject'],
+        'exam_type': document['exam_type'],
+        'feedback': feedback_list,
+    }
+
+
+def ungradable(question, total):
+    """Why Evaluate can never grade this question, however often it is retried, or None."""
+    if not question.get('question'):
+        return 'Question not found in the question paper'
+    if not question.get('answer'):
+        return 'No answer was read for this question'
+    try:
+        int(total)
+    except (TypeError, ValueError):
+        return 'total_marks must be an integer'
+    return None
+
+
+def ungraded_item(idx, question, reason, total):
+    """The feedback entry of a question that cannot be graded: no marks, and why."""
+    answer = question.get('answer')
+    try:
+        total = int(total)
+    except (TypeError, ValueError):
+        total = 0
+    return {
+        "index": idx,
+        "qno": question['qno'],
+        "question": question.get('question') or f"Question {question['qno']}",
+        "answer": " ".join(answer) if isinstance(answer, list) else str(answer or ""),
+        "feedback": f"Not graded: {reason}",
+        "score": 0.0,
+        "total": total
+    }
+
+
+def question_outcome(idx, question, result, document):
+    """
+    What the checkpoint keeps of one Evaluate result: the student's feedback
+    item, the error of a question that cannot be graded (final, with no marks),
+    or the error of one a retry may grade (a model or network failure).
+    """
+    if 'error' in result:
+        reason = ungradable(question, document['total'])
+        if reason is not None:
+            logger.warning(f"Question {question['qno']} cannot be graded: {reason}")
+            return final(ungraded_item(idx, question, reason, document['total']), reason)
+        logger.error(f"Grading failed for question {question['qno']}: {result['error']}")
+        return failed(result)
+    # Evaluate numbers results by their place in the request, which may only hold the questions left to grade
+    return graded(build_feedback_item(idx, {**result, 'qno': question['qno']}, document['questions'],
+                                      document['total']))
+
+
+def missing_results(pending, received):
+    """
+    (qno, outcome) for the questions Evaluate sent no result for, marked failed
+    so that a retry grades them. Results beyond the questions sent are dropped.
+    """
+    if received != len(pending):
+        logger.error(f"Evaluate returned {received} results for {len(pending)} questions")
+    return [(question['qno'], failed({'error': 'No result returned by Evaluate'}))
+            for _, question in pending[received:]]
+
+
+def ocr_event(document):
+    return {
+        'questions': [q['qno'] for q in document['questions']],
+        'failed_pages': document['failed_pages']
+    }
+
+
+def unread_pages_error(run):
+    return PipelineError(502, {
+        'error': 'Some pages could not be read, upload the script again to retry them',
+        'failed_pages': run.document['failed_pages']
+    })
+
+
+def ungraded_error(run):
+    return PipelineError(502, {
+        'error': 'Some questions could not be graded',
+        'failed_questions': run.ungraded(),
+        'feedback': run.feedback_list()
+    })
+
+
+def run_summary(run):
+    feedback_list = run.feedback_list()
+    return {
+        'message': 'Processing successful',
+        'score': sum(item['score'] for item in feedback_list),
+        'feedback': feedback_list,
+        'failed_pages': run.document['failed_pages'],
+        'resumed': run.resumed
+    }
+
+
+def run_exam_pipeline(fields):
+    """
+    Grade one answer script from its checkpoint, yielding (event, data): 'ocr'
+    once the text is extracted, 'result' for each graded question, then
+    'summary' after the feedback is stored. Stages the checkpoint already holds
+    are not redone, so a retry OCRs and grades only what failed or never ran.
+    Raises PipelineError when a stage fails, after marking the run failed: when
+    pages could not be read (up to OCR_PAGE_MAX_ATTEMPTS times each), or
+    questions could not be graded for a reason a retry may fix.
+    """
+    run = GradingRun.open(grading_runs_collection, fields['fingerprint'], fields, restart=fields.get('regrade'))
+    try:
+        yield from _run_exam_pipeline(run, fields.get('image_files'))
+    except Exception as e:
+        run.save(status='failed', error=str(e))
+        raise
+
+
+def _run_exam_pipeline(run, image_files):
+    document = run.document
+    if run.ocr_pending():
+        if not image_files:
+            raise PipelineError(409, {'error': 'The pages of this script were never read, upload it again'})
+        read_exam_pages(run, image_files)
+        if run.ocr_pending():
+            raise unread_pages_error(run)
+    if document['questions'] is None:
+        run.save(questions=parse_and_add_questions(
+            document['extracted_text'], document['subject'], document['exam_type']))
+    yield 'ocr', ocr_event(document)
+
+    pending = run.pending_questions()
+    # Questions graded by an earlier attempt are replayed, so a stream still shows every question
+    for feedback_item in run.feedback_list():
+        yield 'result', feedback_item
+    if pending:
+        received = 0
+        for result in stream_evaluation(evaluation_payload(document, [question for _, question in pending])):
+            received += 1
+            if received > len(pending):
+                continue
+            idx, question = pending[received - 1]
+            outcome = question_outcome(idx, question, result, document)
+            run.save_result(question['qno'], outcome)
+            if outcome['status'] == 'ok':
+                yield 'result', outcome['item']
+        for qno, outcome in missing_results(pending, received):
+            run.save_result(qno, outcome)
+    if run.pending_questions():
+        raise ungraded_error(run)
+
+    if not document['notified']:
+        status, student_log = trigger_another_app2(student_payload(document, run.feedback_list()))
+        if status != 200:
+            logger.error(f"Failed to notify student app, status: {status}, details: {student_log}")
+            raise PipelineError(status, {'error': 'Failed to notify student app', 'details': student_log})
+        run.save(notified=True)
+    run.save(status='complete')
+    yield 'summary', run_summary(run)
+
+
+async def run_exam_pipeline_async(fields):
+    """run_exam_pipeline() on the event loop"""
+    run = await GradingRun.aopen(get_mongo_db()['GradingRuns'], fields['fingerprint'], fields,
+                                 restart=fields.get('regrade'))
+    try:
+        async for event in _run_exam_pipeline_async(run, fields.get('image_files')):
+            yield event
+    except Exception as e:
+        await run.asave(status='failed', error=str(e))
+        raise
+
+
+async def _run_exam_pipeline_async(run, image_files):
+    document = run.document
+    if run.ocr_pending():
+        if not image_files:
+            raise PipelineError(409, {'error': 'The pages of this script were never read, upload it again'})
+        await read_exam_pages_async(run, image_files)
+        if run.ocr_pending():
+            raise unread_pages_error(run)
+    if document['questions'] is None:
+        await run.asave(questions=await parse_and_add_questions_async(
+            document['extracted_text'], document['subject'], document['exam_type']))
+    yield 'ocr', ocr_event(document)
+
+    pending = run.pending_questions()
+    for feedback_item in run.feedback_list():
+        yield 'result', feedback_item
+    if pending:
+        received = 0
+        async for result in stream_evaluation_async(
+                evaluation_payload(document, [question for _, question in pending])):
+            received += 1
+            if received > len(pending):
+                continue
+            idx, question = pending[received - 1]
+            outcome = question_outcome(idx, question, result, document)
+            await run.asave_result(question['qno'], outcome)
+            if outcome['status'] == 'ok':
+                yield 'result', outcome['item']
+        for qno, outcome in missing_results(pending, received):
+            await run.asave_result(qno, outcome)
+    if run.pending_questions():
+        raise ungraded_error(run)
+
+    if not document['notified']:
+        status, student_log = await post_to_app_async(
+            settings.OTHER_APP_URL, student_payload(document, run.feedback_list()))
+        if status != 200:
+            logger.error(f"Failed to notify student app, status: {status}, details: {student_log}")
+            raise PipelineError(status, {'error': 'Failed to notify student app', 'details': student_log})
+        await run.asave(notified=True)
+    await run.asave(status='complete')
+    yield 'summary', run_summary(run)
+
+
+def stream_exam_processing(fields, priority, submission):
+    """
+    Server-sent events for one answer script: 'ocr' once the text is extracted,
+    'result' for each question as soon as it is graded, then 'summary' after the
+    feedback is stored (or 'error').
+    """
+    try:
+        with model_priority(priority):
+            for event, data in run_exam_pipeline(fields):
+                if event == 'summary':
+                    submission.complete(submission_result(data['feedback'], data['failed_pages']))
+                yield sse_event(event, data)
+    except PipelineError as e:
+        yield sse_event('error', e.payload)
+    except Exception as e:
+        logger.exception(f"Unexpected error during streamed processing: {e}")
+        yield sse_event('error', {'error': 'Unexpected error', 'details': str(e)})
+    finally:
+        submission.release()
+
+
+async def stream_exam_processing_async(fields, priority, submission):
+    """stream_exam_processing() on the event loop"""
+    with model_priority(priority):
+        try:
+            async for event, data in run_exam_pipeline_async(fields):
+                if event == 'summary':
+                    await submission.acomplete(submission_result(data['feedback'], data['failed_pages']))
+                yield sse_event(event, data)
+        except PipelineError as e:
+            yield sse_event('error', e.payload)
+        except Exception as e:
+            logger.exception(f"Unexpected error during streamed processing: {e}")
+            yield sse_event('error', {'error': 'Unexpected error', 'details': str(e)})
+        finally:
+            await submission.arelease()
+
+
+def exam_processing_summary(fields):
+    """Run the pipeline to the end: its summary, or PipelineError"""
+    summary = None
+    for event, data in run_exam_pipeline(fields):
+        if event == 'summary':
+            summary = data
+    return summary
+
+
+async def exam_processing_summary_async(fields):
+    summary = None
+    async for event, data in run_exam_pipeline_async(fields):
+        if event == 'summary':
+            summary = data
+    return summary
+
+
+def submission_result(feedback_list, failed_pages):
+    """What a duplicate of this submission is answered with"""
+    return {
+        'feedback': feedback_list,
+        'failed_pages': failed_pages,
+        # The Evaluate app's results are streamed, so its JSON body is rebuilt from the feedback
+        'forwarded_response': json.dumps({'results': feedback_list}),
+    }
+
+
+def processed_response(summary, result):
+    return JsonResponse({
+        'message': 'Processing successful',
+        'forwarded_response': result['forwarded_response'],
+        'failed_pages': summary['failed_pages'],
+        'resumed': summary['resumed']
+    })
+
+
+def reused_response(result):
+    return JsonResponse({
+        'message': 'Processing successful',
+        'forwarded_response': result['forwarded_response'],
+        'failed_pages': result['failed_pages'],
+        'reused': True
+    })
+
+
+def pending_response():
+    """For a duplicate of a script whose run is still going, after the short wait of the sync view"""
+    response = JsonResponse({'error': 'This script is already being graded, retry to get its result',
+                             'retry_after': PENDING_RETRY_AFTER}, status=409)
+    response['Retry-After'] = str(PENDING_RETRY_AFTER)
+    return response
+
+
+def replay_exam_processing(result):
+    """The events of a finished run, for a duplicate that asked for a stream"""
+    for feedback_item in result['feedback']:
+        yield sse_event('result', feedback_item)
+    yield sse_event('summary', {
+        'message': 'Processing successful',
+        'score': sum(item['score'] for item in result['feedback']),
+        'feedback': result['feedback'],
+        'failed_pages': result['failed_pages'],
+        'reused': True
+    })
+
+
+def read_exam_request(request):
+    """Return (fields, None) for a valid upload, or (None, error_response)."""
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+        return None, JsonResponse({'error': 'Only POST method is allowed'}, status=405)
 
     exam_type = request.POST.get('exam_type')
     subject = request.POST.get('subject')
@@ -127,115 +718,223 @@ def process_exam_images(request):
     usn = request.POST.get('usn')
 
     if not exam_type or not subject:
-        return JsonResponse({'error': 'Missing exam_type or subject'}, status=400)
+        return None, JsonResponse({'error': 'Missing exam_type or subject'}, status=400)
+
+    rejected = rejected_upload_response(request)
+    if rejected:
+        return None, rejected
 
     if not image_files:
-        return JsonResponse({'error': 'No images provided'}, status=400)
+        return None, JsonResponse({'error': 'No images provided'}, status=400)
+
+    logger.info(f"Received {len(image_files)} images for subject={subject}, exam_type={exam_type}")
+    return {
+        'image_files': image_files,
+        'subject': subject,
+        'exam_type': exam_type,
+        'total': total,
+        'usn': usn,
+        # Grade the script again from scratch, ignoring its stored result and checkpoint
+        'regrade': bool(request.POST.get('regrade')),
+    }, None
+
+
+def exam_submission(request, fields):
+    """The upload's Submission. Its fingerprint, which also keys the run's checkpoint, is added to fields."""
+    fields['fingerprint'] = submission_fingerprint(
+        fields['usn'], fields['subject'], fields['exam_type'], fields['image_files'])
+    return Submission(submission_keys(request, fields['fingerprint']))
+
+
+def wants_event_stream(request):
+    return bool(request.POST.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+def process_exam_images(request):
+    fields, error = read_exam_request(request)
+    if error:
+        return error
+
+    # A retried or re-uploaded script waits for the run in flight, or reuses its result
+    submission = exam_submission(request, fields)
+    reused = submission.claim(reuse=not fields['regrade'])
+    if reused == PENDING:
+        return pending_response()
+    if reused:
+        if wants_event_stream(request):
+            return event_stream_response(replay_exam_processing(reused))
+        return reused_response(reused)
+
+    # Progressive mode: results are pushed as server-sent events while grading runs.
+    # The claim is also released if the client goes away before the stream starts.
+    if wants_event_stream(request):
+        return after_streaming(event_stream_response(
+            stream_exam_processing(fields, priority_from_request(request), submission)), submission.release)
 
     try:
-        logger.info(f"Received {len(image_files)} images for subject={subject}, exam_type={exam_type}")
-        
-        base64_images = [encode_image(img) for img in image_files]
-        
-        extracted_text = extract_text_from_images(base64_images)
-        logger.info(f"Extracted text length: {len(extracted_text)} characters")
-        
-        refined_payload = parse_and_add_questions(extracted_text, subject, exam_type)
-        
-        payload = {
-            'exam_type': exam_type,
-            'subject': subject,
-            'total': total,
-            'questions': refined_payload
-        }
-        
-        logger.info(f"Payload prepared for forwarding: {payload}")
-
-        status_code, response_text = trigger_another_app(payload)
-
-        if status_code != 200:
-            logger.error(f"Failed to notify other app, status: {status_code}, details: {response_text}")
-            return JsonResponse({'error': 'Failed to notify other app', 'details': response_text}, status=status_code)
-
-        logger.info("Processing and forwarding successful.")
-        logger.info(f"Response text: {response_text}")
-
-        # Parse the response from the first app (assuming it's JSON)
-        try:
-            response_data = json.loads(response_text)
-            logger.info(f"Parsed response data: {response_data}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse response as JSON: {e}")
-            response_data = {"results": []}
-        
-        # Format feedback in the expected structure
-        feedback_list = []
-        
-        # Check if we have the refined_payload and response_data to work with
-        if isinstance(response_data, dict) and "results" in response_data:
-            results = response_data.get("results", [])
-            
-            for idx, result in enumerate(results):
-                if not isinstance(result, dict):
-                    continue
-                
-                # Find corresponding question from refined_payload if possible
-                question_data = None
-                qno = result.get("qno", idx + 1)
-                
-                for q in refined_payload:
-                    if q.get("qno") == qno:
-                        question_data = q
-                        break
-                
-                # Get answer from question_data if available
-                answer = ""
-                if question_data and "answer" in question_data:
-                    if isinstance(question_data["answer"], list):
-                        answer = " ".join(question_data["answer"])
-                    else:
-                        answer = str(question_data["answer"])
-                
-                # Get question text
-                question_text = result.get("question", "")
-                if not question_text and question_data:
-                    question_text = question_data.get("question", f"Question {qno}")
-                
-                # Create feedback item with all required fields
-                feedback_item = {
-                    "index": idx,
-                    "qno": qno,
-                    "question": question_text,
-                    "answer": result.get("answer", answer),  # Use answer from result or from question_data
-                    "feedback": result.get("feedback", ""),
-                    "score": float(result.get("score", 0)),  # Convert to float to handle decimal scores
-                    "total": int(result.get("total", total) if result.get("total") else total)  # Use question total or overall total
-                }
-                
-                feedback_list.append(feedback_item)
-        
-        logger.info(f"Generated feedback list: {feedback_list}")
-        
-        # Create the payload with the properly formatted feedback
-        student_payload = {
-            'usn': usn,
-            'subject': subject,
-            'exam_type': exam_type,
-            'feedback': feedback_list,
-        }
-        
-        logger.info(f"Student payload: {student_payload}")
-        
-        status, student_log = trigger_another_app2(student_payload)
-    
-        if status != 200:
-            logger.error(f"Failed to notify student app, status: {status}, details: {student_log}")
-            return JsonResponse({'error': 'Failed to notify student app', 'details': student_log}, status=status)
-        
-        logger.info(f"Student log: {student_log}")
+        summary = exam_processing_summary(fields)
+        log_payload(logger, "Feedback stored", summary['feedback'])
+
+        result = submission_result(summary['feedback'], summary['failed_pages'])
+        submission.complete(result)
+        return processed_response(summary, result)
+
+    except PipelineError as e:
+        return JsonResponse(e.payload, status=e.status)
+    except Exception as e:
+        logger.exception(f"Unexpected error during processing: {e}")
+        return JsonResponse({'error': 'Unexpected error', 'details': str(e)}, status=500)
+    finally:
+        submission.release()
+
+
+@csrf_exempt
+async def process_exam_images_async(request):
+    # Reading request.POST/FILES parses the upload synchronously, as it would in any view
+    fields, error = read_exam_request(request)
+    if error:
+        return error
+
+    # Hashing the pages reads every upload, keep it off the event loop
+    submission = await sync_to_async(exam_submission, thread_sensitive=False)(request, fields)
+    reused = await submission.aclaim(reuse=not fields['regrade'])
+    if reused == PENDING:
+        return pending_response()
+    if reused:
+        if wants_event_stream(request):
+            return event_stream_response(replay_exam_processing(reused))
+        return reused_response(reused)
+
+    if wants_event_stream(request):
+        return after_streaming(event_stream_response(stream_exam_processing_async(
+            fields, priority_from_request(request), submission)), submission.release)
+
+    try:
+        summary = await exam_processing_summary_async(fields)
+        log_payload(logger, "Feedback stored", summary['feedback'])
 
-        return JsonResponse({'message': 'Processing successful', 'forwarded_response': response_text})
+        result = submission_result(summary['feedback'], summary['failed_pages'])
+        await submission.acomplete(result)
+        return processed_response(summary, result)
 
+    except PipelineError as e:
+        return JsonResponse(e.payload, status=e.status)
     except Exception as e:
         logger.exception(f"Unexpected error during processing: {e}")
-        return JsonResponse({'error': 'Unexpected error', 'details': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': 'Unexpected error', 'details': str(e)}, status=500)
+    finally:
+        await submission.arelease()
+
+
+# Runs are listed without their OCR text and answers, and resumed from a fresh read of the whole document
+RUN_LIST_PROJECTION = {'extracted_text': 0, 'pages.text': 0, 'questions.answer': 0, 'questions.rubric': 0}
+RUN_FIELDS_PROJECTION = {'usn': 1, 'subject': 1, 'exam_type': 1, 'total': 1}
+
+
+def run_entry(document):
+    results = document.get('results') or {}
+    return {
+        'run_id': document['_id'],
+        'usn': document.get('usn'),
+        'status': document.get('status'),
+        'error': document.get('error'),
+        'attempts': document.get('attempts'),
+        'failed_pages': document.get('failed_pages') or [],
+        'questions': len(document['questions']) if document.get('questions') is not None else None,
+        'graded': sum(outcome.get('status') == 'ok' for outcome in results.values()),
+        'ungradable': sorted(int(qno) for qno, outcome in results.items() if outcome.get('status') == 'final'),
+        'failed_questions': sorted(int(qno) for qno, outcome in results.items() if outcome.get('status') == 'failed'),
+        'notified': document.get('notified', False),
+        'updated_at': document.get('updated_at'),
+    }
+
+
+def resumable_runs_query(subject, exam_type, usns=None):
+    """Runs that stopped part way and can go on without their upload, i.e. whose pages were all read."""
+    # A run still "running" after its submission claim lapsed was left behind by a worker that died
+    abandoned = checkpoints.now() - datetime.timedelta(seconds=settings.SUBMISSION_PENDING_TIMEOUT)
+    query = {
+        'subject': subject,
+        'exam_type': exam_type,
+        # Questions are only parsed once no page is left to read
+        'questions': {'$ne': None},
+        '$or': [{'status': 'failed'}, {'status': 'running', 'updated_at': {'$lt': abandoned}}],
+    }
+    if usns:
+        query['usn'] = {'$in': usns}
+    return query
+
+
+def resume_run(document):
+    """Finish one stored run; returns how it went."""
+    fields = {**run_fields(document), 'fingerprint': document['_id']}
+    outcome = {'run_id': document['_id'], 'usn': document.get('usn')}
+    submission = Submission(submission_keys(None, document['_id']))
+    claimed = submission.claim()
+    if claimed == PENDING:
+        # A retry of the upload is grading it right now
+        return {**outcome, 'status': 'running'}
+    if claimed:
+        # A retry of the upload finished it in the meantime
+        return {**outcome, 'status': 'complete'}
+    try:
+        summary = exam_processing_summary(fields)
+        submission.complete(submission_result(summary['feedback'], summary['failed_pages']))
+        return {**outcome, 'status': 'complete', 'score': summary['score']}
+    except PipelineError as e:
+        return {**outcome, 'status': 'failed', 'error': e.payload['error'],
+                'failed_questions': e.payload.get('failed_questions', [])}
+    except Exception as e:
+        logger.exception(f"Resuming grading run {document['_id']} failed: {e}")
+        return {**outcome, 'status': 'failed', 'error': str(e)}
+    finally:
+        submission.release()
+
+
+@csrf_exempt
+def grading_runs(request):
+    """
+    GET ?subject=&exam_type=[&status=]: every script's grading run for the exam and how far it got.
+    POST {"subject", "exam_type", ["usns"]}: resume the runs that failed part way, grading only
+    their failed and missing questions and storing the feedback that was not stored.
+    """
+    if request.method == 'GET':
+        subject = request.GET.get('subject')
+        exam_type = request.GET.get('exam_type')
+        if not subject or not exam_type:
+            return JsonResponse({'error': 'subject and exam_type are required'}, status=400)
+        query = {'subject': subject, 'exam_type': exam_type}
+        if request.GET.get('status'):
+            query['status'] = request.GET['status']
+        runs = grading_runs_collection.find(query, RUN_LIST_PROJECTION).sort('usn', 1)
+        return JsonResponse({'runs': [run_entry(document) for document in runs]})
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only GET and POST methods are allowed'}, status=405)
+    try:
+        data = loads(request.body)
+        subject = data['subject']
+        exam_type = data['exam_type']
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'error': 'subject and exam_type are required', 'details': str(e)}, status=400)
+
+    documents = list(grading_runs_collection.find(
+        resumable_runs_query(subject, exam_type, data.get('usns')), RUN_FIELDS_PROJECTION))
+    workers = max(1, min(settings.GRADING_RUN_RESUME_WORKERS, len(documents)))
+    with model_priority(priority_from_request(request)), ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each run goes on in a copy of this context so it keeps the request's priority
+        futures = [executor.submit(contextvars.copy_context().run, resume_run, document) for document in documents]
+    outcomes = [future.result() for future in futures]
+    return JsonResponse({
+        'resumed': len(outcomes),
+        'completed': sum(outcome['status'] == 'complete' for outcome in outcomes),
+        'runs': outcomes,
+    })
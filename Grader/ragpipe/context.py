@@ -0,0 +1,103 @@
+"""
+Token-budgeted context for grading prompts.
+
+The search hits are whole textbook pages. They are split into passages of a
+few sentences, passages repeated across hits are dropped, and the passages
+most similar to the query are kept until the token budget is spent. Kept
+passages are written back out in page and reading order.
+"""
+import re
+
+import numpy as np
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9(\["])')
+# Passages this similar to one already chosen add nothing new
+DUPLICATE_SIMILARITY = 0.92
+
+
+def count_tokens(text):
+    # Same rough 4-characters-per-token rule the rate limiter uses
+    return len(text) // 4 + 1
+
+
+def split_passages(text, sentences_per_passage=3):
+    """Split page text into passages of up to sentences_per_passage sentences."""
+    sentences = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = ' '.join(paragraph.split())
+        if paragraph:
+            sentences.extend(s for s in SENTENCE_END.split(paragraph) if s)
+    return [
+        ' '.join(sentences[i:i + sentences_per_passage])
+        for i in range(0, len(sentences), sentences_per_passage)
+    ]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def assemble_context(query, hits, token_budget, encode, sentences_per_passage=3, query_embedding=None):
+    """
+    Build the prompt context for query from hits, a list of
+    {"page_number", "text"} dicts in ranked order. encode maps a list of
+    strings to embeddings. A falsy token_budget keeps the whole pages.
+
+    Returns {"context", "passages", "tokens_used", "tokens_full"} where
+    passages lists the kept {"page_number", "text", "score"} in output order.
+    """
+    full_context = "\n\n".join(f"[Page {hit['page_number']}]: {hit['text']}" for hit in hits)
+    tokens_full = count_tokens(full_context)
+    if not token_budget or tokens_full <= token_budget:
+        return {
+            "context": full_context,
+            "passages": [{"page_number": hit["page_number"], "text": hit["text"], "score": None} for hit in hits],
+            "tokens_used": tokens_full,
+            "tokens_full": tokens_full,
+        }
+
+    # (rank, position on page, page_number, text); the same page can come back twice
+    candidates = []
+    seen = set()
+    for rank, hit in enumerate(hits):
+        for position, passage in enumerate(split_passages(hit["text"], sentences_per_passage)):
+            key = passage.lower()
+            if key not in seen:
+                seen.add(key)
+                candidates.append((rank, position, hit["page_number"], passage))
+
+    if not candidates:
+        return {"context": "", "passages": [], "tokens_used": 0, "tokens_full": tokens_full}
+
+    if query_embedding is None:
+        query_embedding = encode([query])
+    passage_vectors = _normalize(encode([c[3] for c in candidates]))
+    scores = passage_vectors @ _normalize(query_embedding)[0]
+
+    chosen = []
+    tokens_used = 0
+    for i in np.argsort(-scores):
+        # Each passage is written as "[Page n]: text" on its own paragraph
+        rank, position, page_number, passage = candidates[i]
+        cost = count_tokens(f"[Page {page_number}]: {passage}\n\n")
+        if tokens_used + cost > token_budget:
+            continue
+        if chosen and float(np.max(passage_vectors[chosen] @ passage_vectors[i])) >= DUPLICATE_SIMILARITY:
+            continue
+        chosen.append(i)
+        tokens_used += cost
+
+    chosen.sort(key=lambda i: (candidates[i][2], candidates[i][1]))
+    passages = [
+        {"page_number": candidates[i][2], "text": candidates[i][3], "score": float(scores[i])}
+        for i in chosen
+    ]
+    context = "\n\n".join(f"[Page {p['page_number']}]: {p['text']}" for p in passages)
+    return {
+        "context": context,
+        "passages": passages,
+        "tokens_used": count_tokens(context) if context else 0,
+        "tokens_full": tokens_full,
+    }
@@ -0,0 +1,71 @@
+"""
+The sentence embedding model behind /rag/pipeline/ and /rag/search/, on one
+of the CPU runtimes sentence-transformers can drive:
+
+    torch     stock PyTorch
+    onnx      ONNX Runtime; RAG_EMBEDDING_MODEL_FILE picks an exported graph,
+              e.g. onnx/model_qint8_avx512_vnni.onnx for int8 dynamic
+              quantization (see export_quantized())
+    openvino  OpenVINO, with openvino/openvino_model_qint8_quantized.xml as
+              its int8 counterpart
+
+Every backend returns the same 384-dim vectors up to rounding, so indexes
+built with one can be searched with another.
+"""
+import os
+
+from django.conf import settings
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+def load_model(model_name=None, backend=None, model_file=None, threads=None):
+    """A SentenceTransformer for RAG_EMBEDDING_MODEL on the configured backend."""
+    from sentence_transformers import SentenceTransformer
+
+    model_name = model_name or settings.RAG_EMBEDDING_MODEL
+    backend = backend or settings.RAG_EMBEDDING_BACKEND
+    model_file = model_file if model_file is not None else settings.RAG_EMBEDDING_MODEL_FILE
+    threads = threads if threads is not None else settings.RAG_EMBEDDING_THREADS
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+    model_kwargs = {}
+    if backend == 'torch':
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+    else:
+        if model_file:
+            model_kwargs['file_name'] = model_file
+        if backend == 'onnx':
+            import onnxruntime
+
+            session_options = onnxruntime.SessionOptions()
+            session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if threads:
+                session_options.intra_op_num_threads = threads
+                session_options.inter_op_num_threads = 1
+            model_kwargs['provider'] = 'CPUExecutionProvider'
+            model_kwargs['session_options'] = session_options
+        elif threads:
+            model_kwargs['ov_config'] = {'INFERENCE_NUM_THREADS': str(threads)}
+
+    return SentenceTransformer(model_name, device='cpu', backend=backend,
+                               model_kwargs=model_kwargs or None)
+
+
+def export_quantized(directory, quantization_config='avx512_vnni'):
+    """
+    Export RAG_EMBEDDING_MODEL to ONNX with int8 dynamic quantization, for
+    CPUs (or arm64) without a ready-made quantized file on the model hub.
+    Returns the model_name and model_file to load it with, which go into
+    RAG_EMBEDDING_MODEL and RAG_EMBEDDING_MODEL_FILE.
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    model = load_model(backend='onnx', model_file='', threads=0)
+    model.save(directory)
+    export_dynamic_quantized_onnx_model(model, quantization_config, directory)
+    return directory, os.path.join('onnx', f"model_qint8_{quantization_config}.onnx")
@@ -0,0 +1,98 @@
+"""
+FAISS indexes for textbook page embeddings, stored at reduced precision.
+
+    flat  float32 vectors, exact search (384 dims: 1536 bytes per page)
+    fp16  half-precision scalar quantizer (768 bytes per page)
+    sq8   8-bit scalar quantizer (384 bytes per page)
+    pq    product quantizer, one byte per subquantizer (48 bytes per page by
+          default) plus about 400 KB of codebooks, so it pays off only for
+          books of a few thousand pages and more
+
+Quantized indexes also write the float32 vectors to a .npy file next to the
+index. Searches can re-rank their top candidates against it at full
+precision; the file is memory-mapped, so only the candidate rows are read.
+"""
+import math
+
+import faiss
+import numpy as np
+
+QUANTIZATIONS = ('flat', 'fp16', 'sq8', 'pq')
+
+
+def build_index(embeddings, quantization='flat', pq_subquantizers=48):
+    """A trained index holding embeddings, an (n, d) float32 array."""
+    n, d = embeddings.shape
+    if quantization == 'fp16':
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif quantization == 'sq8':
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif quantization == 'pq' and n >= 2:
+        if d % pq_subquantizers:
+            raise ValueError(f"pq_subquantizers must divide the embedding size {d}")
+        # Each subquantizer has at most 256 centroids and needs a training vector per centroid
+        nbits = min(8, int(math.log2(n)))
+        index = faiss.IndexPQ(d, pq_subquantizers, nbits)
+        # A textbook has far fewer pages than faiss asks for per centroid; train on what there is quietly
+        index.pq.cp.min_points_per_centroid = 1
+    elif quantization in QUANTIZATIONS:
+        # Exact search, and the fallback for a PQ index over a single page
+        index = faiss.IndexFlatL2(d)
+    else:
+        raise ValueError(f"Unknown quantization {quantization!r}; expected one of {', '.join(QUANTIZATIONS)}")
+
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def index_bytes(index):
+    """Size of the index as written to disk, close to its resident size once loaded."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def save_index(embeddings, base_name, quantization='flat', pq_subquantizers=48):
+    """
+    Write the index for embeddings to <base_name>_index.faiss. Returns
+    (index_path, vectors_path), where vectors_path is the full-precision copy
+    kept for re-ranking, or None for a flat index.
+    """
+    index = build_index(embeddings, quantization, pq_subquantizers)
+    index_path = f"{base_name}_index.faiss"
+    faiss.write_index(index, index_path)
+
+    vectors_path = None
+    if quantization != 'flat':
+        vectors_path = f"{base_name}_vectors.npy"
+        np.save(vectors_path, embeddings)
+    return index_path, vectors_path
+
+
+def load_vectors(vectors_path):
+    return np.load(vectors_path, mmap_mode='r')
+
+
+def search(index, query_embedding, k, vectors=None, rerank_candidates=0):
+    """
+    index.search(query_embedding, k). With full-precision vectors and
+    rerank_candidates > k, that many candidates are fetched from the index
+    and the best k are picked by exact L2 distance.
+    """
+    if vectors is None or rerank_candidates <= k:
+        return index.search(query_embedding, k)
+
+    _, candidates = index.search(query_embedding, rerank_candidates)
+    distances = np.full((len(query_embedding), k), np.inf, dtype='float32')
+    ids = np.full((len(query_embedding), k), -1, dtype='int64')
+    for row, (query, found) in enumerate(zip(query_embedding, candidates)):
+        found = found[found != -1]
+        if not len(found):
+            continue
+        # Sorted row order reads the memory-mapped file front to back
+        order = np.sort(found)
+        exact = ((np.asarray(vectors[order], dtype='float32') - query) ** 2).sum(axis=1)
+        best = np.argsort(exact)[:k]
+        distances[row, :len(best)] = exact[best]
+        ids[row, :len(best)] = order[best]
+    return distances, ids
@@ -1,25 +1,38 @@
 import os
-import faiss
 import pickle
+import threading
 import requests
-import numpy as np
-import PyPDF2
-import json
 from io import BytesIO
 from urllib.parse import urlparse, unquote
 
-from django.http import JsonResponse
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+from Grader.metrics import timed
+from Grader.responses import JsonResponse, loads
+
 # Load environment variables
 load_dotenv()
 
-# Load embedding model
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+# faiss, numpy, PyPDF2 and sentence_transformers (torch) are imported by the
+# views that use them, so starting a worker does not pay for them
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """The sentence embedding model, loaded on first use."""
+    global _embedding_model
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            from ragpipe.embeddings import load_model
+
+            with timed('embedding_model_load'):
+                _embedding_model = load_model()
+        return _embedding_model
 
 # Utility to extract base filename
 def get_filename_from_path_or_url(path_or_url):
@@ -32,6 +45,8 @@ def get_filename_from_path_or_url(path_or_url):
 
 # Extract text from each PDF page
 def load_pdf_from_stream(pdf_stream):
+    import PyPDF2
+
     pages = []
     try:
         reader = PyPDF2.PdfReader(pdf_stream)
@@ -44,20 +59,23 @@ def load_pdf_from_stream(pdf_stream):
     return pages
 
 # Embed text and save FAISS index + metadata
-def embed_pages_and_save(pages, base_name):
+def embed_pages_and_save(pages, base_name, quantization=None):
+    import numpy as np
+    from ragpipe.indexing import save_index
+
     texts = [p["text"] for p in pages]
-    embeddings = embedding_model.encode(texts, show_progress_bar=True)
+    with timed('embedding'):
+        embeddings = get_embedding_model().encode(
+            texts, batch_size=settings.RAG_EMBEDDING_BATCH_SIZE, show_progress_bar=True)
     embeddings = np.array(embeddings).astype("float32")
 
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
+    quantization = quantization or settings.RAG_INDEX_QUANTIZATION
+    index_path, vectors_path = save_index(
+        embeddings, base_name, quantization, pq_subquantizers=settings.RAG_PQ_SUBQUANTIZERS)
 
-    index_path = f"{base_name}_index.faiss"
     meta_path = f"{base_name}_meta.pkl"
-
-    faiss.write_index(index, index_path)
     with open(meta_path, "wb") as f:
-        pickle.dump({"texts": texts, "pages": pages}, f)
+        pickle.dump({"texts": texts, "pages": pages, "quantization": quantization, "vectors_file": vectors_path}, f)
 
     return index_path, meta_path
 
@@ -65,18 +83,27 @@ def embed_pages_and_save(pages, base_name):
 @csrf_exempt
 @require_POST
 def ragify_pdf_view(request):
+    from ragpipe.indexing import QUANTIZATIONS
+
     try:
         if request.content_type == "application/json":
-            body = json.loads(request.body)
+            body = loads(request.body)
             pdf_url = body.get("pdf_url")
             pdf_file = None
+            quantization = body.get("quantization")
         else:
             pdf_url = request.POST.get("pdf_url")
             pdf_file = request.FILES.get("pdf_file")
+            quantization = request.POST.get("quantization")
 
         if not pdf_url and not pdf_file:
             return JsonResponse({"error": "Provide either 'pdf_url' or upload a 'pdf_file'."}, status=400)
 
+        if quantization and quantization not in QUANTIZATIONS:
+            return JsonResponse({
+                "error": f"'quantization' must be one of {', '.join(QUANTIZATIONS)}."
+            }, status=400)
+
         if pdf_url:
             response = requests.get(pdf_url)
             response.raise_for_status()
@@ -87,7 +114,7 @@ def ragify_pdf_view(request):
             base_name = os.path.splitext(pdf_file.name)[0]
 
         pages = load_pdf_from_stream(pdf_stream)
-        index_path, meta_path = embed_pages_and_save(pages, base_name)
+        index_path, meta_path = embed_pages_and_save(pages, base_name, quantization)
 
         return JsonResponse({
             "status": "success",
@@ -102,16 +129,25 @@ def ragify_pdf_view(request):
 @csrf_exempt
 @require_POST
 def similarity_search_view(request):
+    import faiss
+    import numpy as np
+    from ragpipe.context import assemble_context
+    from ragpipe.indexing import load_vectors, search
+
     try:
         if request.content_type == "application/json":
-            body = json.loads(request.body)
+            body = loads(request.body)
             query = body.get("query")
             index_file = body.get("index_file")
             meta_file = body.get("meta_file")
+            token_budget = body.get("token_budget", settings.RAG_CONTEXT_TOKEN_BUDGET)
+            rerank = body.get("rerank_candidates", settings.RAG_RERANK_CANDIDATES)
         else:
             query = request.POST.get("query")
             index_file = request.POST.get("index_file")
             meta_file = request.POST.get("meta_file")
+            token_budget = request.POST.get("token_budget", settings.RAG_CONTEXT_TOKEN_BUDGET)
+            rerank = request.POST.get("rerank_candidates", settings.RAG_RERANK_CANDIDATES)
 
         if not query or not index_file or not meta_file:
             return JsonResponse({
@@ -121,27 +157,49 @@ def similarity_search_view(request):
         if not os.path.exists(index_file) or not os.path.exists(meta_file):
             return JsonResponse({"error": "Index or metadata file not found."}, status=404)
 
-        index = faiss.read_index(index_file)
-        with open(meta_file, "rb") as f:
-            meta = pickle.load(f)
+        with timed('faiss_load'):
+            index = faiss.read_index(index_file)
+            with open(meta_file, "rb") as f:
+                meta = pickle.load(f)
 
         pages = meta["pages"]
-        query_embedding = embedding_model.encode([query])
+        # Quantized indexes keep a full-precision copy of the vectors for re-ranking
+        vectors_file = meta.get("vectors_file")
+        vectors = load_vectors(vectors_file) if vectors_file and os.path.exists(vectors_file) else None
+        embedding_model = get_embedding_model()
+        with timed('embedding'):
+            query_embedding = embedding_model.encode([query])
         query_embedding = np.array(query_embedding).astype("float32")
 
-        D, I = index.search(query_embedding, 5)
+        with timed('faiss_search'):
+            D, I = search(index, query_embedding, 5, vectors, int(rerank or 0))
 
-        results = []
+        hits = []
         for idx, distance in zip(I[0], D[0]):
             if idx != -1:
-                page_data = pages[idx]
-                results.append({
-                    "page_number": page_data["page_number"],
-                    "text": page_data["text"],
-                    "similarity_score": float(distance)
-                })
-
-        return JsonResponse({"query": query, "results": results})
+                hits.append({**pages[idx], "similarity_score": float(distance)})
+
+        # Trim the pages to the passages that fit the budget; 0 or null returns whole pages
+        with timed('rag_context'):
+            assembled = assemble_context(
+                query, hits, int(token_budget or 0), embedding_model.encode,
+                sentences_per_passage=settings.RAG_CONTEXT_SENTENCES_PER_PASSAGE,
+                query_embedding=query_embedding
+            )
+
+        scores = {hit["page_number"]: hit["similarity_score"] for hit in hits}
+        results = [
+            {**passage, "similarity_score": scores[passage["page_number"]]}
+            for passage in assembled["passages"]
+        ]
+
+        return JsonResponse({
+            "query": query,
+            "results": results,
+            "context": assembled["context"],
+            "tokens_used": assembled["tokens_used"],
+            "tokens_full": assembled["tokens_full"]
+        })
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)